@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Compare chunked storage (core.chunkedStorage) with plain loose objects.
+
+Write successive revisions of a big blob, each one a few small edits
+away from the previous one, to a repository storing them whole and to
+one storing them in chunks. Report the write speed and the space taken
+by each, and the dedup ratio of the chunked one.
+
+    python benchmarks/chunked.py [--size MB] [--revisions N] [--edits N] [--json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from repository.repofun import repo_create
+from repository.GitRepository import GitRepository
+from repository.objects import GitBlob
+from repository.object_fun import object_write
+
+
+def revisions(size, count, edits, seed=0):
+    """count revisions of size random bytes, each with edits small
+    inserts, deletions or overwrites from the previous one."""
+    rng = random.Random(seed)
+    data = bytearray(rng.randbytes(size))
+    for _ in range(count):
+        yield bytes(data)
+        for _ in range(edits):
+            pos = rng.randrange(len(data))
+            kind = rng.randrange(3)
+            if kind == 0:
+                data[pos:pos] = rng.randbytes(rng.randrange(1, 100))
+            elif kind == 1:
+                del data[pos:pos + rng.randrange(1, 100)]
+            else:
+                data[pos:pos + 8] = rng.randbytes(8)
+
+
+def disk_usage(path):
+    return sum(os.path.getsize(os.path.join(top, name))
+               for top, _, files in os.walk(path) for name in files)
+
+
+def store(path, blobs, chunked):
+    """Write blobs to a new repository at path. Return the time taken and
+    the size of its object store."""
+    repo_create(path)
+    if chunked:
+        repo = GitRepository(path)
+        repo.conf.set("core", "chunkedStorage", "true")
+        with open(os.path.join(path, ".git", "config"), "w") as f:
+            repo.conf.write(f)
+    repo = GitRepository(path)
+
+    start = time.perf_counter()
+    for data in blobs:
+        object_write(GitBlob(data), repo)
+    return time.perf_counter() - start, disk_usage(os.path.join(path, ".git", "objects"))
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description="Compare chunked storage with loose objects")
+    parser.add_argument("--size", type=int, default=64, help="Size of the blob, in MB")
+    parser.add_argument("--revisions", type=int, default=10, help="Number of revisions written")
+    parser.add_argument("--edits", type=int, default=5, help="Edits between revisions")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args(argv)
+
+    blobs = list(revisions(args.size * 1024 * 1024, args.revisions, args.edits))
+    total = sum(len(data) for data in blobs)
+    results = {}
+    tmp = tempfile.mkdtemp()
+    try:
+        for mode in ("loose", "chunked"):
+            elapsed, size = store(os.path.join(tmp, mode), blobs, mode == "chunked")
+            results[mode] = {"seconds": elapsed, "mb_per_s": total / elapsed / 1024 / 1024,
+                             "stored_bytes": size, "dedup_ratio": total / size}
+    finally:
+        shutil.rmtree(tmp)
+
+    if args.json:
+        print(json.dumps({"revisions": len(blobs), "bytes": total, "results": results}, indent=2))
+        return
+
+    print(f"{len(blobs)} revisions of {args.size} MB, {args.edits} edits apart: {total / 1024 / 1024:.0f} MiB")
+    print("mode         MB/s   stored MiB   dedup")
+    for mode, res in results.items():
+        print(f"{mode:8} {res["mb_per_s"]:8.1f} {res["stored_bytes"] / 1024 / 1024:12.1f} "
+              f"{res["dedup_ratio"]:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Compare the zlib levels on a sample of a repository's objects.
+
+For each level, compress the sampled objects the way loose objects are
+stored (header and payload) and report the speed and the size ratio, to
+pick core.looseCompression / pack.compression from data.
+
+    python benchmarks/compression.py [-C REPO] [--sample N] [--levels 1,6,9] [--json]
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from repository.repofun import repo_find
+from repository.packfile import repo_packs
+from repository.object_fun import loose_objects, object_read_raw
+
+
+def object_shas(repo):
+    """The shas of all the objects of repo, loose and packed."""
+    shas = set(loose_objects(repo))
+    for pack in repo_packs(repo):
+        shas.update(sha.hex() for sha in pack.index.shas())
+    return sorted(shas)
+
+
+def sample_objects(repo, count, seed=0):
+    """The raw loose form (header and payload) of count objects of repo,
+    picked at random, but the same ones from run to run."""
+    shas = object_shas(repo)
+    shas = random.Random(seed).sample(shas, min(count, len(shas)))
+    objects = []
+    for sha in shas:
+        fmt, data = object_read_raw(repo, sha)
+        objects.append(fmt + b' ' + str(len(data)).encode() + b'\x00' + data)
+    return objects
+
+
+def measure(objects, level, repeat=3):
+    """Best time to compress all of objects at level, and their
+    compressed size."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = sum(len(zlib.compress(raw, level)) for raw in objects)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, size
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description="Compare zlib levels on a repository's objects")
+    parser.add_argument("-C", dest="path", default=".", help="The repository (default: the current one)")
+    parser.add_argument("--sample", type=int, default=2000, help="Number of objects to sample")
+    parser.add_argument("--levels", default="0,1,2,3,4,5,6,7,8,9",
+                        help="Comma separated levels to compare")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args(argv)
+
+    repo = repo_find(args.path)
+    objects = sample_objects(repo, args.sample)
+    total = sum(len(raw) for raw in objects)
+    if not total:
+        raise Exception("No objects to sample")
+
+    results = []
+    for level in [int(level) for level in args.levels.split(",")]:
+        elapsed, size = measure(objects, level)
+        results.append({"level": level,
+                        "mb_per_s": total / max(elapsed, 1e-9) / 1024 / 1024,
+                        "ratio": size / total})
+
+    if args.json:
+        print(json.dumps({"objects": len(objects), "bytes": total, "levels": results}, indent=2))
+        return
+
+    print(f"{len(objects)} objects, {total / 1024 / 1024:.2f} MiB")
+    print("level      MB/s   ratio")
+    for res in results:
+        print(f"{res["level"]:5} {res["mb_per_s"]:9.1f}  {res["ratio"]:6.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Run the benchmarks of benchmarks/suite.py, and compare them with a baseline.
+
+    python benchmarks/run.py [-k PATTERN] [--large] [-r REPEAT] [--json FILE]
+                             [--baseline FILE] [--threshold RATIO] [--save-baseline]
+
+Each benchmark is timed REPEAT times, keeping the best and median times.
+The results are compared with the baseline (benchmarks/baseline.json by
+default): a benchmark whose best time is more than THRESHOLD slower than
+its baseline one is a regression, and the exit status is 1. Baselines
+are only meaningful on the machine that made them: save a new one with
+--save-baseline after changing machines.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import statistics
+
+from suite import BENCHMARKS
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def measure(fn, repeat):
+    """Set fn up in a scratch directory and time it repeat times."""
+    tmp = tempfile.mkdtemp()
+    try:
+        run, ops, nbytes = fn(tmp)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+    finally:
+        shutil.rmtree(tmp)
+
+    best = min(times)
+    result = {"best": best, "median": statistics.median(times), "ops_per_s": ops / best}
+    if nbytes:
+        result["mb_per_s"] = nbytes / best / 1024 / 1024
+    return result
+
+
+def compare(results, baseline, threshold):
+    """Print how results compare with baseline. Return the names of the
+    regressions."""
+    regressions = []
+    for name, res in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:32} {res["best"] * 1000:10.2f} ms   (not in the baseline)")
+            continue
+        ratio = res["best"] / base["best"]
+        verdict = ""
+        if ratio > 1 + threshold:
+            verdict = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            verdict = "faster"
+        print(f"{name:32} {res["best"] * 1000:10.2f} ms  {ratio:6.2f}x baseline  {verdict}")
+    return regressions
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description="Run the object store benchmarks")
+    parser.add_argument("-k", dest="pattern", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--large", action="store_true", help="Also run the large benchmarks (1GB blobs, 100k files)")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Times each benchmark is run")
+    parser.add_argument("--json", metavar="FILE", help="Write the results to FILE as JSON")
+    parser.add_argument("--baseline", default=BASELINE, help="Baseline to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Slowdown from the baseline counted as a regression (default: 0.25)")
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the baseline")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, large, fn in BENCHMARKS:
+        if args.pattern not in name or (large and not args.large):
+            continue
+        results[name] = measure(fn, args.repeat)
+        res = results[name]
+        rate = f"{res["mb_per_s"]:10.1f} MB/s" if "mb_per_s" in res else f"{res["ops_per_s"]:10.0f} ops/s"
+        print(f"{name:32} best {res["best"] * 1000:10.2f} ms  median {res["median"] * 1000:10.2f} ms  {rate}",
+              flush=True)
+
+    report = {"python": platform.python_version(), "machine": platform.machine(),
+              "repeat": args.repeat, "results": results}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        # Keep the baseline of the benchmarks not run this time
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)["results"]
+        report["results"] = baseline | results
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    print(f"\nCompared with {args.baseline} (threshold {args.threshold:.0%}):")
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {", ".join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Measure how long mygit takes to start.
+
+For each command, time the whole process (wall-clock, best and median
+of several runs) and break its imports down with python -X importtime.
+
+    python benchmarks/startup.py [-n RUNS] [--top N] [--json]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MYGIT = os.path.join(ROOT, "mygit")
+
+# Commands doing (almost) nothing, so their time is startup: show-ref in
+# an empty repository lists no refs, and init creates one. Each is
+# (arguments, whether it runs in a new empty directory every time).
+COMMANDS = [(["show-ref"], False), (["init", "."], True), (["--help"], False)]
+
+
+def timed(cmd, cwd=None):
+    """Run cmd, return its wall-clock time."""
+    start = time.perf_counter()
+    subprocess.run(cmd, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def run(args, cwd, importtime=False, fresh=False):
+    """Run mygit with args in cwd, or in a new directory under it if
+    fresh. Return the wall-clock time and stderr."""
+    if fresh:
+        cwd = tempfile.mkdtemp(dir=cwd)
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + [MYGIT] + args
+    start = time.perf_counter()
+    res = subprocess.run(cmd, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    elapsed = time.perf_counter() - start
+    # A failing command would time its error path
+    if res.returncode != 0:
+        raise Exception(f"mygit {" ".join(args)} failed: {res.stderr.decode()}")
+    return elapsed, res.stderr.decode()
+
+
+def parse_importtime(stderr):
+    """Parse -X importtime output into a list of (module, self, cumulative),
+    in microseconds."""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(own), int(cumulative)))
+    return modules
+
+
+def measure(args, fresh, cwd, runs, top):
+    times = [run(args, cwd, fresh=fresh)[0] for _ in range(runs)]
+    modules = parse_importtime(run(args, cwd, importtime=True, fresh=fresh)[1])
+    return {
+        "command": " ".join(args),
+        "best_ms": min(times) * 1000,
+        "median_ms": statistics.median(times) * 1000,
+        "modules": len(modules),
+        "import_ms": sum(m[1] for m in modules) / 1000,
+        "slowest": [{"module": name, "self_ms": own / 1000}
+                    for name, own, _ in sorted(modules, key=lambda m: -m[1])[:top]],
+    }
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description="Measure mygit's startup time")
+    parser.add_argument("-n", "--runs", type=int, default=20, help="Runs of each command")
+    parser.add_argument("--top", type=int, default=5, help="Slowest imports to show")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args(argv)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        run(["init", "."], tmp)
+        # The interpreter alone, to tell what mygit adds to it
+        bare = min(timed([sys.executable, "-c", "pass"]) for _ in range(args.runs)) * 1000
+        results = [measure(command, fresh, tmp, args.runs, args.top) for command, fresh in COMMANDS]
+    finally:
+        shutil.rmtree(tmp)
+
+    if args.json:
+        print(json.dumps({"python_ms": bare, "commands": results}, indent=2))
+        return
+
+    print(f"python -c pass: {bare:.1f} ms")
+    for res in results:
+        print(f"\nmygit {res["command"]}: best {res["best_ms"]:.1f} ms, median {res["median_ms"]:.1f} ms, "
+              f"{res["modules"]} modules imported in {res["import_ms"]:.1f} ms")
+        for slow in res["slowest"]:
+            print(f"    {slow["self_ms"]:7.2f} ms  {slow["module"]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""The benchmarks of the object store hot paths, run by benchmarks/run.py.
+
+Each benchmark is a function registered with @benchmark. Given a scratch
+directory, it sets up what it needs (untimed) and returns the function
+to time, with the number of operations and of bytes a call of it does,
+for the rates.
+"""
+import io
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from repository import repofun
+from repository.repofun import repo_create, repo_find
+from repository.objects import GitBlob, GitTree, GitCommit
+from repository.object_fun import object_write, object_read
+from repository.add import add
+from repository.status import status
+from repository.packfile import pack_find, repo_packs
+from repository.repack import repack, midx_write
+from repository.object_filter import object_filter_load
+
+KB = 1024
+MB = 1024 * KB
+GB = 1024 * MB
+
+# Every benchmark: (name, large, function)
+BENCHMARKS = []
+
+
+def benchmark(name, large=False):
+    """Register a benchmark. Large ones need minutes or gigabytes, and
+    only run when asked for."""
+    def register(fn):
+        BENCHMARKS.append((name, large, fn))
+        return fn
+    return register
+
+
+def size_name(size):
+    for unit, name in [(GB, "GB"), (MB, "MB"), (KB, "KB")]:
+        if size >= unit:
+            return f"{size // unit}{name}"
+    return f"{size}B"
+
+
+def blob_data(size):
+    """size bytes compressing about like source code: half random, half
+    repeated."""
+    half = os.urandom(size // 2)
+    return half + half[:size - len(half)]
+
+
+# Blobs of each size written or read by a call, so that small ones are
+# timed over enough work
+def _blobs_per_call(size):
+    return max(1, 4 * MB // size)
+
+
+def _blob_benchmarks(size, large):
+    count = _blobs_per_call(size)
+
+    @benchmark(f"object_write/{size_name(size)}", large)
+    def write(tmp):
+        repo = repo_create(tmp)
+        data = bytearray(blob_data(size))
+        calls = [0]
+
+        def run():
+            # Blobs already stored aren't written again: make each one new
+            calls[0] += 1
+            for i in range(count):
+                data[:16] = f"{calls[0]:08x}{i:08x}".encode()
+                object_write(GitBlob(bytes(data)), repo)
+        return run, count, count * size
+
+    @benchmark(f"object_read/{size_name(size)}", large)
+    def read(tmp):
+        repo = repo_create(tmp)
+        data = bytearray(blob_data(size))
+        shas = []
+        for i in range(count):
+            data[:8] = f"{i:08x}".encode()
+            shas.append(object_write(GitBlob(bytes(data)), repo))
+
+        def run():
+            # Time the reads from disk, not from the object cache
+            repo.object_cache.clear()
+            for sha in shas:
+                object_read(repo, sha)
+        return run, count, count * size
+
+
+for size, large in [(1 * KB, False), (64 * KB, False), (1 * MB, False), (16 * MB, False),
+                    (256 * MB, True), (1 * GB, True)]:
+    _blob_benchmarks(size, large)
+
+
+def _repo_find_benchmarks(depth):
+    @benchmark(f"repo_find/depth{depth}/cold")
+    def cold(tmp):
+        repo_create(tmp)
+        nested = os.path.join(tmp, *[f"d{i}" for i in range(depth)])
+        os.makedirs(nested, exist_ok=True)
+
+        def run():
+            for _ in range(100):
+                repofun._find_cache.clear()
+                repofun._repo_cache.clear()
+                repo_find(nested)
+        return run, 100, 0
+
+    @benchmark(f"repo_find/depth{depth}/cached")
+    def cached(tmp):
+        repo_create(tmp)
+        nested = os.path.join(tmp, *[f"d{i}" for i in range(depth)])
+        os.makedirs(nested, exist_ok=True)
+
+        def run():
+            for _ in range(1000):
+                repo_find(nested)
+        return run, 1000, 0
+
+
+for depth in [0, 8, 32]:
+    _repo_find_benchmarks(depth)
+
+
+@benchmark("parse/tree")
+def parse_tree(tmp):
+    # A tree of 1000 files and 100 directories, like a big source directory
+    entries = [(b'100644', f"file{i:04}.py".encode()) for i in range(1000)]
+    entries += [(b'40000', f"dir{i:03}".encode()) for i in range(100)]
+    data = b''.join(mode + b' ' + name + b'\x00' + os.urandom(20)
+                    for mode, name in sorted(entries, key=lambda e: e[1]))
+
+    def run():
+        for _ in range(100):
+            tree = GitTree(data)
+            for leaf in tree:
+                pass
+            tree.find(b'file0500.py')
+    return run, 100, 100 * len(data)
+
+
+@benchmark("parse/commit")
+def parse_commit(tmp):
+    data = (b"tree " + b"1" * 40 + b"\n"
+            b"parent " + b"2" * 40 + b"\n"
+            b"parent " + b"3" * 40 + b"\n"
+            b"author A U Thor <author@example.com> 1700000000 +0100\n"
+            b"committer C O Mitter <committer@example.com> 1700000000 +0100\n"
+            b"\n"
+            b"Merge branch 'topic'\n\n" + b"A longer description of the change.\n" * 10)
+
+    def run():
+        for _ in range(10000):
+            commit = GitCommit(data)
+            commit.parents()
+            commit.tree()
+    return run, 10000, 10000 * len(data)
+
+
+def _status_benchmark(files, large):
+    @benchmark(f"status/{files // 1000}k", large)
+    def run_status(tmp):
+        repo = repo_create(tmp)
+        # 100 files per directory, 100 directories per directory
+        for i in range(files):
+            directory = os.path.join(tmp, f"a{i // 10000}", f"b{i // 100 % 100}")
+            if i % 100 == 0:
+                os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f"f{i % 100}.txt"), "w") as f:
+                f.write(f"file {i}\n")
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            add(repo, ["."])
+        finally:
+            os.chdir(cwd)
+        # The first status refreshes the index, the timed ones find it clean
+        status(repo, out=io.StringIO())
+
+        def run():
+            status(repo, out=io.StringIO())
+        return run, files, 0
+
+
+_status_benchmark(10000, False)
+_status_benchmark(100000, True)
+
+
+def _many_packs(tmp, packs=16, objects=500):
+    """A repository with packs of objects blobs each."""
+    repo = repo_create(tmp)
+    for i in range(packs):
+        for j in range(objects):
+            object_write(GitBlob(f"pack {i} object {j}\n".encode()), repo)
+        repack(repo, window=0, jobs=1)
+    return repo
+
+def _lookup_benchmark(name, setup, lookup):
+    @benchmark(name)
+    def run_lookups(tmp):
+        repo = _many_packs(tmp)
+        context = setup(repo)
+        repo_packs(repo, rescan=True)
+        # Objects that aren't there: every pack has to say so
+        misses = [os.urandom(20) for _ in range(10000)]
+
+        def run():
+            for sha in misses:
+                lookup(repo, context, sha)
+        return run, len(misses), 0
+
+_lookup_benchmark("pack_find/miss/16packs", lambda repo: None,
+                  lambda repo, _, sha: pack_find(repo, sha))
+_lookup_benchmark("pack_find/miss/16packs-midx", midx_write,
+                  lambda repo, _, sha: pack_find(repo, sha))
+_lookup_benchmark("object_filter/miss", object_filter_load,
+                  lambda repo, fltr, sha: sha.hex() in fltr)
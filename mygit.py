@@ -1,35 +1,232 @@
-import argparse
-from datetime import datetime
 import sys
 
-# My modules
-from utils.argparser_def import define_argparser
-from utils.path import *
-from repository.repofun import repo_create
+# My modules. The repository modules are imported by the commands that
+# use them, so a command only pays for loading what it runs
+from utils.argparser_def import define_argparser, command_of
 
-argparser = define_argparser()
+# The parser main built, for the usage errors of the commands
+argparser = None
+
+def cmd_add(args):
+    from repository.repofun import repo_find
+    from repository.add import add
+    repo = repo_find()
+    add(repo, args.path, jobs=args.jobs)
 
 def cmd_init(args):
+    from repository.repofun import repo_create
     repo_create(args.path)
 
+def cmd_cat_file(args):
+    from repository.repofun import repo_find, cat_file, cat_file_batch
+    if args.batch:
+        if args.show or args.type is not None:
+            argparser.error(f"cat-file --batch{"" if args.batch == "contents" else "-check"} takes no arguments")
+        repo = repo_find()
+        cat_file_batch(repo, sys.stdin, contents=args.batch == "contents", buffer=args.buffer)
+        return
+
+    if args.show:
+        if args.object is not None or args.type is None:
+            argparser.error(f"cat-file -{args.show[0]} takes exactly one object")
+        name, fmt = args.type, None
+    else:
+        if args.object is None:
+            argparser.error("cat-file needs a type and an object")
+        if args.type not in ["blob", "commit", "tag", "tree"]:
+            argparser.error(f"invalid object type {args.type}")
+        name, fmt = args.object, args.type.encode()
+
+    repo = repo_find()
+    cat_file(repo, name, fmt=fmt, show=args.show)
+
+def cmd_check_ignore(args):
+    from repository.repofun import repo_find
+    from repository.ignore import check_ignore
+    if args.stdin == bool(args.path):
+        argparser.error("check-ignore needs either paths or --stdin")
+
+    repo = repo_find()
+    check_ignore(repo, sys.stdin if args.stdin else args.path)
+
+def cmd_checkout(args):
+    from repository.repofun import repo_find
+    from repository.checkout import checkout
+    repo = repo_find()
+    stats = checkout(repo, args.commit, force=args.force, jobs=args.jobs)
+    if stats["branch"]:
+        print(f"Switched to branch '{stats["branch"]}'")
+    else:
+        print(f"HEAD is now at {stats["commit"][:7]}")
+
+    if args.timings:
+        print(f"Wrote {stats["written"]} files, removed {stats["removed"]}, "
+              f"left {stats["unchanged"]} unchanged")
+        for phase, elapsed in stats["timings"].items():
+            print(f"{phase:>8}: {elapsed * 1000:.1f} ms")
+
+def cmd_commit_graph(args):
+    from repository.repofun import repo_find
+    from repository.commit_graph import commit_graph_write
+    repo = repo_find()
+    count = commit_graph_write(repo)
+    print(f"Wrote the commit-graph of {count} commits")
+
+def cmd_multi_pack_index(args):
+    from repository.repofun import repo_find
+    from repository.repack import midx_write
+    repo = repo_find()
+    count = midx_write(repo)
+    print(f"Wrote the multi-pack-index of {count} objects")
+
+def cmd_hash_object(args):
+    from repository.repofun import repo_find, hash_object
+    if args.stdin == (args.path is not None):
+        argparser.error("hash-object needs either a file or --stdin")
+
+    repo = repo_find() if args.write else None
+    sha = hash_object(None if args.stdin else args.path, args.type.encode(), repo)
+    print(sha)
+
+def cmd_log(args):
+    from repository.repofun import repo_find
+    from repository.history import log, commit_resolve
+    repo = repo_find()
+    starts = [commit_resolve(repo, name) for name in args.commit]
+    log(repo, starts, max_count=args.max_count, oneline=args.oneline)
+
+def cmd_ls_files(args):
+    from repository.repofun import repo_find
+    from repository.status import ls_files
+    repo = repo_find()
+    ls_files(repo, stage=args.stage)
+
+def cmd_ls_tree(args):
+    from repository.repofun import repo_find
+    from repository.tree import ls_tree
+    repo = repo_find()
+    ls_tree(repo, args.tree, recursive=args.recursive)
+
+def cmd_merge_base(args):
+    from repository.repofun import repo_find
+    from repository.history import merge_bases, commit_resolve
+    repo = repo_find()
+    one, two = [commit_resolve(repo, name) for name in args.commit]
+    bases = merge_bases(repo, one, two)
+    for sha in bases if args.all else bases[:1]:
+        print(sha)
+
+def cmd_rev_list(args):
+    from repository.repofun import repo_find
+    from repository.history import rev_list, rev_list_args
+    repo = repo_find()
+    include, exclude = rev_list_args(repo, args.commit)
+    commits = rev_list(repo, include, exclude)[:args.max_count]
+    if args.count:
+        print(len(commits))
+    else:
+        for sha in commits:
+            print(sha)
+
+def cmd_rev_parse(args):
+    from repository.repofun import repo_find, rev_parse
+    if args.stdin == bool(args.name):
+        argparser.error("rev-parse needs either names or --stdin")
+
+    repo = repo_find()
+    fmt = args.type.encode() if args.type else None
+    rev_parse(repo, sys.stdin if args.stdin else args.name, fmt=fmt, batch=args.stdin)
+
+def cmd_show_ref(args):
+    from repository.repofun import repo_find
+    from repository.ref_fun import show_ref
+    repo = repo_find()
+    show_ref(repo, args.pattern, heads=args.heads, tags=args.tags, dereference=args.dereference)
+
+def cmd_status(args):
+    from repository.repofun import repo_find
+    from repository.status import status
+    repo = repo_find()
+    status(repo, short=args.short, jobs=args.jobs)
+
+def cmd_pack_refs(args):
+    from repository.repofun import repo_find
+    from repository.ref_fun import pack_refs
+    repo = repo_find()
+    pack_refs(repo, all=args.all)
+
+def cmd_repack(args):
+    import os
+    from repository.repofun import repo_find
+    from repository.repack import repack, midx_write
+    from repository.packfile import midx_path
+    from repository.ref_fun import pack_refs
+    from repository.commit_graph import commit_graph_write
+    from repository.object_filter import object_filter_write
+    repo = repo_find()
+    stats = repack(repo, window=args.window, depth=args.depth, jobs=args.jobs)
+    if args.command == "gc":
+        pack_refs(repo, all=True)
+        commit_graph_write(repo)
+        midx_write(repo)
+        object_filter_write(repo)
+    elif stats["pack"] and os.path.exists(midx_path(repo)):
+        # Keep the multi-pack-index covering all the packs
+        midx_write(repo)
+
+    if not stats["pack"]:
+        print("Nothing new to pack.")
+        return
+
+    ratio = stats["pack_bytes"] / stats["loose_bytes"] if stats["loose_bytes"] else 0
+    elapsed = max(stats["time"], 1e-6)
+    print(f"Packed {stats["objects"]} objects ({stats["deltas"]} deltas) into {stats["pack"]}.pack")
+    print(f"Loose objects: {stats["loose_bytes"]} bytes, pack: {stats["pack_bytes"]} bytes "
+          f"({ratio:.1%} of the loose size)")
+    print(f"Took {elapsed:.2f}s: {stats["objects"] / elapsed:.0f} objects/s, "
+          f"{stats["object_bytes"] / elapsed / 1024 / 1024:.2f} MiB/s")
+
+def cmd_tag(args):
+    from repository.repofun import repo_find
+    from repository.ref_fun import tag_list, tag_create
+    repo = repo_find()
+    if args.name:
+        tag_create(repo, args.name, args.object)
+    else:
+        tag_list(repo)
+
 def main(argv=sys.argv[1:]):
+    global argparser
+    # Only the subparser of the command run is built, unless there's
+    # none to run and argparse has to list them all
+    argparser = define_argparser(command_of(argv))
     args = argparser.parse_args(argv)
+    if args.profile or args.profile_output:
+        from utils import trace
+        trace.enable(profile_output=args.profile_output)
     match args.command:
-        # case "add"          : cmd_add(args)
-        # case "cat-file"     : cmd_cat_file(args)
-        # case "check-ignore" : cmd_check_ignore(args)
-        # case "checkout"     : cmd_checkout(args)
+        case "add"          : cmd_add(args)
+        case "cat-file"     : cmd_cat_file(args)
+        case "check-ignore" : cmd_check_ignore(args)
+        case "checkout"     : cmd_checkout(args)
         # case "commit"       : cmd_commit(args)
-        # case "hash-object"  : cmd_hash_object(args)
+        case "commit-graph" : cmd_commit_graph(args)
+        case "hash-object"  : cmd_hash_object(args)
+        case "gc"           : cmd_repack(args)
         case "init"         : cmd_init(args)
-        # case "log"          : cmd_log(args)
-        # case "ls-files"     : cmd_ls_files(args)
-        # case "ls-tree"      : cmd_ls_tree(args)
-        # case "rev-parse"    : cmd_rev_parse(args)
+        case "log"          : cmd_log(args)
+        case "ls-files"     : cmd_ls_files(args)
+        case "ls-tree"      : cmd_ls_tree(args)
+        case "merge-base"   : cmd_merge_base(args)
+        case "multi-pack-index": cmd_multi_pack_index(args)
+        case "pack-refs"    : cmd_pack_refs(args)
+        case "repack"       : cmd_repack(args)
+        case "rev-list"     : cmd_rev_list(args)
+        case "rev-parse"    : cmd_rev_parse(args)
         # case "rm"           : cmd_rm(args)
-        # case "show-ref"     : cmd_show_ref(args)
-        # case "status"       : cmd_status(args)
-        # case "tag"          : cmd_tag(args)
+        case "show-ref"     : cmd_show_ref(args)
+        case "status"       : cmd_status(args)
+        case "tag"          : cmd_tag(args)
         case _              : print("Bad command.")
 
 
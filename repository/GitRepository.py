@@ -1,5 +1,19 @@
+import contextlib
 import configparser
 from utils.path import *
+from utils.lru import ByteLRU
+from utils.config import conf_size, conf_compression
+from utils import trace
+from .write_batch import WriteBatch
+
+# Default budget of the parsed object cache (core.objectCacheLimit)
+DEFAULT_OBJECT_CACHE_LIMIT = 64 * 1024 * 1024
+# Blobs from this size go to chunked storage, if core.chunkedStorage
+# (core.chunkedStorageThreshold)
+DEFAULT_CHUNKED_THRESHOLD = 1024 * 1024
+# Blobs bigger than this aren't cached (core.objectCacheBlobLimit): they're
+# rarely read twice, and would push everything else out
+DEFAULT_OBJECT_CACHE_BLOB_LIMIT = 1024 * 1024
 
 
 class GitRepository (object):
@@ -8,11 +22,37 @@ class GitRepository (object):
     worktree = None
     gitdir = None
     conf = None
+    # Packs opened so far, and mtime of objects/pack when they were listed
+    packs = None
+    packs_mtime = None
+    # Opened multi-pack-index, the packs it covers and the others, if any
+    midx = None
+    # Opened commit-graph, with the stat data of its file
+    commit_graph = None
+    # Object filter, with the stat data of its file and where the
+    # reading of its log ended, see object_filter_load
+    object_filter = None
+    # Sorted shas of the loose objects and chunked blobs, to resolve short
+    # shas, and the mtimes of the fan-out directories listed into it
+    loose_names = None
+    loose_fanouts = None
+    # Parsed objects by sha, see object_read
+    object_cache = None
+    object_cache_blob_limit = None
+    # zlib levels of loose objects and of packs
+    loose_compression = None
+    pack_compression = None
+    # Size from which blobs are stored in chunks, None if they never are
+    chunked_threshold = None
+    # Whether object files are synced to disk before being moved into
+    # place (core.fsyncObjectFiles), and the write batch in progress
+    fsync_objects = False
+    batch = None
 
-    def __init__(self, path, force=False):
-        # Set the path for the worktree and git 
+    def __init__(self, path, force=False, gitdir=None):
+        # Set the path for the worktree and git, .git in it unless given
         self.worktree = path
-        self.gitdir = os.path.join(path, ".git")
+        self.gitdir = gitdir or os.path.join(path, ".git")
 
         if not (force or os.path.isdir(self.gitdir)):
             raise Exception(f"Not a Git repository {path}")
@@ -30,3 +70,40 @@ class GitRepository (object):
             vers = int(self.conf.get("core", "repositoryformatversion"))
             if vers != 0:
                 raise Exception("Unsupported repositoryformatversion: {vers}")
+
+        self.object_cache = ByteLRU(conf_size(self.conf, "core", "objectCacheLimit",
+                                              DEFAULT_OBJECT_CACHE_LIMIT))
+        self.object_cache_blob_limit = conf_size(self.conf, "core", "objectCacheBlobLimit",
+                                                 DEFAULT_OBJECT_CACHE_BLOB_LIMIT)
+        self.loose_compression = conf_compression(self.conf, "core", "looseCompression")
+        self.pack_compression = conf_compression(self.conf, "pack", "compression")
+        if self.conf.getboolean("core", "chunkedStorage", fallback=False):
+            self.chunked_threshold = conf_size(self.conf, "core", "chunkedStorageThreshold",
+                                               DEFAULT_CHUNKED_THRESHOLD)
+
+        self.fsync_objects = self.conf.getboolean("core", "fsyncObjectFiles", fallback=False)
+
+        if trace.ENABLED:
+            trace.add_counters(f"object_cache {self.gitdir}", self.cache_stats)
+
+    def cache_stats(self):
+        """Return the counters of the object cache, to tune its budget."""
+        return self.object_cache.stats()
+
+    @contextlib.contextmanager
+    def write_batch(self):
+        """Batch the objects written in the with block: they're only moved
+        into place, after one pass syncing them all, when it ends without
+        an exception. They can be read in the meantime. Nested batches
+        are part of the outer one."""
+        if self.batch is not None:
+            yield self.batch
+            return
+
+        self.batch = WriteBatch(self)
+        try:
+            yield self.batch
+            self.batch.commit()
+        finally:
+            self.batch.abort()
+            self.batch = None
@@ -0,0 +1,134 @@
+import os
+import stat
+import heapq
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .GitRepository import GitRepository
+from .objects import GitBlob
+from .object_fun import object_write, object_write_stream
+from .object_filter import object_filter_load
+from .index import GitIndexEntry, index_read, index_write
+from .ignore import GitIgnore
+from .worktree import walk_worktree
+
+# Files bigger than this are hashed through the streaming writer
+# instead of being read in memory
+STREAM_THRESHOLD = 1024 * 1024
+
+# Batches per worker, so that workers finishing early get more work
+BATCHES_PER_JOB = 4
+
+
+def add_paths(repo, paths, index=None):
+    """Expand paths (files or directories, relative to the current
+    directory) into the sorted list of the worktree files they name,
+    as paths relative to the worktree.  Ignored files are left out of
+    directories, unless they are in index."""
+    worktree = os.path.realpath(repo.worktree)
+    ignore = GitIgnore(repo)
+
+    def skip(path, is_dir):
+        if not is_dir and index is not None and index.find(path):
+            return False
+        return ignore(path, is_dir)
+
+    files = set()
+    for path in paths:
+        # Only the directories are resolved: a symlink is added as such,
+        # not the file it points to
+        head, tail = os.path.split(path)
+        if tail in ("", ".", ".."):
+            abspath = os.path.realpath(path)
+        else:
+            abspath = os.path.join(os.path.realpath(head), tail)
+        if abspath != worktree and not abspath.startswith(worktree + os.sep):
+            raise Exception(f"{path} is outside the repository at {worktree}")
+        relpath = os.path.relpath(abspath, worktree).replace(os.sep, "/")
+
+        try:
+            st = os.lstat(abspath)
+        except FileNotFoundError:
+            raise Exception(f"pathspec {path} did not match any files")
+        if stat.S_ISDIR(st.st_mode):
+            start = "" if relpath == "." else relpath
+            files.update(entry.path for entry in walk_worktree(repo, skip, start=start))
+        else:
+            files.add(relpath)
+
+    return sorted(files)
+
+def add_batches(sizes, count):
+    """Split files into count batches of about the same total size.
+    sizes is a list of (path, size); greedily give the biggest file left
+    to the lightest batch."""
+    batches = [(0, i, []) for i in range(count)]
+    for path, size in sorted(sizes, key=lambda s: -s[1]):
+        total, i, files = heapq.heappop(batches)
+        files.append(path)
+        heapq.heappush(batches, (total + size, i, files))
+    return [files for _, _, files in batches if files]
+
+
+# Hashing, run in the worker processes
+_worker_repo = None
+
+def _worker_init(worktree, gitdir):
+    global _worker_repo
+    _worker_repo = GitRepository(worktree, gitdir=gitdir)
+
+def hash_file(repo, path, write=True):
+    """Hash the worktree file at path (relative to the worktree) as a
+    blob, writing it to repo if write.  Return its index entry."""
+    full = os.path.join(repo.worktree, path)
+    st = os.lstat(full)
+    target = repo if write else None
+
+    if stat.S_ISLNK(st.st_mode):
+        # Symlinks are stored as a blob of their target
+        mode = 0o120000
+        sha = object_write(GitBlob(os.fsencode(os.readlink(full))), target)
+    else:
+        mode = 0o100755 if st.st_mode & 0o111 else 0o100644
+        if st.st_size > STREAM_THRESHOLD:
+            sha = object_write_stream(full, st.st_size, repo=target)
+        else:
+            with open(full, "rb") as f:
+                sha = object_write(GitBlob(f.read()), target)
+
+    return GitIndexEntry.from_stat(path, st, mode, bytes.fromhex(sha))
+
+def _hash_batch(paths):
+    with _worker_repo.write_batch():
+        return [hash_file(_worker_repo, path) for path in paths]
+
+def add(repo, paths, jobs=None):
+    """Add the files named by paths to the index of repo.
+
+    Blobs are hashed, compressed and written by a pool of processes,
+    working on batches of about the same total size, each one a write
+    batch of the object store. The index is only read and written once,
+    with all the new entries merged in. Return the number of files
+    added."""
+    index = index_read(repo)
+    files = add_paths(repo, paths, index)
+    jobs = jobs or os.cpu_count() or 1
+
+    entries = []
+    if jobs == 1 or len(files) < 2:
+        with repo.write_batch():
+            for path in files:
+                entries.append(hash_file(repo, path))
+    else:
+        # Workers load the filter of the object store: make sure there's
+        # one, rather than each of them building it
+        object_filter_load(repo)
+        sizes = [(path, os.lstat(os.path.join(repo.worktree, path)).st_size) for path in files]
+        batches = add_batches(sizes, jobs * BATCHES_PER_JOB)
+        with ProcessPoolExecutor(jobs, initializer=_worker_init,
+                                 initargs=(repo.worktree, repo.gitdir)) as pool:
+            for future in as_completed([pool.submit(_hash_batch, b) for b in batches]):
+                entries.extend(future.result())
+
+    index.add_entries(entries)
+    index_write(repo, index)
+    return len(entries)
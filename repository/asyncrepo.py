@@ -0,0 +1,66 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from .GitRepository import GitRepository
+from .object_fun import object_read, object_write, object_find
+
+
+def _default_workers():
+    # Reads are a mix of disk I/O and zlib, which both release the GIL
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+class AsyncRepository(object):
+    """An asyncio facade over a GitRepository.
+
+    Reading, writing and resolving run in a bounded thread pool, so the
+    event loop never waits on the disk, zlib or sha1; the repository and
+    its caches are shared by all the requests. Concurrent reads of the
+    same sha are coalesced: they all await the same in-flight future.
+
+    Objects returned are the shared, cached ones: don't modify them."""
+
+    def __init__(self, repo, max_workers=None):
+        self.repo = repo if isinstance(repo, GitRepository) else GitRepository(repo)
+        self.executor = ThreadPoolExecutor(max_workers or _default_workers(),
+                                           thread_name_prefix="mygit")
+        # Reads in flight, by sha
+        self._reads = dict()
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def read_object(self, sha):
+        """Read object sha, like object_read.  Return None if there's no
+        such object."""
+        future = self._reads.get(sha)
+        if future is None:
+            future = asyncio.ensure_future(self._run(object_read, self.repo, sha))
+            self._reads[sha] = future
+            future.add_done_callback(lambda f: self._reads.pop(sha, None))
+        # A cancelled caller mustn't cancel the read for the others
+        return await asyncio.shield(future)
+
+    async def read_objects(self, shas):
+        """Read all the objects in shas concurrently.  Return them in the
+        same order."""
+        return await asyncio.gather(*(self.read_object(sha) for sha in shas))
+
+    async def write_object(self, obj):
+        """Hash, compress and store obj, like object_write.  Return its sha."""
+        return await self._run(object_write, obj, self.repo)
+
+    async def resolve(self, name, fmt=None):
+        """Resolve name to a sha, like object_find."""
+        return await self._run(object_find, self.repo, name, fmt)
+
+    def close(self):
+        """Wait for the reads in flight, and stop the threads."""
+        self.executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
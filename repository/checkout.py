@@ -0,0 +1,215 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .object_fun import object_open, CHUNK_SIZE
+from .index import GitIndexEntry, index_read, index_write
+from .refs import ref_resolve, ref_write
+from .tree import tree_resolve, tree_flatten
+from .status import stat_matches, entry_check
+from .history import commit_resolve
+
+# Writes handed to each thread at once, per thread: small files are
+# batched so the pool isn't mostly busy passing them around
+BATCHES_PER_JOB = 4
+
+
+def checkout_plan(repo, index, target, head=None, force=False):
+    """Compare target (a dict of path: GitTreeLeaf) with index and the
+    worktree.  Return the lists of leaves to write and of index entries
+    to remove, and the number of files left as they are.
+
+    Files that are the same in the index and in target are left alone,
+    local changes included, like git does. Unless force, changes that
+    would be lost (in the worktree, or staged, compared to head, the
+    leaves of HEAD) make it raise instead. With force, only the files
+    whose index stat data shows they match target are skipped."""
+    filemode = repo.conf.getboolean("core", "filemode", fallback=True)
+    head = head or {}
+    write, remove, conflicts = [], [], []
+    unchanged = 0
+
+    def file_stat(name):
+        try:
+            return os.lstat(os.path.join(repo.worktree, name))
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def is_clean(entry):
+        # Same in the worktree as in the index, and nothing staged
+        head_leaf = head.get(entry.name)
+        if head_leaf is None or bytes.fromhex(head_leaf.sha) != entry.sha:
+            return False
+        return entry_check(repo, index, entry, file_stat(entry.name), filemode)[0] is None
+
+    for path, leaf in target.items():
+        entry = index.find(path)
+        same = (entry is not None and entry.sha == bytes.fromhex(leaf.sha)
+                and entry.mode == int(leaf.mode, 8))
+        if same and not force:
+            unchanged += 1
+            continue
+        if same:
+            st = file_stat(path)
+            if st is not None and stat_matches(entry, st, filemode) and not index.is_racy(entry):
+                unchanged += 1
+                continue
+        elif not force:
+            if entry is not None and not is_clean(entry):
+                conflicts.append(path)
+            elif entry is None and file_stat(path) is not None:
+                # Untracked file in the way
+                conflicts.append(path)
+        write.append(leaf)
+
+    for entry in index:
+        if entry.name not in target:
+            if not force and not is_clean(entry) and file_stat(entry.name) is not None:
+                conflicts.append(entry.name)
+            remove.append(entry)
+
+    if conflicts:
+        raise Exception("Your local changes to the following files would be overwritten by checkout:\n"
+                        + "".join(f"\t{path}\n" for path in sorted(conflicts)))
+    return write, remove, unchanged
+
+
+def checkout_file(repo, leaf):
+    """Write the blob of leaf to its path in the worktree.  Return its
+    new index entry."""
+    path = os.path.join(repo.worktree, leaf.path)
+    res = object_open(repo, leaf.sha)
+    if res is None:
+        raise Exception(f"Missing blob {leaf.sha} for {leaf.path}")
+
+    fmt, size, stream = res
+    mode = int(leaf.mode, 8)
+    with stream:
+        if mode == 0o120000:
+            _replace(path, lambda: os.symlink(stream.read(), path))
+        else:
+            # The umask applies, like when git creates files
+            perms = 0o777 if mode == 0o100755 else 0o666
+            fd = _replace(path, lambda: os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, perms))
+            with os.fdopen(fd, "wb") as f:
+                if size <= CHUNK_SIZE:
+                    f.write(stream.read())
+                else:
+                    for chunk in stream.chunks():
+                        f.write(chunk)
+
+    return GitIndexEntry.from_stat(leaf.path, os.lstat(path), mode, bytes.fromhex(leaf.sha))
+
+def _replace(path, create):
+    # Most files don't exist yet: only remove what's there when creating
+    # fails, rather than checking first
+    try:
+        return create()
+    except FileExistsError:
+        os.remove(path)
+        return create()
+
+def _checkout_batch(repo, leaves):
+    return [checkout_file(repo, leaf) for leaf in leaves]
+
+
+def _remove_files(repo, entries):
+    """Remove the files of entries, then the directories left empty."""
+    dirs = set()
+    for entry in entries:
+        try:
+            os.remove(os.path.join(repo.worktree, entry.name))
+        except FileNotFoundError:
+            pass
+        path = entry.name
+        while "/" in path:
+            path = path.rsplit("/", 1)[0]
+            dirs.add(path)
+
+    # Deepest first, so parents are empty by the time they're tried
+    for path in sorted(dirs, key=lambda d: -d.count("/")):
+        try:
+            os.rmdir(os.path.join(repo.worktree, path))
+        except OSError:
+            pass
+
+def _make_dirs(repo, leaves, force=False):
+    """Create the directories of leaves, each once."""
+    dirs = {leaf.path.rsplit("/", 1)[0] for leaf in leaves if "/" in leaf.path}
+    for path in sorted(dirs):
+        full = os.path.join(repo.worktree, path)
+        # Tracked files in the way are gone already, this is an untracked one
+        if os.path.lexists(full) and not os.path.isdir(full):
+            if not force:
+                raise Exception(f"Untracked file {path} would be overwritten by checkout")
+            os.remove(full)
+        os.makedirs(full, exist_ok=True)
+
+
+def checkout(repo, name, force=False, jobs=None):
+    """Check out commit name into the worktree and the index, and point
+    HEAD to it: to the branch if name is one, else detached.
+
+    Only the files that differ between the index and the commit are
+    written, by a pool of threads (zlib and file I/O release the GIL),
+    after the directories they need are created in one go. Return
+    statistics, with the time taken by each phase in "timings"."""
+    timings = {}
+    start = time.perf_counter()
+
+    def phase(name):
+        nonlocal start
+        now = time.perf_counter()
+        timings[name] = now - start
+        start = now
+
+    commit = commit_resolve(repo, name)
+    target = {leaf.path: leaf for leaf in tree_flatten(repo, tree_resolve(repo, commit))
+              # Submodules aren't checked out
+              if leaf.mode != b'160000'}
+    head_commit = ref_resolve(repo, "HEAD")
+    head = {}
+    if head_commit:
+        head = {leaf.path: leaf for leaf in tree_flatten(repo, tree_resolve(repo, head_commit))}
+    index = index_read(repo)
+    phase("read")
+
+    write, remove, unchanged = checkout_plan(repo, index, target, head, force)
+    phase("plan")
+
+    _remove_files(repo, remove)
+    phase("remove")
+
+    _make_dirs(repo, write, force)
+    phase("mkdir")
+
+    jobs = jobs or os.cpu_count() or 1
+    entries = []
+    if jobs == 1 or len(write) < 2:
+        entries = _checkout_batch(repo, write)
+    else:
+        write.sort(key=lambda leaf: leaf.path)
+        step = max(1, -(-len(write) // (jobs * BATCHES_PER_JOB)))
+        batches = [write[i:i + step] for i in range(0, len(write), step)]
+        with ThreadPoolExecutor(jobs) as pool:
+            for batch in pool.map(lambda leaves: _checkout_batch(repo, leaves), batches):
+                entries.extend(batch)
+    phase("write")
+
+    if remove:
+        index.remove(entry.name for entry in remove)
+    if entries:
+        index.add_entries(entries)
+    if index.dirty:
+        index_write(repo, index)
+
+    branch = f"refs/heads/{name}"
+    if ref_resolve(repo, branch) == commit and not name.startswith("refs/"):
+        ref_write(repo, "HEAD", f"ref: {branch}")
+    else:
+        branch = None
+        ref_write(repo, "HEAD", commit)
+    phase("index")
+
+    return {"commit": commit, "branch": branch and name, "written": len(write),
+            "removed": len(remove), "unchanged": unchanged, "timings": timings}
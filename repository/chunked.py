@@ -0,0 +1,207 @@
+import os
+import mmap
+import struct
+import hashlib
+
+from utils.path import repo_path
+from .write_batch import object_file_pending, object_file_exists, object_file_write
+
+# Chunked storage of big blobs (core.chunkedStorage): a blob is cut into
+# content-defined chunks, each stored once, uncompressed, under
+# objects/chunked/data, and a manifest under objects/chunked/manifests
+# lists the chunks of the blob. A few KB changed in a big file only add
+# the chunks around the change. Blobs keep their git sha, and read like
+# any other object, but only through mygit: git doesn't know about this.
+#
+# Chunk boundaries come from a rolling hash over the last WINDOW bytes:
+# each byte is mapped to one bit (by _BITS), and a chunk ends where the
+# last WINDOW bits are _PATTERN. bytes.translate and bytes.find do the
+# rolling in C. For random data that's one position in 2**WINDOW, so
+# chunks are about CHUNK_MIN + 64KiB long. Since boundaries only depend
+# on the bytes just before them, inserting or removing data only moves
+# the boundaries around the edit. Changing any of this changes where
+# chunks are cut, and stored blobs would stop sharing chunks with the
+# new ones: don't.
+WINDOW = 16
+CHUNK_MIN = 16 * 1024
+CHUNK_MAX = 256 * 1024
+
+_BITS = bytes((bits[b >> 3] >> (b & 7)) & 1
+              for bits in [hashlib.sha256(b"mygit content-defined chunking").digest()]
+              for b in range(256))
+_PATTERN = bytes((bits[i >> 3] >> (i & 7)) & 1
+                 for bits in [hashlib.sha256(b"mygit chunk boundary").digest()]
+                 for i in range(WINDOW))
+
+# Data read from a stream at once while chunking it
+READ_SIZE = 4 * 1024 * 1024
+
+# Manifest: magic, version, blob size and number of chunks, then the
+# sha and length of each chunk
+MANIFEST_MAGIC = b'MGCH'
+MANIFEST_HEADER = struct.Struct(">4sIQI")
+MANIFEST_ENTRY = struct.Struct(">20sI")
+
+
+def chunk_cut(buf, start, final):
+    """End of the chunk of buf starting at start.  Unless final (buf holds
+    all of the data left), buf must hold at least CHUNK_MAX bytes after
+    start."""
+    assert final or len(buf) - start >= CHUNK_MAX
+    end = min(len(buf), start + CHUNK_MAX)
+    # The window ending a chunk must end at CHUNK_MIN or after
+    lo = start + CHUNK_MIN - WINDOW
+    if lo < end:
+        i = buf[lo:end].translate(_BITS).find(_PATTERN)
+        if i >= 0:
+            return lo + i + WINDOW
+    return end
+
+def chunk_stream(src, size):
+    """Cut the size bytes read from src into chunks.  Yield them as they
+    are found, reading READ_SIZE bytes at a time."""
+    buf = b''
+    pos = 0
+    remaining = size
+    while True:
+        if len(buf) - pos < CHUNK_MAX and remaining:
+            data = src.read(min(READ_SIZE, remaining))
+            if not data:
+                raise Exception(f"Short read: expected {size} bytes, got {size - remaining}")
+            remaining -= len(data)
+            buf = buf[pos:] + data
+            pos = 0
+            continue
+        if pos == len(buf):
+            return
+        cut = chunk_cut(buf, pos, final=not remaining)
+        yield buf[pos:cut]
+        pos = cut
+
+
+def chunked_path(repo, *path):
+    return repo_path(repo, "objects", "chunked", *path)
+
+def manifest_path(repo, sha):
+    return chunked_path(repo, "manifests", sha[0:2], sha[2:])
+
+def chunked_write(repo, src, size):
+    """Store the blob of size bytes read from src in chunks.  Chunks
+    already stored, by this blob or another, aren't written again.
+    Return the sha of the blob, the same as if stored whole."""
+    sha1 = hashlib.sha1(b'blob ' + str(size).encode() + b'\x00')
+    entries = []
+    for chunk in chunk_stream(src, size):
+        sha1.update(chunk)
+        chunk_sha = hashlib.sha1(chunk).hexdigest()
+        path = chunked_path(repo, "data", chunk_sha[0:2], chunk_sha[2:])
+        if not object_file_exists(repo, path):
+            object_file_write(repo, path, chunk)
+        entries.append(MANIFEST_ENTRY.pack(bytes.fromhex(chunk_sha), len(chunk)))
+
+    if src.read(1):
+        raise Exception(f"Stream is longer than the announced {size} bytes")
+
+    sha = sha1.hexdigest()
+    path = manifest_path(repo, sha)
+    if not object_file_exists(repo, path):
+        object_file_write(repo, path, MANIFEST_HEADER.pack(MANIFEST_MAGIC, 1, size, len(entries)) + b''.join(entries))
+    return sha
+
+def chunked_objects(repo):
+    """Return the shas of the chunked blobs of repo."""
+    top = chunked_path(repo, "manifests")
+    if not os.path.isdir(top):
+        return []
+    return [fanout + name for fanout in os.listdir(top)
+            for name in os.listdir(os.path.join(top, fanout)) if len(name) == 38]
+
+
+def chunked_open(repo, path, sha):
+    """Open the chunked blob whose manifest is at path.  Return a
+    (fmt, size, stream) tuple, like object_open."""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, size, count = MANIFEST_HEADER.unpack_from(data)
+    if magic != MANIFEST_MAGIC or version != 1 or \
+       len(data) != MANIFEST_HEADER.size + count * MANIFEST_ENTRY.size:
+        raise Exception(f"Malformed chunk manifest for {sha}")
+
+    chunks = []
+    for chunk_sha, length in MANIFEST_ENTRY.iter_unpack(data[MANIFEST_HEADER.size:]):
+        chunk_sha = chunk_sha.hex()
+        path = chunked_path(repo, "data", chunk_sha[0:2], chunk_sha[2:])
+        chunks.append((object_file_pending(repo, path), length))
+    if sum(length for _, length in chunks) != size:
+        raise Exception(f"Malformed chunk manifest for {sha}: bad length")
+    return b'blob', size, ChunkedObjectStream(chunks, size, sha)
+
+
+class ChunkedObjectStream(object):
+    """Same interface as ObjectStream, over the chunks of a chunked blob.
+
+    Chunks are mmapped one at a time as they're reached, and views()
+    hands out memoryviews of the maps, without copying anything."""
+
+    def __init__(self, chunks, size, sha):
+        self._chunks = chunks
+        self._map = None
+        # Chunk being read, and position in it
+        self._i = 0
+        self._pos = 0
+        self.size = size
+        self.sha = sha
+        self.remaining = size
+
+    def _current(self):
+        """The map of the chunk being read, moving on to the next one if
+        it's all read."""
+        path, length = self._chunks[self._i]
+        if self._pos == length:
+            self._i += 1
+            self._pos = 0
+            self._map = None
+            path, length = self._chunks[self._i]
+        if self._map is None:
+            try:
+                with open(path, "rb") as f:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (FileNotFoundError, ValueError):
+                raise Exception(f"Malformed object {self.sha}: missing chunk {os.path.basename(path)}")
+            if len(self._map) != length:
+                raise Exception(f"Malformed object {self.sha}: bad chunk length")
+        return self._map
+
+    def views(self, n=-1):
+        """Iterate over memoryviews of the next n bytes of the body (all
+        of what's left if n < 0).  The views stay valid after the stream
+        is closed."""
+        if n < 0 or n > self.remaining:
+            n = self.remaining
+        while n:
+            data = self._current()
+            view = memoryview(data)[self._pos:self._pos + n]
+            self._pos += len(view)
+            self.remaining -= len(view)
+            n -= len(view)
+            yield view
+
+    def read(self, n=-1):
+        """Read up to n bytes of the body, or all of what's left if n < 0."""
+        return b''.join(self.views(n))
+
+    def chunks(self, chunk_size=None):
+        """Iterate over the rest of the body, chunk by chunk, as views
+        into the maps."""
+        return self.views()
+
+    def close(self):
+        # Maps are unmapped once the last view into them is gone
+        self._map = None
+        self._chunks = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,247 @@
+import os
+import mmap
+import struct
+import hashlib
+import tempfile
+
+from utils.path import repo_path, repo_dir
+from .object_fun import object_read, object_peel
+from .refs import ref_list, ref_resolve
+
+# Parent positions with a special meaning in the CDAT chunk
+GRAPH_PARENT_NONE = 0x70000000
+GRAPH_EXTRA_EDGES = 0x80000000
+# Set on the last parent of a commit in the EDGE chunk
+GRAPH_LAST_EDGE = 0x80000000
+
+# Generation numbers are stored on 30 bits, dates on 34
+GENERATION_MAX = 0x3fffffff
+DATE_MASK = 0x3ffffffff
+
+# Size of a CDAT record: tree, two parents, generation and date
+CDAT_SIZE = 36
+
+
+class CommitGraph(object):
+    """A commit-graph file, in the format of git's
+    objects/info/commit-graph (version 1, SHA-1).
+
+    For every commit it has the root tree, the positions of the parents
+    in the graph, the commit date and the generation number (one more
+    than the highest generation of the parents) in fixed-width records,
+    so walking history never inflates a commit. Commits are sorted by
+    sha and looked up like in a pack index: fanout, then binary search.
+    The file is mmapped and never copied."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        signature, version, hash_version, chunks = struct.unpack_from(">4sBBB", self.map, 0)
+        if signature != b'CGPH' or version != 1 or hash_version != 1:
+            raise Exception(f"Unsupported commit-graph {path}")
+
+        # Chunk lookup table: id and offset of each chunk, then a
+        # terminating entry giving the end of the last one
+        self.chunks = dict()
+        for i in range(chunks):
+            chunk_id, offset = struct.unpack_from(">4sQ", self.map, 8 + 12 * i)
+            self.chunks[chunk_id] = offset
+        for chunk_id in (b'OIDF', b'OIDL', b'CDAT'):
+            if chunk_id not in self.chunks:
+                raise Exception(f"Malformed commit-graph {path}: no {chunk_id.decode()} chunk")
+
+        self.fanout = struct.unpack_from(">256I", self.map, self.chunks[b'OIDF'])
+        self.count = self.fanout[255]
+        self._oids = self.chunks[b'OIDL']
+        self._cdat = self.chunks[b'CDAT']
+        self._edges = self.chunks.get(b'EDGE')
+
+    def __len__(self):
+        return self.count
+
+    def oid(self, pos):
+        """Binary sha of the commit at pos."""
+        start = self._oids + 20 * pos
+        return self.map[start:start+20]
+
+    def find(self, sha):
+        """Return the position of the commit with binary sha, or None."""
+        lo = self.fanout[sha[0] - 1] if sha[0] else 0
+        hi = self.fanout[sha[0]]
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            cur = self.oid(mid)
+            if cur < sha:
+                lo = mid + 1
+            elif cur > sha:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def tree(self, pos):
+        """Binary sha of the root tree of the commit at pos."""
+        start = self._cdat + CDAT_SIZE * pos
+        return self.map[start:start+20]
+
+    def entry(self, pos):
+        """Return (parents, generation, date) of the commit at pos, the
+        parents being graph positions."""
+        parent1, parent2, high, low = struct.unpack_from(">IIII", self.map, self._cdat + CDAT_SIZE * pos + 20)
+
+        parents = []
+        if parent1 != GRAPH_PARENT_NONE:
+            parents.append(parent1)
+        if parent2 & GRAPH_EXTRA_EDGES:
+            # Octopus merge: the other parents are in the EDGE chunk
+            edge = self._edges + 4 * (parent2 & ~GRAPH_EXTRA_EDGES)
+            while True:
+                parent, = struct.unpack_from(">I", self.map, edge)
+                parents.append(parent & ~GRAPH_LAST_EDGE)
+                if parent & GRAPH_LAST_EDGE:
+                    break
+                edge += 4
+        elif parent2 != GRAPH_PARENT_NONE:
+            parents.append(parent2)
+
+        return parents, high >> 2, ((high & 3) << 32) | low
+
+
+def commit_graph_path(repo):
+    return repo_path(repo, "objects", "info", "commit-graph")
+
+def commit_graph_load(repo):
+    """Return the CommitGraph of repo, or None if it has none.  It is
+    opened once, and again only if the file changed."""
+    path = commit_graph_path(repo)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    key = (st.st_mtime_ns, st.st_size, st.st_ino)
+    cached = getattr(repo, "commit_graph", None)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    graph = CommitGraph(path)
+    repo.commit_graph = (key, graph)
+    return graph
+
+def graph_commits(repo):
+    """Return the dict of the commits reachable from the refs and HEAD
+    of repo, by binary sha, with their (tree, parents, date).  Commits
+    already in the current commit-graph are taken from it, so only new
+    ones are inflated."""
+    old = commit_graph_load(repo)
+    starts = list(ref_list(repo).values())
+    head = ref_resolve(repo, "HEAD")
+    if head:
+        starts.append(head)
+
+    commits = dict()
+    stack = [bytes.fromhex(sha) for sha in filter(None, (object_peel(repo, s, b'commit') for s in starts))]
+    while stack:
+        sha = stack.pop()
+        if sha in commits:
+            continue
+
+        pos = old.find(sha) if old else None
+        if pos is not None:
+            positions, generation, date = old.entry(pos)
+            parents = [old.oid(p) for p in positions]
+            tree = old.tree(pos)
+        else:
+            commit = object_read(repo, sha.hex())
+            if commit is None or commit.fmt != b'commit':
+                raise Exception(f"Missing commit {sha.hex()}")
+            parents = [bytes.fromhex(p) for p in commit.parents()]
+            tree = bytes.fromhex(commit.tree())
+            date = commit.date()
+
+        commits[sha] = (tree, parents, date)
+        stack.extend(p for p in parents if p not in commits)
+    return commits
+
+def graph_generations(commits):
+    """Compute the generation number of every commit in commits, as
+    returned by graph_commits: 1 for roots, else one more than the
+    highest generation of the parents."""
+    generations = dict()
+    for sha in commits:
+        stack = [sha]
+        while stack:
+            top = stack[-1]
+            if top in generations:
+                stack.pop()
+                continue
+            parents = commits[top][1]
+            todo = [p for p in parents if p not in generations]
+            if todo:
+                stack.extend(todo)
+                continue
+            generations[top] = min(GENERATION_MAX, 1 + max((generations[p] for p in parents), default=0))
+            stack.pop()
+    return generations
+
+def commit_graph_write(repo):
+    """Write the commit-graph of repo, for all the commits reachable from
+    its refs.  Return the number of commits in it."""
+    commits = graph_commits(repo)
+    generations = graph_generations(commits)
+    shas = sorted(commits)
+    positions = {sha: i for i, sha in enumerate(shas)}
+
+    fanout = [0] * 256
+    for sha in shas:
+        fanout[sha[0]] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i-1]
+
+    cdat = []
+    edges = []
+    for sha in shas:
+        tree, parents, date = commits[sha]
+        parents = [positions[p] for p in parents]
+        parent1 = parents[0] if parents else GRAPH_PARENT_NONE
+        if len(parents) > 2:
+            parent2 = GRAPH_EXTRA_EDGES | len(edges)
+            edges.extend(parents[1:-1])
+            edges.append(parents[-1] | GRAPH_LAST_EDGE)
+        else:
+            parent2 = parents[1] if len(parents) == 2 else GRAPH_PARENT_NONE
+
+        date &= DATE_MASK
+        cdat.append(tree + struct.pack(">IIII", parent1, parent2,
+                                       (generations[sha] << 2) | (date >> 32),
+                                       date & 0xffffffff))
+
+    chunks = [(b'OIDF', struct.pack(">256I", *fanout)),
+              (b'OIDL', b''.join(shas)),
+              (b'CDAT', b''.join(cdat))]
+    if edges:
+        chunks.append((b'EDGE', struct.pack(f">{len(edges)}I", *edges)))
+
+    out = [struct.pack(">4sBBBB", b'CGPH', 1, 1, len(chunks), 0)]
+    offset = 8 + 12 * (len(chunks) + 1)
+    for chunk_id, data in chunks:
+        out.append(struct.pack(">4sQ", chunk_id, offset))
+        offset += len(data)
+    out.append(struct.pack(">4sQ", b'\x00' * 4, offset))
+    out.extend(data for _, data in chunks)
+    data = b''.join(out)
+
+    directory = repo_dir(repo, "objects", "info", mkdir=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix="tmp_graph_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.write(hashlib.sha1(data).digest())
+        os.replace(tmp, commit_graph_path(repo))
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return len(shas)
@@ -0,0 +1,252 @@
+import sys
+import heapq
+import itertools
+from datetime import datetime, timezone, timedelta
+
+from .object_fun import object_read, object_find
+from .objects import signature_date
+from .commit_graph import commit_graph_load
+
+# Flags of the commits met while painting history
+PARENT1 = 1
+PARENT2 = 2
+STALE = 4
+UNINTERESTING = 8
+
+
+class CommitSource(object):
+    """Parents, dates and generation numbers of the commits of a repo,
+    by hex sha.
+
+    They come from the commit-graph for the commits in it. The others
+    are inflated and parsed, along with their ancestors down to the
+    graph (or the roots), to get their generation."""
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.graph = commit_graph_load(repo)
+        self.cache = dict()
+
+    def _lookup(self, sha):
+        """Info of sha if it's known without parsing, else None."""
+        info = self.cache.get(sha)
+        if info is None and self.graph is not None:
+            pos = self.graph.find(bytes.fromhex(sha))
+            if pos is not None:
+                parents, generation, date = self.graph.entry(pos)
+                info = ([self.graph.oid(p).hex() for p in parents], date, generation)
+                self.cache[sha] = info
+        return info
+
+    def info(self, sha):
+        """Return (parents, date, generation) of commit sha."""
+        info = self._lookup(sha)
+        if info is not None:
+            return info
+
+        parsed = dict()
+        stack = [sha]
+        while stack:
+            top = stack[-1]
+            if top in self.cache:
+                stack.pop()
+                continue
+            if top not in parsed:
+                commit = object_read(self.repo, top)
+                if commit is None or commit.fmt != b'commit':
+                    raise Exception(f"{top} is not a commit")
+                parsed[top] = (commit.parents(), commit.date())
+
+            parents, date = parsed[top]
+            todo = [p for p in parents if self._lookup(p) is None]
+            if todo:
+                stack.extend(todo)
+                continue
+            generation = 1 + max((self.cache[p][2] for p in parents), default=0)
+            self.cache[top] = (parents, date, generation)
+            stack.pop()
+        return self.cache[sha]
+
+    def parents(self, sha):
+        return self.info(sha)[0]
+
+    def date(self, sha):
+        return self.info(sha)[1]
+
+    def generation(self, sha):
+        return self.info(sha)[2]
+
+
+def commit_resolve(repo, name):
+    """Resolve name to the sha of a commit, or raise."""
+    commit = object_find(repo, name, fmt=b'commit')
+    if commit is None:
+        raise Exception(f"Not a valid commit name {name}")
+    return commit
+
+def _paint(source, starts, flags, stale, visit=None):
+    """Walk history from starts, highest generation first, so that a
+    commit is only reached once all its children (among the commits
+    walked) have given it their flags.  starts is a dict of the initial
+    flags, by sha; flags is updated in place.  visit(sha, flags), if
+    given, returns the flags a commit passes on to its parents.
+
+    Stop once every queued commit has one of the stale flags, as git
+    does: the queued commits that don't are counted as they come and
+    go, rather than checking them all at every step. Return the commits
+    walked, in the order they were."""
+    queue = []
+    for sha, f in starts.items():
+        flags[sha] = flags.get(sha, 0) | f
+        heapq.heappush(queue, (-source.generation(sha), -source.date(sha), sha))
+
+    walked = []
+    queued = set(starts)
+    pending = set(starts)
+    active = sum(1 for sha in starts if not flags[sha] & stale)
+    while active:
+        _, _, sha = heapq.heappop(queue)
+        pending.discard(sha)
+        if not flags[sha] & stale:
+            active -= 1
+        walked.append(sha)
+        f = visit(sha, flags[sha]) if visit else flags[sha]
+        for parent in source.parents(sha):
+            old = flags.get(parent, 0)
+            if parent in queued and old & f == f:
+                continue
+            flags[parent] = old | f
+            if parent not in queued:
+                queued.add(parent)
+                pending.add(parent)
+                heapq.heappush(queue, (-source.generation(parent), -source.date(parent), parent))
+                if not flags[parent] & stale:
+                    active += 1
+            elif parent in pending and not old & stale and f & stale:
+                active -= 1
+    return walked
+
+def rev_list(repo, include, exclude=(), source=None):
+    """Return the commits reachable from the commits in include but not
+    from those in exclude, newest first."""
+    source = source or CommitSource(repo)
+    starts = {sha: 0 for sha in include}
+    starts.update({sha: UNINTERESTING for sha in exclude})
+
+    flags = dict()
+    # Commits left once only uninteresting ones are queued are
+    # ancestors of those, so uninteresting too
+    walked = _paint(source, starts, flags, UNINTERESTING)
+    commits = [sha for sha in walked if not flags[sha] & UNINTERESTING]
+    commits.sort(key=lambda sha: -source.date(sha))
+    return commits
+
+def merge_bases(repo, one, two, source=None):
+    """Return the best common ancestors of commits one and two: those
+    that aren't ancestors of another common ancestor.  The first one is
+    the one with the highest generation."""
+    source = source or CommitSource(repo)
+    if one == two:
+        return [one]
+
+    flags = dict()
+    candidates = []
+
+    # Commits reached from both sides are common ancestors, and their own
+    # ancestors can't be the best ones, so they're marked stale
+    def visit(sha, f):
+        f &= PARENT1 | PARENT2 | STALE
+        if f == PARENT1 | PARENT2:
+            candidates.append(sha)
+            f |= STALE
+        return f
+
+    _paint(source, {one: PARENT1, two: PARENT2}, flags, STALE, visit)
+
+    # A candidate found before another one turned it stale can still be
+    # an ancestor of it
+    return [sha for sha in candidates
+            if not any(other != sha and is_ancestor(repo, sha, other, source) for other in candidates)]
+
+def is_ancestor(repo, ancestor, commit, source=None):
+    """Whether ancestor is reachable from commit.  The walk doesn't go
+    below the generation of ancestor, where it can't be."""
+    source = source or CommitSource(repo)
+    floor = source.generation(ancestor)
+    seen = {commit}
+    stack = [commit]
+    while stack:
+        sha = stack.pop()
+        if sha == ancestor:
+            return True
+        for parent in source.parents(sha):
+            if parent not in seen and source.generation(parent) >= floor:
+                seen.add(parent)
+                stack.append(parent)
+    return False
+
+def rev_list_args(repo, revs):
+    """Split rev-list arguments into the (include, exclude) lists of
+    commits.  ^A excludes A, A..B is B without A (HEAD if omitted)."""
+    include = []
+    exclude = []
+    for rev in revs:
+        if ".." in rev:
+            left, right = rev.split("..", 1)
+            exclude.append(commit_resolve(repo, left or "HEAD"))
+            include.append(commit_resolve(repo, right or "HEAD"))
+        elif rev.startswith("^"):
+            exclude.append(commit_resolve(repo, rev[1:]))
+        else:
+            include.append(commit_resolve(repo, rev))
+    return include, exclude
+
+def format_date(signature):
+    """Format the date of a signature line like git log does."""
+    timestamp, tz = signature_date(signature)
+    sign = -1 if tz.startswith("-") else 1
+    offset = timedelta(hours=int(tz[1:3]), minutes=int(tz[3:5])) * sign
+    d = datetime.fromtimestamp(timestamp, timezone(offset))
+    return f"{d:%a %b} {d.day} {d:%H:%M:%S %Y} {tz}"
+
+def log(repo, starts, max_count=None, oneline=False, out=None):
+    """Print the history of the commits in starts, newest first, like git
+    log.  The walk runs on the commit-graph; only the commits printed
+    are inflated."""
+    out = out or sys.stdout
+    source = CommitSource(repo)
+
+    # Commits with the same date come out in the order they were queued
+    order = itertools.count()
+    queue = []
+    seen = set()
+    for sha in starts:
+        if sha not in seen:
+            seen.add(sha)
+            heapq.heappush(queue, (-source.date(sha), next(order), sha))
+
+    shown = 0
+    while queue and (max_count is None or shown < max_count):
+        _, _, sha = heapq.heappop(queue)
+        for parent in source.parents(sha):
+            if parent not in seen:
+                seen.add(parent)
+                heapq.heappush(queue, (-source.date(parent), next(order), parent))
+
+        commit = object_read(repo, sha)
+        message = commit.kvlm[None].decode("utf8", "replace")
+        if oneline:
+            out.write(f"{sha[:7]} {message.split("\n", 1)[0]}\n")
+        else:
+            if shown:
+                out.write("\n")
+            out.write(f"commit {sha}\n")
+            parents = commit.parents()
+            if len(parents) > 1:
+                out.write(f"Merge: {" ".join(p[:7] for p in parents)}\n")
+            author = commit.kvlm[b'author']
+            out.write(f"Author: {author[:author.rfind(b'>')+1].decode("utf8", "replace")}\n")
+            out.write(f"Date:   {format_date(author)}\n\n")
+            for line in message.rstrip("\n").split("\n"):
+                out.write(f"    {line}\n" if line else "\n")
+        shown += 1
@@ -0,0 +1,251 @@
+import os
+import re
+import sys
+import posixpath
+import threading
+
+from utils.path import repo_file
+
+
+def gitignore_parse(lines):
+    """Parse the lines of a .gitignore-style file.  Return a list of
+    (pattern, negated, dir_only, anchored) rules, in file order."""
+    rules = []
+    for line in lines:
+        line = line.rstrip("\n")
+        # Trailing spaces are ignored, unless escaped
+        if line.endswith(" ") and not line.endswith("\\ "):
+            line = line.rstrip(" ")
+        if not line or line.startswith("#"):
+            continue
+
+        negated = line.startswith("!")
+        if negated or line.startswith("\\"):
+            line = line[1:]
+
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        # A slash anywhere but at the end anchors the pattern to the
+        # directory of the file it comes from
+        anchored = "/" in line
+        line = line.lstrip("/")
+
+        if line:
+            rules.append((line, negated, dir_only, anchored))
+    return rules
+
+def glob_to_regex(pattern):
+    """Translate a gitignore glob into a regex matching the same paths.
+    Wildcards don't match /, except for the ** forms."""
+    out = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**/", i) and (i == 0 or pattern[i-1] == "/"):
+            # Leading or middle **/: any number of directories
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i) and i + 2 == n and (i == 0 or pattern[i-1] == "/"):
+            # Trailing **: everything inside
+            out.append(".*")
+            i += 2
+        elif c == "*":
+            out.append("[^/]*")
+            i += 1
+        elif c == "?":
+            out.append("[^/]")
+            i += 1
+        elif c == "[":
+            j = i + 1
+            if j < n and pattern[j] in "!^":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            j = pattern.find("]", j)
+            if j < 0:
+                # No closing bracket, so it's a literal one
+                out.append("\\[")
+                i += 1
+                continue
+            body = pattern[i+1:j]
+            if body[0] in "!^":
+                body = "^" + body[1:]
+            out.append("[" + body.replace("[", "\\[") + "]")
+            i = j + 1
+        elif c == "\\" and i + 1 < n:
+            out.append(re.escape(pattern[i+1]))
+            i += 2
+        else:
+            out.append(re.escape(c))
+            i += 1
+    return "".join(out)
+
+
+class IgnoreFile(object):
+    """The rules of one ignore file, compiled into a single regex for
+    files and one for directories (dir-only rules don't apply to files).
+
+    Rules are put in the regex in reverse order, each in its own group:
+    the first alternative to match is the last matching rule, which is
+    the one that wins, and the group that matched tells if it negates."""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.files = self._compile([r for r in rules if not r[2]])
+        self.dirs = self._compile(rules)
+
+    @staticmethod
+    def _compile(rules):
+        if not rules:
+            return None
+        alternatives = []
+        negated = [None]
+        for pattern, neg, dir_only, anchored in reversed(rules):
+            regex = glob_to_regex(pattern)
+            if not anchored:
+                regex = "(?:.*/)?" + regex
+            alternatives.append("(" + regex + ")")
+            negated.append(neg)
+        return re.compile("|".join(alternatives), re.DOTALL), negated
+
+    def match(self, path, is_dir):
+        """Match path, relative to the directory of the file.  Return
+        True if ignored, False if re-included, None if no rule matches."""
+        compiled = self.dirs if is_dir else self.files
+        if compiled is None:
+            return None
+        regex, negated = compiled
+        m = regex.fullmatch(path)
+        if m is None:
+            return None
+        return not negated[m.lastindex]
+
+EMPTY = IgnoreFile([])
+
+# Compiled ignore files, by path, with the (mtime, size) they were read at
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+def ignore_file_load(path):
+    """Return the compiled IgnoreFile for path, EMPTY if it doesn't exist.
+    Compiled files are cached for the whole process, and only read and
+    compiled again when their mtime or size change."""
+    try:
+        st = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return EMPTY
+
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _compiled.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    with open(path, encoding="utf8", errors="replace") as f:
+        compiled = IgnoreFile(gitignore_parse(f))
+    with _compiled_lock:
+        _compiled[path] = (key, compiled)
+    return compiled
+
+
+class GitIgnore(object):
+    """The ignore rules of a repository: the .gitignore files of the
+    worktree, .git/info/exclude and core.excludesFile.
+
+    Each of them is a compiled IgnoreFile. The .gitignore of a directory
+    is loaded the first time a path in it is checked, and the verdict for
+    each directory is remembered, as everything in an ignored directory
+    is ignored. Paths are relative to the worktree, with / separators.
+    This is safe to use from several threads."""
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.scoped = {}
+        self.dir_verdicts = {}
+
+        # Rules that apply everywhere, info/exclude first as it overrides
+        # the user-wide excludes file
+        self.global_files = []
+        exclude = repo_file(repo, "info", "exclude")
+        if exclude:
+            self.global_files.append(ignore_file_load(exclude))
+        excludes = repo.conf.get("core", "excludesFile", fallback=None)
+        if excludes:
+            self.global_files.append(ignore_file_load(os.path.expanduser(excludes)))
+
+    def rules(self, directory):
+        """Compiled .gitignore of directory ("" for the top)."""
+        compiled = self.scoped.get(directory)
+        if compiled is None:
+            compiled = ignore_file_load(os.path.join(self.repo.worktree, directory, ".gitignore"))
+            self.scoped[directory] = compiled
+        return compiled
+
+    def _match(self, path, is_dir):
+        """Match path itself, without looking at its parents.  The
+        .gitignore closest to path decides, then the global files."""
+        start = len(path)
+        while start > 0:
+            start = path.rfind("/", 0, start)
+            directory = path[:start] if start > 0 else ""
+            result = self.rules(directory).match(path[start+1:], is_dir)
+            if result is not None:
+                return result
+
+        for compiled in self.global_files:
+            result = compiled.match(path, is_dir)
+            if result is not None:
+                return result
+        return False
+
+    def _dir_ignored(self, directory):
+        """Whether directory, or one of its parents, is ignored."""
+        verdict = self.dir_verdicts.get(directory)
+        if verdict is None:
+            parent = directory.rpartition("/")[0]
+            verdict = (parent and self._dir_ignored(parent)) or self._match(directory, True)
+            self.dir_verdicts[directory] = verdict
+        return verdict
+
+    def is_ignored(self, path, is_dir=False):
+        """Whether path is ignored.  If is_dir is None, the type of path
+        is only looked up in the worktree if a directory-only rule makes
+        a difference."""
+        parent = path.rpartition("/")[0]
+        if parent and self._dir_ignored(parent):
+            return True
+
+        if is_dir is None:
+            as_file = self._match(path, False)
+            if as_file == self._match(path, True):
+                return as_file
+            is_dir = os.path.isdir(os.path.join(self.repo.worktree, path))
+
+        if is_dir:
+            return self._dir_ignored(path)
+        return self._match(path, False)
+
+    def __call__(self, path, is_dir=False):
+        return self.is_ignored(path, is_dir)
+
+
+def check_ignore(repo, paths, out=None):
+    """Write the paths (relative to the current directory) that are
+    ignored to out, one per line, as given.  paths can be any iterable,
+    like a file, so huge batches are streamed.  A trailing / marks a
+    directory."""
+    out = out or sys.stdout
+    ignore = GitIgnore(repo)
+    prefix = os.path.relpath(os.getcwd(), repo.worktree)
+    prefix = "" if prefix == "." else prefix.replace(os.sep, "/") + "/"
+
+    for line in paths:
+        path = line.rstrip("\n")
+        if not path:
+            continue
+        is_dir = True if path.endswith("/") else None
+        rel = posixpath.normpath(prefix + path.replace(os.sep, "/"))
+        if rel.startswith("../") or rel == "..":
+            raise Exception(f"{path} is outside the repository")
+        if rel != "." and ignore.is_ignored(rel, is_dir):
+            out.write(path + "\n")
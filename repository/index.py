@@ -0,0 +1,188 @@
+import os
+import struct
+import hashlib
+from bisect import bisect_left
+
+from utils.path import repo_file
+
+# Entry fields, as stored on disk before the sha
+ENTRY_HEAD = struct.Struct(">10I")
+
+
+class GitIndexEntry(object):
+    """An entry of the index: the stat data of a file when it was
+    added, and the sha of the blob it was added as.
+
+    Times are kept as integer nanoseconds and the sha as 20 raw bytes,
+    and __slots__ keeps the per-entry overhead down for big worktrees."""
+
+    __slots__ = ("name", "ctime", "mtime", "dev", "ino", "mode",
+                 "uid", "gid", "fsize", "sha", "flags")
+
+    def __init__(self, name, ctime, mtime, dev, ino, mode, uid, gid, fsize, sha, flags=0):
+        self.name = name
+        self.ctime = ctime
+        self.mtime = mtime
+        self.dev = dev
+        self.ino = ino
+        self.mode = mode
+        self.uid = uid
+        self.gid = gid
+        self.fsize = fsize
+        self.sha = sha
+        # Flags other than the name length, which is computed on write
+        self.flags = flags
+
+    @classmethod
+    def from_stat(cls, name, st, mode, sha):
+        """Build an entry for name from its os.stat_result."""
+        return cls(name, st.st_ctime_ns, st.st_mtime_ns, st.st_dev, st.st_ino,
+                   mode, st.st_uid, st.st_gid, st.st_size, sha)
+
+    @property
+    def stage(self):
+        return (self.flags >> 12) & 3
+
+    def __repr__(self):
+        return f"GitIndexEntry({self.name!r}, {self.mode:o}, {self.sha.hex()})"
+
+
+class GitIndex(object):
+    """The index (.git/index), in DIRC version 2 format.
+
+    Entries are kept sorted by name, as on disk, so lookups are a
+    binary search. Extensions aren't kept, git rebuilds them."""
+
+    def __init__(self, version=2, entries=None, mtime=None):
+        self.version = version
+        self.entries = entries if entries is not None else []
+        # mtime (in ns) of the index file when read, to detect racy entries
+        self.mtime = mtime
+        # Whether entries changed since the index was read
+        self.dirty = False
+        self._names = None
+
+    def names(self):
+        """Sorted list of the names of the entries, built on demand."""
+        if self._names is None:
+            self._names = [e.name for e in self.entries]
+        return self._names
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def find(self, name):
+        """Return the entry for name (at stage 0), or None."""
+        names = self.names()
+        i = bisect_left(names, name)
+        if i < len(names) and names[i] == name:
+            return self.entries[i]
+        return None
+
+    def add_entries(self, entries):
+        """Add entries, replacing those with the same names, in one go."""
+        merged = {e.name: e for e in self.entries}
+        for e in entries:
+            merged[e.name] = e
+        self.entries = [merged[name] for name in sorted(merged)]
+        self._names = None
+        self.dirty = True
+
+    def is_racy(self, entry):
+        """Whether entry may have changed without its stat data showing
+        it: if the file was modified in the same timestamp tick as the
+        index was written, its mtime can't tell."""
+        return self.mtime is None or entry.mtime >= self.mtime
+
+    def remove(self, names):
+        """Remove the entries whose name is in names."""
+        names = set(names)
+        self.entries = [e for e in self.entries if e.name not in names]
+        self._names = None
+        self.dirty = True
+
+
+def index_read(repo):
+    """Read the index of repo.  Return an empty GitIndex if there's none."""
+    path = repo_file(repo, "index")
+    if not path or not os.path.exists(path):
+        return GitIndex()
+
+    with open(path, "rb") as f:
+        mtime = os.fstat(f.fileno()).st_mtime_ns
+        raw = f.read()
+
+    if hashlib.sha1(raw[:-20]).digest() != raw[-20:]:
+        raise Exception(f"Index {path} is corrupt: bad checksum")
+
+    signature, version, count = struct.unpack_from(">4sII", raw, 0)
+    if signature != b'DIRC':
+        raise Exception(f"Index {path} is corrupt: bad signature")
+    if version not in (2, 3):
+        raise Exception(f"Unsupported index version {version}")
+
+    entries = []
+    pos = 12
+    for _ in range(count):
+        (ctime_s, ctime_ns, mtime_s, mtime_ns, dev, ino,
+         mode, uid, gid, fsize) = ENTRY_HEAD.unpack_from(raw, pos)
+        sha = raw[pos+40:pos+60]
+        flags, = struct.unpack_from(">H", raw, pos+60)
+        name_start = pos + 62
+        # Version 3 extended flags, which we don't use
+        if flags & 0x4000:
+            name_start += 2
+
+        # Names longer than 0xfff are only NUL-terminated
+        name_end = raw.index(b'\x00', name_start)
+        name = raw[name_start:name_end].decode("utf8")
+
+        entries.append(GitIndexEntry(name,
+                                     ctime_s * 1000000000 + ctime_ns,
+                                     mtime_s * 1000000000 + mtime_ns,
+                                     dev, ino, mode, uid, gid, fsize, sha,
+                                     flags & 0xb000))
+
+        # Entries are padded with NULs to a multiple of 8 bytes
+        pos += ((name_end - pos) // 8 + 1) * 8
+
+    return GitIndex(version, entries, mtime)
+
+def index_write(repo, index):
+    """Write index as the index of repo.
+
+    It goes to index.lock first, renamed over the index once complete,
+    which is also how git keeps concurrent writers out."""
+    path = repo_file(repo, "index")
+    lock = path + ".lock"
+
+    out = [struct.pack(">4sII", b'DIRC', 2, len(index.entries))]
+    for e in index.entries:
+        name = e.name.encode("utf8")
+        out.append(ENTRY_HEAD.pack(
+            (e.ctime // 1000000000) & 0xffffffff, e.ctime % 1000000000,
+            (e.mtime // 1000000000) & 0xffffffff, e.mtime % 1000000000,
+            e.dev & 0xffffffff, e.ino & 0xffffffff, e.mode,
+            e.uid & 0xffffffff, e.gid & 0xffffffff, e.fsize & 0xffffffff))
+        # Version 2 can't store the extended flag
+        flags = (e.flags & 0xb000) | min(len(name), 0xfff)
+        out.append(e.sha + struct.pack(">H", flags) + name)
+        out.append(b'\x00' * (8 - (62 + len(name)) % 8))
+
+    data = b''.join(out)
+    try:
+        f = open(lock, "xb")
+    except FileExistsError:
+        raise Exception(f"Unable to create {lock}: another process seems to be writing the index")
+
+    try:
+        with f:
+            f.write(data)
+            f.write(hashlib.sha1(data).digest())
+        os.replace(lock, path)
+    except BaseException:
+        os.remove(lock)
+        raise
@@ -0,0 +1,309 @@
+import os
+import struct
+
+from utils.path import repo_path, repo_dir
+from .packfile import repo_packs
+from .object_fun import loose_objects
+from .chunked import chunked_objects
+
+# A Bloom filter over the shas of the objects of a repository, in
+# objects/info/object-filter, for write batches to tell the objects
+# they don't have yet without looking for them. "No" is definite, and
+# costs no syscall; "maybe" means looking on disk, as without filter.
+#
+# Each process reads it once, and keeps it on the repository until the
+# file changes. Objects written since it was saved are appended to
+# objects/info/object-filter.log, 20 bytes each: appends don't need a
+# lock, so concurrent writers can't lose each other's. Loading reads
+# what was appended since the last time. The filter file itself is
+# only rewritten under object-filter.lock: when there's none yet, it's
+# full, packs were added or removed, or the log got long and is merged
+# in. The log is first renamed to object-filter.log.merging, so that
+# new objects go to a new one; a writer whose log was renamed under it
+# writes its shas again, to the new one.
+#
+# Objects written by git are only added when it's rebuilt (by gc, or
+# when it's full), except for its packs. Until then the filter may
+# answer "no" for objects that exist, and they're written again: that's
+# wasted work, never a wrong result, as objects never change. Likewise,
+# objects that are removed stay in the filter.
+
+# Bits per object, and bits checked per object: a false "maybe" rate of
+# about 1% when full. Filters are made for twice the objects they hold,
+# so they don't need rebuilding right away.
+BITS_PER_OBJECT = 10
+HASHES = 7
+MIN_BITS = 1 << 16
+
+# Objects in the log from which it's merged into the filter file
+LOG_MERGE = 8192
+
+# Magic, version, number of hashes, log2 of the number of bits, number
+# of objects, and number of packs covered; then their NUL-terminated
+# names and the bits
+FILTER_MAGIC = b'MGBF'
+FILTER_HEADER = struct.Struct(">4sIIIQI")
+
+
+class ObjectFilter(object):
+    """Bloom filter over object shas.
+
+    Shas are already uniformly distributed: the bit positions are taken
+    from their first 16 bytes by double hashing, without hashing them
+    again."""
+
+    def __init__(self, log_bits, bits=None, count=0, packs=()):
+        self.log_bits = log_bits
+        self.mask = (1 << log_bits) - 1
+        self.bits = bits if bits is not None else bytearray(1 << (log_bits - 3))
+        self.count = count
+        # Names of the packs whose objects are in
+        self.packs = set(packs)
+
+    def _positions(self, h1, h2):
+        h2 |= 1
+        return [(h1 + i * h2) & self.mask for i in range(HASHES)]
+
+    def add(self, sha):
+        """Add the object with hex sha."""
+        return self.add_binary(bytes.fromhex(sha))
+
+    def add_binary(self, sha):
+        """Add the object with binary sha.  Return whether it was new."""
+        # Objects already in (or seemingly so) don't count toward filling
+        # it, so adding the same objects again doesn't rebuild it early
+        bits = self.bits
+        positions = self._positions(int.from_bytes(sha[0:8]), int.from_bytes(sha[8:16]))
+        if all(bits[pos >> 3] & (1 << (pos & 7)) for pos in positions):
+            return False
+        for pos in positions:
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+        return True
+
+    def __contains__(self, sha):
+        """Whether the object with hex sha may be in the repository."""
+        # Inlined, and stopping at the first bit missing: most misses
+        # only check one or two
+        bits, mask = self.bits, self.mask
+        h1 = int(sha[0:16], 16)
+        h2 = int(sha[16:32], 16) | 1
+        for i in range(HASHES):
+            pos = (h1 + i * h2) & mask
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def full(self, more=0):
+        return (self.count + more) * BITS_PER_OBJECT > len(self.bits) * 8
+
+    def serialize(self):
+        names = b''.join(name.encode() + b'\x00' for name in sorted(self.packs))
+        return (FILTER_HEADER.pack(FILTER_MAGIC, 1, HASHES, self.log_bits, self.count, len(self.packs))
+                + names + self.bits)
+
+    @classmethod
+    def parse(cls, data, path):
+        magic, version, hashes, log_bits, count, packs = FILTER_HEADER.unpack_from(data)
+        if magic != FILTER_MAGIC or version != 1 or hashes != HASHES:
+            raise Exception(f"Unsupported object filter {path}")
+        pos = FILTER_HEADER.size
+        names = []
+        for _ in range(packs):
+            end = data.index(b'\x00', pos)
+            names.append(data[pos:end].decode())
+            pos = end + 1
+        bits = bytearray(data[pos:])
+        if len(bits) != 1 << (log_bits - 3):
+            raise Exception(f"Malformed object filter {path}")
+        return cls(log_bits, bits, count, names)
+
+
+def object_filter_path(repo):
+    return repo_path(repo, "objects", "info", "object-filter")
+
+def _log_path(repo):
+    return repo_path(repo, "objects", "info", "object-filter.log")
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def _filter_read(path):
+    try:
+        with open(path, "rb") as f:
+            return ObjectFilter.parse(f.read(), path)
+    except FileNotFoundError:
+        return None
+
+def _log_read(path, fltr, pos=None):
+    """Add the shas of the log at path to fltr, from pos, the (inode,
+    offset) where the last read ended, if it's the same file.  Return
+    where this one ended, None if there's no log."""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        ino = os.fstat(f.fileno()).st_ino
+        start = pos[1] if pos and pos[0] == ino else 0
+        f.seek(start)
+        data = f.read()
+    # A write in progress may have left part of a sha at the end
+    end = len(data) - len(data) % 20
+    for i in range(0, end, 20):
+        fltr.add_binary(data[i:i+20])
+    return (ino, start + end)
+
+def _log_append(repo, data):
+    """Append data, binary shas, to the log of repo."""
+    path = _log_path(repo)
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        except FileNotFoundError:
+            # No objects/info: there's no filter to keep up to date
+            return
+        try:
+            os.write(fd, data)
+            ino = os.fstat(fd).st_ino
+        finally:
+            os.close(fd)
+        # Unless the log was taken for merging meanwhile, maybe before
+        # this was written to it
+        try:
+            if os.stat(path).st_ino == ino:
+                return
+        except FileNotFoundError:
+            pass
+
+def object_filter_build(repo):
+    """Make a new filter with all the objects of repo: packed, loose and
+    chunked."""
+    packs = repo_packs(repo, rescan=True)
+    loose = loose_objects(repo) + chunked_objects(repo)
+    count = sum(len(pack.index) for pack in packs) + len(loose)
+
+    log_bits = (max(MIN_BITS, 2 * count * BITS_PER_OBJECT) - 1).bit_length()
+    fltr = ObjectFilter(log_bits, packs=[pack.name for pack in packs])
+    for pack in packs:
+        for sha in pack.index.shas():
+            fltr.add_binary(sha)
+    for sha in loose:
+        fltr.add(sha)
+    return fltr
+
+def _filter_rewrite(repo, rebuild=False):
+    """Merge the log and the packs not covered into the filter file of
+    repo, or rebuild it from scratch if rebuild, if there's none, or if
+    it would be full.  Return the new filter, or None if another process
+    is writing it."""
+    path = object_filter_path(repo)
+    lock = path + ".lock"
+    log = _log_path(repo)
+    merging = log + ".merging"
+    repo_dir(repo, "objects", "info", mkdir=True)
+    try:
+        f = open(lock, "xb")
+    except FileExistsError:
+        return None
+
+    try:
+        with f:
+            # Objects written from now on go to a new log. One left by a
+            # merge that failed is merged first
+            if not os.path.exists(merging):
+                try:
+                    os.replace(log, merging)
+                except FileNotFoundError:
+                    pass
+
+            fltr = None if rebuild else _filter_read(path)
+            if fltr is not None:
+                _log_read(merging, fltr)
+                packs = repo_packs(repo, rescan=True)
+                new = [pack for pack in packs if pack.name not in fltr.packs]
+                if fltr.full(sum(len(pack.index) for pack in new)):
+                    fltr = None
+                else:
+                    for pack in new:
+                        for sha in pack.index.shas():
+                            fltr.add_binary(sha)
+                    # Forget the packs that are gone, their objects stay in
+                    fltr.packs = {pack.name for pack in packs}
+            if fltr is None:
+                # The objects of the log are all there to be found
+                fltr = object_filter_build(repo)
+            f.write(fltr.serialize())
+        os.replace(lock, path)
+    except BaseException:
+        os.remove(lock)
+        raise
+
+    try:
+        os.remove(merging)
+    except FileNotFoundError:
+        pass
+    return fltr
+
+def object_filter_load(repo):
+    """Return the filter of repo, with the objects of its log and its
+    packs.  It's read once and kept on repo, until the file changes.
+
+    The file is rewritten if there's none, it's full, the packs changed
+    or the log got long; if another process is doing so, this one goes
+    on with the filter it has, or returns None if it has none."""
+    path = object_filter_path(repo)
+    key = _stat_key(path)
+    cached = repo.object_filter
+    if key is not None and cached is not None and cached[0] == key:
+        fltr, log_pos = cached[1], cached[2]
+    else:
+        fltr, log_pos = (_filter_read(path) if key else None), None
+        if fltr is not None:
+            _log_read(_log_path(repo) + ".merging", fltr)
+
+    rebuild = fltr is None
+    rewrite = rebuild
+    if fltr is not None:
+        log_pos = _log_read(_log_path(repo), fltr, log_pos)
+        packs = repo_packs(repo, rescan=True)
+        new = [pack for pack in packs if pack.name not in fltr.packs]
+        rebuild = fltr.full(sum(len(pack.index) for pack in new))
+        rewrite = (rebuild or new or len(fltr.packs) != len(packs)
+                   or (log_pos is not None and log_pos[1] >= LOG_MERGE * 20))
+        if new and not rebuild:
+            # Until it's saved with them, in case it can't be now
+            for pack in new:
+                for sha in pack.index.shas():
+                    fltr.add_binary(sha)
+            fltr.packs.update(pack.name for pack in new)
+
+    if rewrite:
+        saved = _filter_rewrite(repo, rebuild)
+        if saved is not None:
+            fltr, key = saved, _stat_key(path)
+            log_pos = _log_read(_log_path(repo), fltr)
+        elif fltr is None:
+            return None
+
+    repo.object_filter = (key, fltr, log_pos)
+    return fltr
+
+def object_filter_update(repo, shas):
+    """Record the objects with hex shas, just written to repo, in the
+    log of its filter."""
+    if shas:
+        _log_append(repo, b''.join(bytes.fromhex(sha) for sha in shas))
+
+def object_filter_write(repo):
+    """Rebuild the filter of repo from scratch, dropping the objects that
+    are gone.  Return the number of objects in it."""
+    fltr = _filter_rewrite(repo, rebuild=True)
+    if fltr is None:
+        raise Exception(f"Unable to create {object_filter_path(repo)}.lock: "
+                        "another process seems to be writing the object filter")
+    return fltr.count
@@ -1,62 +1,498 @@
+import io
 import os
+import re
 import zlib
 import hashlib
+from bisect import bisect_left
 
-from utils.path import repo_file
-from .objects import GitBlob
+from utils.path import repo_path, repo_dir
+from utils.trace import traced
+from .objects import GitBlob, GitCommit, GitTag, GitTree
+from .packfile import pack_find, repo_packs
+from .refs import ref_resolve
+from .chunked import chunked_write, chunked_open, chunked_objects, chunked_path, manifest_path
+from .write_batch import object_tmp_open, object_file_pending, object_file_exists, object_file_commit, \
+    object_file_write, object_known_new, object_written
 
-def object_read(repo, sha):
-    """Read object sha from Git repository repo.  Return a
-    GitObject whose exact type depends on the object."""
+# Size of the chunks used when streaming object data
+CHUNK_SIZE = 64 * 1024
+
+# Shortest abbreviated sha accepted, as in git
+MIN_PREFIX = 4
+HEX_DIGITS = "0123456789abcdefABCDEF"
+
+# Where the ^ and ~ suffixes of a revision start, each of them, and
+# all of them
+SUFFIX_RE = re.compile(r"[\^~]")
+SUFFIX_TOKEN_RE = re.compile(r"\^(\{[a-z]*\})|(\^[0-9]*)|(~[0-9]*)")
+SUFFIXES_RE = re.compile(f"(?:{SUFFIX_TOKEN_RE.pattern})*")
+
+# Estimated memory of a parsed object besides its data
+OBJECT_OVERHEAD = 256
+
+class AmbiguousObjectError(Exception):
+    """A short sha matches several objects."""
+
+class ObjectStream(object):
+    """Incremental reader over the body of a loose object.
+
+    The zlib stream is inflated on demand, so at most one chunk of
+    compressed input and the requested output are held in memory."""
+
+    def __init__(self, f, decompressor, pending, size, sha):
+        self._f = f
+        self._d = decompressor
+        self._buf = bytearray(pending)
+        self.size = size
+        self.sha = sha
+        # Bytes of the body not handed out yet
+        self.remaining = size
+
+    def _fill(self, want):
+        """Inflate until _buf holds at least want bytes or the stream ends."""
+        while len(self._buf) < want and not self._d.eof:
+            data = self._d.unconsumed_tail or self._f.read(CHUNK_SIZE)
+            if not data:
+                raise Exception(f"Malformed object {self.sha}: truncated")
+            self._buf += self._d.decompress(data, want - len(self._buf))
+
+    def read(self, n=-1):
+        """Read up to n bytes of the body, or all of what's left if n < 0."""
+        if n < 0 or n > self.remaining:
+            n = self.remaining
+
+        self._fill(n)
+        if len(self._buf) < n:
+            raise Exception(f"Malformed object {self.sha}: bad length")
+
+        data = bytes(self._buf[:n])
+        del self._buf[:n]
+        self.remaining -= n
+
+        # Once the announced size is delivered, nothing must be left
+        if not self.remaining:
+            self._fill(1)
+            if self._buf:
+                raise Exception(f"Malformed object {self.sha}: bad length")
+        return data
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        """Iterate over the rest of the body in chunks of chunk_size."""
+        while self.remaining:
+            yield self.read(chunk_size)
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PackedObjectStream(ObjectStream):
+    """Same interface as ObjectStream, over an object that has already
+    been inflated (and undeltified) from a pack."""
+
+    def __init__(self, data, sha):
+        self._data = data
+        self.size = len(data)
+        self.sha = sha
+        self.remaining = self.size
 
-    path = repo_file(repo, "objects", sha[0:2], sha[2:])
+    def read(self, n=-1):
+        if n < 0 or n > self.remaining:
+            n = self.remaining
+        start = self.size - self.remaining
+        self.remaining -= n
+        return self._data[start:start+n]
 
-    if not os.path.isfile(path):  # type: ignore
+    def close(self):
+        pass
+
+
+def object_locate(repo, sha):
+    """Find where object sha is stored.  Return ("pack", pack, offset)
+    for packed objects, ("loose", path) for loose ones, ("chunked",
+    manifest path) for chunked blobs, or None.
+
+    Packs are searched first, as that's an in-memory binary search. If
+    the object is nowhere, packs are rescanned in case it got packed in
+    the meantime (by a concurrent gc, for example)."""
+
+    binsha = bytes.fromhex(sha)
+    found = pack_find(repo, binsha)
+    if found:
+        return ("pack",) + found
+
+    # Objects of the write batch in progress are read from their
+    # temporary file
+    path = object_file_pending(repo, repo_path(repo, "objects", sha[0:2], sha[2:]))
+    if os.path.isfile(path):
+        return ("loose", path)
+
+    path = object_file_pending(repo, manifest_path(repo, sha))
+    if os.path.isfile(path):
+        return ("chunked", path)
+
+    found = pack_find(repo, binsha, rescan=True)
+    if found:
+        return ("pack",) + found
+    return None
+
+def _external_base(repo):
+    """Callback used by packs to read REF_DELTA bases stored elsewhere."""
+    return lambda binsha: object_read_raw(repo, binsha.hex())
+
+def _external_base_header(repo):
+    """Same as _external_base, but only returns (fmt, size)."""
+    return lambda binsha: object_read_header(repo, binsha.hex())
+
+def object_open(repo, sha):
+    """Open object sha for incremental reading.  Return a
+    (fmt, size, stream) tuple, or None if there's no such object.
+    For loose objects only the header is inflated here; the body is
+    read from stream, which must be closed by the caller."""
+
+    where = object_locate(repo, sha)
+    if where is None:
         return None
 
-    with open (path, "rb") as f:  # type: ignore
-        raw = zlib.decompress(f.read())
+    if where[0] == "pack":
+        fmt, data = where[1].read(where[2], _external_base(repo))
+        return fmt, len(data), PackedObjectStream(data, sha)
+    if where[0] == "chunked":
+        return chunked_open(repo, where[1], sha)
+
+    f = open(where[1], "rb")
+    try:
+        d = zlib.decompressobj()
+        raw = b''
+
+        # Inflate just enough to get to the end of the header
+        while b'\x00' not in raw:
+            data = d.unconsumed_tail or f.read(512)
+            if not data or d.eof:
+                raise Exception(f"Malformed object {sha}: bad header")
+            raw += d.decompress(data, 64)
 
         # Read object type
         x = raw.find(b' ')
         fmt = raw[0:x]
 
-        # Read and validate object size
+        # Read object size
         y = raw.find(b'\x00', x)
         size = int(raw[x:y].decode("ascii"))
-        if size != len(raw)-y-1:
-            raise Exception(f"Malformed object {sha}: bad length")
 
-        # Pick constructor
-        match fmt:
-            #case b'commit' : c=GitCommit
-            #case b'tree'   : c=GitTree
-            #case b'tag'    : c=GitTag
-            case b'blob'   : c=GitBlob
-            case _:
-                raise Exception(f"Unknown type {fmt.decode("ascii")} for object {sha}")
+        return fmt, size, ObjectStream(f, d, raw[y+1:], size, sha)
+    except BaseException:
+        f.close()
+        raise
+
+def object_read_header(repo, sha):
+    """Return the (fmt, size) of object sha without reading its body,
+    or None if there's no such object."""
+    where = object_locate(repo, sha)
+    if where is None:
+        return None
+
+    if where[0] == "pack":
+        return where[1].read_header(where[2], _external_base_header(repo))
+
+    fmt, size, stream = object_open(repo, sha)
+    stream.close()
+    return fmt, size
 
-        # Call constructor and return object
-        return c(raw[y+1:])
+def object_read_raw(repo, sha):
+    """Return the (fmt, data) of object sha, or None if there's no such
+    object.  This skips parsing, for callers that only need the bytes."""
+    res = object_open(repo, sha)
+    if res is None:
+        return None
 
+    fmt, size, stream = res
+    with stream:
+        return fmt, stream.read()
 
+def _object_bytes(obj):
+    return len(obj.serialize()) if obj is not None else 0
+
+@traced("object_read", bytes_out=_object_bytes)
+def object_read(repo, sha):
+    """Read object sha from Git repository repo.  Return a
+    GitObject whose exact type depends on the object.
+
+    Parsed objects are kept in the object cache of repo, so reading the
+    same tree or commit again is free. They're shared: callers must not
+    modify them."""
+
+    obj = repo.object_cache.get(sha)
+    if obj is not None:
+        return obj
+
+    res = object_read_raw(repo, sha)
+    if res is None:
+        return None
+
+    fmt, data = res
+
+    # Pick constructor
+    match fmt:
+        case b'commit' : c=GitCommit
+        case b'tree'   : c=GitTree
+        case b'tag'    : c=GitTag
+        case b'blob'   : c=GitBlob
+        case _:
+            raise Exception(f"Unknown type {fmt.decode("ascii")} for object {sha}")
+
+    # Call constructor and return object
+    obj = c(data)
+    if fmt != b'blob' or len(data) <= repo.object_cache_blob_limit:
+        repo.object_cache.put(sha, obj, object_size_estimate(fmt, len(data)))
+    return obj
+
+def object_size_estimate(fmt, size):
+    """Rough memory used by a parsed object of size bytes.  Parsed
+    commits and tags hold their fields on top of the data."""
+    if fmt == b'blob':
+        return size + OBJECT_OVERHEAD
+    return 2 * size + OBJECT_OVERHEAD
+
+
+def _chunked(repo, size):
+    """Whether a blob of size bytes goes to chunked storage in repo."""
+    return repo.chunked_threshold is not None and size >= repo.chunked_threshold
+
+@traced("object_write", bytes_in=lambda obj, repo=None: _object_bytes(obj))
 def object_write(obj, repo=None):
     # Serialize object data
     data = obj.serialize()
+    if repo and obj.fmt == b'blob' and _chunked(repo, len(data)):
+        sha = chunked_write(repo, io.BytesIO(data), len(data))
+        object_written(repo, sha)
+        return sha
     # Add header
     result = obj.fmt + b' ' + str(len(data)).encode() + b'\x00' + data
     # Compute hash
     sha = hashlib.sha1(result).hexdigest()
 
     if repo:
-        # Compute path
-        path=repo_file(repo, "objects", sha[0:2], sha[2:], mkdir=True)
-
-        if not os.path.exists(path):    # type: ignore
-            with open(path, 'wb') as f: # type: ignore
-                # Compress and write
-                f.write(zlib.compress(result))
+        path = repo_path(repo, "objects", sha[0:2], sha[2:])
+        # Objects the filter doesn't know are new, no need to look
+        new = object_known_new(repo, sha)
+        if new or not object_file_exists(repo, path):
+            object_file_write(repo, path, zlib.compress(result, repo.loose_compression), check=not new)
+            object_written(repo, sha)
     return sha
 
+@traced("object_write_stream")
+def object_write_stream(src, size=None, fmt=b'blob', repo=None):
+    """Hash (and write, if repo is given) an object whose payload is read
+    from src, without ever holding the whole payload in memory.
+
+    src is either a path to a file or a binary stream. When src is a
+    stream, size MUST be the number of bytes it will deliver; for a
+    path it defaults to the file size. The header and payload go
+    through sha1 and zlib in a single pass, into a temporary file in
+    objects/ that is renamed to its final path once the sha is known.
+    Returns the sha of the object."""
+
+    if isinstance(src, (str, os.PathLike)):
+        if size is None:
+            size = os.path.getsize(src)
+        with open(src, "rb") as f:
+            return object_write_stream(f, size, fmt, repo)
+
+    if size is None:
+        raise Exception("Size is required when hashing a stream")
+    if repo and fmt == b'blob' and _chunked(repo, size):
+        sha = chunked_write(repo, src, size)
+        object_written(repo, sha)
+        return sha
+
+    header = fmt + b' ' + str(size).encode() + b'\x00'
+    sha1 = hashlib.sha1(header)
+
+    out = None
+    if repo:
+        fd, tmp_path = object_tmp_open(repo)
+        out = os.fdopen(fd, "wb")
+        compressor = zlib.compressobj(repo.loose_compression)
+        out.write(compressor.compress(header))
+
+    try:
+        remaining = size
+        while remaining:
+            chunk = src.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise Exception(f"Short read: expected {size} bytes, got {size - remaining}")
+            remaining -= len(chunk)
+            sha1.update(chunk)
+            if out:
+                out.write(compressor.compress(chunk))
+
+        if src.read(1):
+            raise Exception(f"Stream is longer than the announced {size} bytes")
+
+        sha = sha1.hexdigest()
+        if out:
+            out.write(compressor.flush())
+            out.close()
+            # Move the object into place, unless we already have it
+            new = object_known_new(repo, sha)
+            object_file_commit(repo, tmp_path, repo_path(repo, "objects", sha[0:2], sha[2:]), check=not new)
+            object_written(repo, sha)
+        return sha
+    except BaseException:
+        if out:
+            out.close()
+            os.remove(tmp_path)
+        raise
+
+def loose_objects(repo):
+    """Return the shas of all the loose objects of repo, sorted."""
+    objects = repo_dir(repo, "objects")
+    shas = []
+    for fanout in os.listdir(objects):
+        if len(fanout) != 2 or not os.path.isdir(os.path.join(objects, fanout)):
+            continue
+        for name in os.listdir(os.path.join(objects, fanout)):
+            if len(name) == 38:
+                shas.append(fanout + name)
+    return sorted(shas)
+
+def _fanout_names(directory, fanout):
+    """The shas of the objects in the fan-out directory of directory."""
+    try:
+        return [fanout + name for name in os.listdir(os.path.join(directory, fanout)) if len(name) == 38]
+    except FileNotFoundError:
+        return []
+
+def _fanout_mtime(directory, fanout):
+    try:
+        return os.stat(os.path.join(directory, fanout)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def object_prefix_find(repo, prefix):
+    """Return the sorted shas of the objects whose sha starts with prefix
+    (lowercase hex, at least 2 digits).
+
+    Loose objects (and chunked blobs) are listed into a sorted list kept
+    on repo, one fan-out directory at a time, the first time a prefix
+    falls in it; pack indexes are sorted already, so each lookup is a
+    few binary searches. A directory is listed again when its mtime
+    changed, as objects were written to it since, and packs written
+    since are picked up."""
+    if repo.loose_names is None:
+        repo.loose_names = []
+        repo.loose_fanouts = dict()
+
+    fanout = prefix[:2]
+    objects, manifests = repo_path(repo, "objects"), chunked_path(repo, "manifests")
+    # Taken before listing, so a write during the listing is seen next time
+    mtimes = (_fanout_mtime(objects, fanout), _fanout_mtime(manifests, fanout))
+    names = repo.loose_names
+    if repo.loose_fanouts.get(fanout) != mtimes:
+        # fan-out directories only hold hex digits, all before "g"
+        lo, hi = bisect_left(names, fanout), bisect_left(names, fanout + "g")
+        names[lo:hi] = sorted(_fanout_names(objects, fanout) + _fanout_names(manifests, fanout))
+        repo.loose_fanouts[fanout] = mtimes
+
+    found = set()
+    i = bisect_left(names, prefix)
+    while i < len(names) and names[i].startswith(prefix):
+        found.add(names[i])
+        i += 1
+    for pack in repo_packs(repo, rescan=True):
+        found.update(sha.hex() for sha in pack.index.find_prefix(prefix))
+    return sorted(found)
+
+def object_peel(repo, sha, fmt):
+    """Follow sha to an object of type fmt: tags are followed to what
+    they tag, commits to their tree.  Return None if there's no such
+    object on the way."""
+    while sha:
+        header = object_read_header(repo, sha)
+        if header is None:
+            return None
+        if header[0] == fmt:
+            return sha
+        if header[0] == b'tag':
+            sha = object_read(repo, sha).kvlm[b'object'].decode("ascii")
+        elif header[0] == b'commit' and fmt == b'tree':
+            sha = object_read(repo, sha).tree()
+        else:
+            return None
+    return None
+
+def _name_resolve(repo, name, fmt=None):
+    """Resolve name without suffixes: a full or short sha, or a ref."""
+    if len(name) == 40 and all(c in HEX_DIGITS for c in name):
+        return name.lower()
+
+    # Same order as git: the name itself (for HEAD, ORIG_HEAD and the
+    # like), then under refs/, tags, heads and remotes
+    for ref in (name, "refs/" + name, "refs/tags/" + name, "refs/heads/" + name,
+                "refs/remotes/" + name, "refs/remotes/" + name + "/HEAD"):
+        if ref.startswith("refs/") or ref.isupper():
+            sha = ref_resolve(repo, ref)
+            if sha:
+                return sha
+
+    if len(name) < MIN_PREFIX or not all(c in HEX_DIGITS for c in name):
+        return None
+    found = object_prefix_find(repo, name.lower())
+    if len(found) > 1 and fmt:
+        # Only keep the candidates that can be peeled to what is wanted
+        found = [sha for sha in found if object_peel(repo, sha, fmt)]
+    if len(found) > 1:
+        raise AmbiguousObjectError(f"Short object ID {name} is ambiguous: {", ".join(found)}")
+    return found[0] if found else None
+
 def object_find(repo, name, fmt=None, follow=True):
-    return name
+    """Resolve name to the sha of an object, or return None.
+
+    name is a sha (at least 4 hex digits), or a ref, branch or tag name,
+    followed by any number of git's suffixes: ^N for the Nth parent, ~N
+    for the Nth first-parent ancestor, ^{type} to peel to a type, and
+    ^{} to peel tags. If fmt is given, the object is peeled to that type
+    if follow, and must be of that type if not."""
+    suffixes = SUFFIX_RE.search(name)
+    base = name[:suffixes.start()] if suffixes else name
+    if not SUFFIXES_RE.fullmatch(name, len(base)):
+        return None
+    sha = _name_resolve(repo, base, None if suffixes else fmt)
+
+    for peel, parent, ancestor in SUFFIX_TOKEN_RE.findall(name[len(base):]):
+        if sha is None:
+            return None
+        if parent or ancestor or not peel:
+            # ^N and ~N are both about commits
+            sha = object_peel(repo, sha, b'commit')
+            if sha is None:
+                return None
+        if peel == "{}":
+            while sha and object_read_header(repo, sha)[0] == b'tag':
+                sha = object_read(repo, sha).kvlm[b'object'].decode("ascii")
+        elif peel:
+            sha = object_peel(repo, sha, peel[1:-1].encode())
+        elif parent:
+            n = int(parent[1:] or 1)
+            if n:
+                parents = object_read(repo, sha).parents()
+                sha = parents[n-1] if n <= len(parents) else None
+        else:
+            for _ in range(int(ancestor[1:] or 1)):
+                parents = object_read(repo, sha).parents()
+                if not parents:
+                    return None
+                sha = parents[0]
+
+    if sha is None or fmt is None:
+        return sha
+    if follow:
+        return object_peel(repo, sha, fmt)
+    header = object_read_header(repo, sha)
+    return sha if header and header[0] == fmt else None
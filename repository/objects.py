@@ -1,3 +1,6 @@
+from array import array
+from collections import namedtuple
+
 class GitObject(object):
     def __init__(self, data=None):
         if data != None:
@@ -31,3 +34,189 @@ class GitBlob(GitObject):
     def deserialize(self, data):
         """ Stores the blob data """
         self.blobdata = data
+
+# An entry of a tree, decoded: mode as bytes, path as str, sha in hex
+GitTreeLeaf = namedtuple("GitTreeLeaf", ["mode", "path", "sha"])
+
+class GitTree(GitObject):
+    """A tree, kept as its raw data plus two arrays with the positions of
+    the space and of the NUL of each entry, instead of an object per
+    entry. The mode of entry i runs up to its space, the name up to its
+    NUL, then come the 20 bytes of the sha; entries are only decoded
+    when asked for.
+
+    Entries are sorted the way git sorts them: by name, as if trees
+    had a trailing "/"."""
+    fmt=b'tree'
+
+    def serialize(self):
+        """ Returns the raw tree """
+        return self.data
+
+    def deserialize(self, data):
+        """ Finds the boundaries of the entries, without copying them """
+        self.data = data
+        self._spaces = array("I")
+        self._nuls = array("I")
+        pos = 0
+        end = len(data)
+        while pos < end:
+            spc = data.find(b' ', pos)
+            nul = data.find(b'\x00', spc)
+            if spc < 0 or nul < 0 or nul + 21 > end:
+                raise Exception("Malformed tree: truncated entry")
+            self._spaces.append(spc)
+            self._nuls.append(nul)
+            pos = nul + 21
+
+    def init(self):
+        self.deserialize(b'')
+
+    def __len__(self):
+        return len(self._nuls)
+
+    def _start(self, i):
+        return self._nuls[i-1] + 21 if i else 0
+
+    def mode(self, i):
+        """ Mode of entry i, as bytes (like b'100644' or b'40000') """
+        return self.data[self._start(i):self._spaces[i]]
+
+    def name(self, i):
+        """ Name of entry i, as bytes """
+        return self.data[self._spaces[i]+1:self._nuls[i]]
+
+    def sha(self, i):
+        """ Binary sha of entry i """
+        nul = self._nuls[i]
+        return self.data[nul+1:nul+21]
+
+    def is_tree(self, i):
+        # Modes of other entries (100644, 100755, 120000, 160000) don't
+        # end like this, and it works for a zero-padded 040000 too
+        spc = self._spaces[i]
+        return self.data[spc-5:spc] == b'40000'
+
+    def key(self, i):
+        """ Sort key of entry i """
+        name = self.name(i)
+        return name + b'/' if self.is_tree(i) else name
+
+    def entry(self, i):
+        """ Entry i, decoded as a GitTreeLeaf """
+        return GitTreeLeaf(self.mode(i), self.name(i).decode("utf8", "surrogateescape"), self.sha(i).hex())
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.entry(i)
+
+    def _search(self, key):
+        """ Index of the first entry whose key isn't below key """
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, name):
+        """ Return the index of the entry called name (bytes), or None.
+        It sorts differently whether it's a tree or not, so both places
+        are looked at """
+        for key in (name, name + b'/'):
+            i = self._search(key)
+            if i < len(self) and self.name(i) == name:
+                return i
+        return None
+
+def kvlm_parse(raw):
+    """Parse a Key-Value List with Message, the format of commits and
+    tags: header lines of "key value" (continued on lines starting with
+    a space), a blank line, then the message.  Return a dict, in order,
+    where the message is under the None key.  Keys seen several times
+    (like parent) map to a list of values."""
+    kvlm = dict()
+    pos = 0
+    while True:
+        nl = raw.find(b'\n', pos)
+
+        # A blank line (or no more lines) ends the headers
+        if nl < 0 or nl == pos:
+            kvlm[None] = raw[pos+1:] if nl == pos else b''
+            return kvlm
+
+        spc = raw.find(b' ', pos, nl)
+        key = raw[pos:spc]
+
+        # The value runs until a newline not followed by a space
+        end = nl
+        while raw[end+1:end+2] == b' ':
+            end = raw.find(b'\n', end + 1)
+            if end < 0:
+                end = len(raw)
+                break
+        value = raw[spc+1:end].replace(b'\n ', b'\n')
+
+        if key in kvlm:
+            if type(kvlm[key]) == list:
+                kvlm[key].append(value)
+            else:
+                kvlm[key] = [kvlm[key], value]
+        else:
+            kvlm[key] = value
+
+        pos = end + 1
+
+def kvlm_serialize(kvlm):
+    """Serialize a dict as made by kvlm_parse back to bytes."""
+    ret = b''
+    for key, value in kvlm.items():
+        if key is None:
+            continue
+        values = value if type(value) == list else [value]
+        for v in values:
+            ret += key + b' ' + v.replace(b'\n', b'\n ') + b'\n'
+
+    # Blank line, then the message
+    ret += b'\n' + kvlm[None]
+    return ret
+
+class GitCommit(GitObject):
+    fmt=b'commit'
+
+    def serialize(self):
+        """ Returns the commit as bytes """
+        return kvlm_serialize(self.kvlm)
+
+    def deserialize(self, data):
+        """ Parses the commit headers and message """
+        self.kvlm = kvlm_parse(data)
+
+    def init(self):
+        self.kvlm = dict()
+
+    def parents(self):
+        """ Returns the list of the shas of the parents """
+        parents = self.kvlm.get(b'parent', [])
+        if type(parents) != list:
+            parents = [parents]
+        return [p.decode("ascii") for p in parents]
+
+    def tree(self):
+        """ Returns the sha of the root tree """
+        return self.kvlm[b'tree'].decode("ascii")
+
+    def date(self):
+        """ Returns the committer timestamp, as an int """
+        return signature_date(self.kvlm[b'committer'])[0]
+
+class GitTag(GitCommit):
+    fmt=b'tag'
+
+def signature_date(signature):
+    """ Returns (timestamp, timezone) from an author or committer line
+    like b'Name <email> 1700000000 +0100' """
+    rest = signature[signature.rfind(b'>')+1:].split()
+    return int(rest[0]), rest[1].decode("ascii") if len(rest) > 1 else "+0000"
@@ -0,0 +1,473 @@
+import os
+import mmap
+import struct
+import zlib
+
+from utils.path import repo_dir, repo_path
+from utils.lru import ByteLRU
+from utils.config import conf_size
+from utils import trace
+
+# Object types, as stored in pack entry headers
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+TYPE_NAMES = {OBJ_COMMIT: b'commit',
+              OBJ_TREE: b'tree',
+              OBJ_BLOB: b'blob',
+              OBJ_TAG: b'tag'}
+
+# Compressed bytes fed to zlib at a time when inflating pack entries
+INFLATE_CHUNK = 64 * 1024
+
+# Same default as git for core.deltaBaseCacheLimit
+DEFAULT_DELTA_BASE_CACHE_LIMIT = 96 * 1024 * 1024
+
+# Process-wide cache of the objects that served as delta bases, keyed by
+# (pack path, offset). Walking history resolves the same bases over and
+# over, this saves inflating them (and their own bases) every time.
+delta_base_cache = ByteLRU(DEFAULT_DELTA_BASE_CACHE_LIMIT)
+
+
+def _mmap_file(path):
+    """Map the whole file at path read-only."""
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class PackIndex(object):
+    """A version 2 pack index (.idx).
+
+    The file is mmapped and never copied: the fanout table narrows a
+    lookup down to the objects sharing the first byte, and a binary
+    search over the sorted sha table does the rest."""
+
+    def __init__(self, path):
+        self.path = path
+        self.map = _mmap_file(path)
+
+        if self.map[0:8] != b'\xfftOc\x00\x00\x00\x02':
+            raise Exception(f"Unsupported pack index {path}: only version 2 is supported")
+
+        self.fanout = struct.unpack_from(">256I", self.map, 8)
+        self.count = self.fanout[255]
+
+        # Offsets of the tables that follow the fanout
+        self._shas = 8 + 256 * 4
+        self._crcs = self._shas + 20 * self.count
+        self._offsets = self._crcs + 4 * self.count
+        self._large_offsets = self._offsets + 4 * self.count
+
+    def __len__(self):
+        return self.count
+
+    def sha(self, i):
+        """Binary sha of the i-th object, in sorted order."""
+        pos = self._shas + 20 * i
+        return self.map[pos:pos+20]
+
+    def offset(self, i):
+        """Offset in the pack of the i-th object."""
+        off, = struct.unpack_from(">I", self.map, self._offsets + 4 * i)
+        if off & 0x80000000:
+            # Offsets past 2GB live in the 64 bit table
+            off, = struct.unpack_from(">Q", self.map, self._large_offsets + 8 * (off & 0x7fffffff))
+        return off
+
+    def find(self, sha):
+        """Return the pack offset of binary sha, or None if it isn't here."""
+        lo = self.fanout[sha[0] - 1] if sha[0] else 0
+        hi = self.fanout[sha[0]]
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = self._shas + 20 * mid
+            cur = self.map[pos:pos+20]
+            if cur < sha:
+                lo = mid + 1
+            elif cur > sha:
+                hi = mid
+            else:
+                return self.offset(mid)
+        return None
+
+    def find_prefix(self, prefix):
+        """Return the binary shas whose hex starts with prefix (at least
+        two hex digits), in sorted order."""
+        # The smallest sha with the prefix, padded with zeros
+        low = bytes.fromhex(prefix.ljust(len(prefix) + len(prefix) % 2, "0"))
+        lo = self.fanout[low[0] - 1] if low[0] else 0
+        hi = self.fanout[low[0]]
+        end = hi
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.sha(mid) < low:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        found = []
+        while lo < end and self.sha(lo).hex().startswith(prefix):
+            found.append(self.sha(lo))
+            lo += 1
+        return found
+
+    def shas(self):
+        """Iterate over the binary shas of the index, in sorted order."""
+        for i in range(self.count):
+            yield self.sha(i)
+
+
+class MultiPackIndex(object):
+    """A multi-pack-index, in the format of git's
+    objects/pack/multi-pack-index (version 1, SHA-1).
+
+    It lists the objects of several packs, sorted by sha, each with the
+    pack it's taken from and its offset there: finding an object is one
+    binary search, instead of one per pack. Packs are named by their
+    index file, and numbered in the order of their names. The file is
+    mmapped and never copied."""
+
+    def __init__(self, path):
+        self.path = path
+        self.map = _mmap_file(path)
+
+        signature, version, hash_version, chunks, bases, packs = struct.unpack_from(">4sBBBBI", self.map, 0)
+        if signature != b'MIDX' or version != 1 or hash_version != 1 or bases != 0:
+            raise Exception(f"Unsupported multi-pack-index {path}")
+
+        # Chunk lookup table, like in the commit-graph
+        self.chunks = dict()
+        for i in range(chunks):
+            chunk_id, offset = struct.unpack_from(">4sQ", self.map, 12 + 12 * i)
+            self.chunks[chunk_id] = offset
+        for chunk_id in (b'PNAM', b'OIDF', b'OIDL', b'OOFF'):
+            if chunk_id not in self.chunks:
+                raise Exception(f"Malformed multi-pack-index {path}: no {chunk_id.decode()} chunk")
+
+        # Names of the pack indexes, each ending with a NUL
+        self.pack_names = []
+        pos = self.chunks[b'PNAM']
+        for _ in range(packs):
+            end = self.map.find(b'\x00', pos)
+            self.pack_names.append(self.map[pos:end].decode())
+            pos = end + 1
+
+        self.fanout = struct.unpack_from(">256I", self.map, self.chunks[b'OIDF'])
+        self.count = self.fanout[255]
+        self._oids = self.chunks[b'OIDL']
+        self._offsets = self.chunks[b'OOFF']
+        self._large_offsets = self.chunks.get(b'LOFF')
+
+    def __len__(self):
+        return self.count
+
+    def sha(self, i):
+        """Binary sha of the i-th object, in sorted order."""
+        pos = self._oids + 20 * i
+        return self.map[pos:pos+20]
+
+    def entry(self, i):
+        """Return the (pack number, offset) of the i-th object."""
+        pack, off = struct.unpack_from(">II", self.map, self._offsets + 8 * i)
+        if self._large_offsets is not None and off & 0x80000000:
+            off, = struct.unpack_from(">Q", self.map, self._large_offsets + 8 * (off & 0x7fffffff))
+        return pack, off
+
+    def find(self, sha):
+        """Return the (pack number, offset) of binary sha, or None if it
+        isn't here."""
+        lo = self.fanout[sha[0] - 1] if sha[0] else 0
+        hi = self.fanout[sha[0]]
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = self._oids + 20 * mid
+            cur = self.map[pos:pos+20]
+            if cur < sha:
+                lo = mid + 1
+            elif cur > sha:
+                hi = mid
+            else:
+                return self.entry(mid)
+        return None
+
+
+class Pack(object):
+    """A packfile (.pack) along with its index.
+
+    Objects are read straight from the mmapped pack; deltas are
+    resolved by walking the chain down to its base and applying the
+    deltas back up. REF_DELTA bases that aren't in this pack are
+    requested from the caller through the external callback."""
+
+    def __init__(self, path):
+        base = path[:-5] if path.endswith(".pack") else path
+        self.name = os.path.basename(base)
+        self.path = base + ".pack"
+        self.index = PackIndex(base + ".idx")
+        self.map = _mmap_file(self.path)
+
+        magic, version, count = struct.unpack_from(">4sII", self.map, 0)
+        if magic != b'PACK' or version not in (2, 3):
+            raise Exception(f"Malformed pack {self.path}: bad header")
+        if count != self.index.count:
+            raise Exception(f"Malformed pack {self.path}: index doesn't match")
+
+    def find(self, sha):
+        return self.index.find(sha)
+
+    def _entry_header(self, offset):
+        """Parse the entry header at offset.  Return (type, size, pos),
+        pos being the first byte after the header."""
+        c = self.map[offset]
+        kind = (c >> 4) & 7
+        size = c & 15
+        shift = 4
+        pos = offset + 1
+        while c & 0x80:
+            c = self.map[pos]
+            pos += 1
+            size |= (c & 0x7f) << shift
+            shift += 7
+        return kind, size, pos
+
+    def _delta_base(self, kind, offset, pos):
+        """Locate the base of the delta entry at offset, whose data starts
+        at pos.  Return (base_offset, base_sha, pos): base_offset is None
+        when the base is a REF_DELTA to an object outside this pack."""
+        if kind == OBJ_OFS_DELTA:
+            c = self.map[pos]
+            pos += 1
+            rel = c & 0x7f
+            while c & 0x80:
+                c = self.map[pos]
+                pos += 1
+                rel = ((rel + 1) << 7) | (c & 0x7f)
+            return offset - rel, None, pos
+
+        base_sha = self.map[pos:pos+20]
+        return self.index.find(base_sha), base_sha, pos + 20
+
+    def _inflate(self, pos, size):
+        """Inflate the zlib stream starting at pos, which holds size
+        bytes once inflated."""
+        d = zlib.decompressobj()
+        out = []
+        while not d.eof:
+            data = self.map[pos:pos+INFLATE_CHUNK]
+            if not data:
+                raise Exception(f"Malformed pack {self.path}: truncated entry")
+            pos += len(data)
+            out.append(d.decompress(data))
+
+        data = b''.join(out)
+        if len(data) != size:
+            raise Exception(f"Malformed pack {self.path}: bad entry length")
+        return data
+
+    def _inflate_head(self, pos, length):
+        """Inflate just the first length bytes of the zlib stream at pos."""
+        return zlib.decompressobj().decompress(self.map[pos:pos+INFLATE_CHUNK], length)
+
+    def read(self, offset, external=None):
+        """Read the object at offset.  Return (fmt, data).
+
+        external(sha) is called with the binary sha of REF_DELTA bases
+        that aren't in this pack and must return their (fmt, data).
+        Bases met along the way go through the delta base cache."""
+        chain = []
+        while True:
+            if chain:
+                cached = delta_base_cache.get((self.path, offset))
+                if cached is not None:
+                    fmt, data = cached
+                    break
+
+            kind, size, pos = self._entry_header(offset)
+            if kind in TYPE_NAMES:
+                fmt, data = TYPE_NAMES[kind], self._inflate(pos, size)
+                if chain:
+                    delta_base_cache.put((self.path, offset), (fmt, data), len(data))
+                break
+
+            if kind not in (OBJ_OFS_DELTA, OBJ_REF_DELTA):
+                raise Exception(f"Malformed pack {self.path}: bad type {kind} at {offset}")
+
+            base_offset, base_sha, pos = self._delta_base(kind, offset, pos)
+            chain.append((offset, pos, size))
+            if base_offset is None:
+                res = external(base_sha) if external else None
+                if res is None:
+                    raise Exception(f"Missing delta base {base_sha.hex()} in {self.path}")
+                fmt, data = res
+                break
+            offset = base_offset
+
+        # Apply the deltas from the base upwards. Everything but the
+        # requested object itself was a base, so keep those around.
+        for i in range(len(chain) - 1, -1, -1):
+            offset, pos, size = chain[i]
+            data = apply_delta(data, self._inflate(pos, size))
+            if i:
+                delta_base_cache.put((self.path, offset), (fmt, data), len(data))
+        return fmt, data
+
+    def read_header(self, offset, external=None):
+        """Return the (fmt, size) of the object at offset, inflating at
+        most the first bytes of its delta.  external(sha) must return the
+        (fmt, size) of REF_DELTA bases that aren't in this pack."""
+        kind, size, pos = self._entry_header(offset)
+        if kind in TYPE_NAMES:
+            return TYPE_NAMES[kind], size
+
+        # The size of a deltified object is in the header of its delta...
+        base_offset, base_sha, pos = self._delta_base(kind, offset, pos)
+        delta = self._inflate_head(pos, 32)
+        _, delta_pos = _delta_header_size(delta, 0)
+        size, _ = _delta_header_size(delta, delta_pos)
+
+        # ... and the type is the one of the base at the end of the chain
+        while base_offset is not None:
+            kind, _, pos = self._entry_header(base_offset)
+            if kind in TYPE_NAMES:
+                return TYPE_NAMES[kind], size
+            base_offset, base_sha, pos = self._delta_base(kind, base_offset, pos)
+
+        res = external(base_sha) if external else None
+        if res is None:
+            raise Exception(f"Missing delta base {base_sha.hex()} in {self.path}")
+        return res[0], size
+
+
+def _delta_header_size(delta, pos):
+    """Read one of the size varints at the start of a delta."""
+    size = shift = 0
+    while True:
+        c = delta[pos]
+        pos += 1
+        size |= (c & 0x7f) << shift
+        shift += 7
+        if not c & 0x80:
+            return size, pos
+
+def apply_delta(base, delta):
+    """Apply a git delta to base, and return the result."""
+    src_size, pos = _delta_header_size(delta, 0)
+    dst_size, pos = _delta_header_size(delta, pos)
+    if src_size != len(base):
+        raise Exception("Delta doesn't apply: bad base size")
+
+    base = memoryview(base)
+    out = bytearray()
+    end = len(delta)
+    while pos < end:
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            # Copy a range of the base
+            off = size = 0
+            for i in range(4):
+                if op & (1 << i):
+                    off |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            if size == 0:
+                size = 0x10000
+            out += base[off:off+size]
+        elif op:
+            # Insert the next op bytes of the delta
+            out += delta[pos:pos+op]
+            pos += op
+        else:
+            raise Exception("Delta doesn't apply: bad opcode 0")
+
+    if len(out) != dst_size:
+        raise Exception("Delta doesn't apply: bad result size")
+    return bytes(out)
+
+
+def repo_packs(repo, rescan=False):
+    """Return the packs of repo.
+
+    They're opened the first time and kept on the repository, so a
+    lookup never opens files. With rescan, objects/pack is checked
+    again (if it changed) for packs written since."""
+    if repo.packs is not None and not rescan:
+        return repo.packs
+
+    pack_dir = repo_dir(repo, "objects", "pack")
+    if not pack_dir:
+        repo.packs = []
+        repo.midx = None
+        return repo.packs
+
+    # Nothing to do if the directory didn't change since last scan
+    mtime = os.stat(pack_dir).st_mtime_ns
+    if repo.packs is not None and repo.packs_mtime == mtime:
+        return repo.packs
+
+    delta_base_cache.limit = conf_size(repo.conf, "core", "deltaBaseCacheLimit",
+                                       DEFAULT_DELTA_BASE_CACHE_LIMIT)
+    trace.add_counters("delta_base_cache", delta_base_cache.stats)
+
+    known = {p.name: p for p in (repo.packs or [])}
+    packs = []
+    for name in sorted(os.listdir(pack_dir)):
+        if not name.endswith(".idx"):
+            continue
+        base = name[:-4]
+        if base in known:
+            packs.append(known[base])
+        elif os.path.exists(os.path.join(pack_dir, base + ".pack")):
+            packs.append(Pack(os.path.join(pack_dir, base)))
+
+    repo.packs = packs
+    repo.packs_mtime = mtime
+    repo.midx = _midx_load(pack_dir, packs)
+    return repo.packs
+
+def midx_path(repo):
+    return repo_path(repo, "objects", "pack", "multi-pack-index")
+
+def _midx_load(pack_dir, packs):
+    """Open the multi-pack-index of pack_dir, if any.  Return it with the
+    packs it covers, by number, and the list of the other packs; or None
+    if it names a pack that's gone."""
+    path = os.path.join(pack_dir, "multi-pack-index")
+    if not os.path.exists(path):
+        return None
+
+    midx = MultiPackIndex(path)
+    by_name = {pack.name + ".idx": pack for pack in packs}
+    covered = [by_name.get(name) for name in midx.pack_names]
+    if None in covered:
+        return None
+    return midx, covered, [pack for pack in packs if pack not in covered]
+
+def pack_find(repo, sha, rescan=False):
+    """Find binary sha in the packs of repo.  Return (pack, offset),
+    or None if it isn't packed.
+
+    With a multi-pack-index, a single lookup covers the packs it
+    indexes, and only the packs written since are searched one by one."""
+    packs = repo_packs(repo, rescan)
+    if repo.midx is not None:
+        midx, covered, packs = repo.midx
+        found = midx.find(sha)
+        if found is not None:
+            return covered[found[0]], found[1]
+
+    for pack in packs:
+        offset = pack.find(sha)
+        if offset is not None:
+            return pack, offset
+    return None
@@ -0,0 +1,109 @@
+import os
+import sys
+
+from utils.path import repo_path
+from .refs import (ref_list, ref_read, ref_resolve, ref_write, loose_refs,
+                   packed_refs_load, packed_refs_write)
+from .object_fun import object_find, object_read, object_read_header
+
+# Characters git doesn't allow in ref names
+BAD_REF_CHARS = " ~^:?*[\\\x7f"
+
+
+def ref_peel(repo, sha):
+    """Return what the tag sha peels to, or None if it isn't a tag."""
+    peeled = None
+    while True:
+        header = object_read_header(repo, sha)
+        if header is None or header[0] != b'tag':
+            return peeled
+        sha = peeled = object_read(repo, sha).kvlm[b'object'].decode("ascii")
+
+def pack_refs(repo, all=False):
+    """Move refs to packed-refs, like git pack-refs: the tags (and with
+    all, every ref) plus what was packed already.  Loose refs are
+    deleted once packed, unless they changed in the meantime; symbolic
+    refs are left alone.  Return the number of refs packed."""
+    packed = packed_refs_load(repo)
+    old = {name: (sha, peeled) for name, sha, peeled in packed.refs()} if packed else {}
+
+    refs = dict()
+    loose = dict()
+    for name in loose_refs(repo):
+        data = ref_read(repo_path(repo, name))
+        if data is None or data.startswith("ref: "):
+            continue
+        if all or name.startswith("refs/tags/") or name in old:
+            loose[name] = data
+
+    for name, (sha, peeled) in old.items():
+        refs[name] = (sha, peeled)
+    for name, sha in loose.items():
+        if name in old and old[name][0] == sha:
+            continue
+        refs[name] = (sha, ref_peel(repo, sha))
+
+    packed_refs_write(repo, [(name, sha, peeled) for name, (sha, peeled) in refs.items()])
+
+    # Prune the loose refs, now they're safe in packed-refs
+    for name, sha in loose.items():
+        path = repo_path(repo, name)
+        if ref_read(path) == sha:
+            os.remove(path)
+            _prune_empty_dirs(repo, os.path.dirname(path))
+    return len(refs)
+
+def _prune_empty_dirs(repo, directory):
+    """Remove directory and its parents while they're empty, stopping
+    at the directories git creates, like refs/heads."""
+    keep = {repo_path(repo, "refs"), repo_path(repo, "refs", "heads"), repo_path(repo, "refs", "tags")}
+    while directory not in keep:
+        try:
+            os.rmdir(directory)
+        except OSError:
+            return
+        directory = os.path.dirname(directory)
+
+def show_ref(repo, patterns=(), heads=False, tags=False, dereference=False, out=None):
+    """Print the refs of repo, like git show-ref.  patterns only keep
+    the refs whose name ends with one of them (whole components)."""
+    out = out or sys.stdout
+    packed = packed_refs_load(repo)
+    prefixes = [p for p, wanted in (("refs/heads/", heads), ("refs/tags/", tags)) if wanted]
+
+    found = False
+    for name, sha in ref_list(repo).items():
+        if prefixes and not any(name.startswith(p) for p in prefixes):
+            continue
+        if patterns and not any(name == p or name.endswith("/" + p) for p in patterns):
+            continue
+        found = True
+        out.write(f"{sha} {name}\n")
+
+        if dereference and name.startswith("refs/tags/"):
+            # packed-refs has the peeled object, as long as it's current
+            entry = packed.find(name) if packed else None
+            peeled = entry[1] if entry and entry[0] == sha else ref_peel(repo, sha)
+            if peeled:
+                out.write(f"{peeled} {name}^{{}}\n")
+    return found
+
+def tag_list(repo, out=None):
+    """Print the names of the tags of repo, sorted."""
+    out = out or sys.stdout
+    for name in ref_list(repo, "refs/tags"):
+        out.write(name[len("refs/tags/"):] + "\n")
+
+def tag_create(repo, name, target="HEAD"):
+    """Create the lightweight tag name pointing to target."""
+    if not name or ".." in name or any(c in name for c in BAD_REF_CHARS) or \
+       name.startswith("/") or name.endswith((".lock", "/")):
+        raise Exception(f"{name} is not a valid tag name")
+
+    ref = "refs/tags/" + name
+    if ref_resolve(repo, ref):
+        raise Exception(f"Tag {name} already exists")
+    sha = object_find(repo, target)
+    if sha is None:
+        raise Exception(f"Not a valid object name {target}")
+    ref_write(repo, ref, sha)
@@ -0,0 +1,237 @@
+import os
+import mmap
+import stat
+
+from utils.path import repo_path
+
+# Contents of the ref files read so far, by path, with the stat data of
+# the file when it was read
+_ref_cache = {}
+
+# Opened packed-refs files, by path, with their stat data
+_packed_cache = {}
+
+# Header of the packed-refs we write: every tag is followed by the
+# object it peels to, and refs are sorted
+PACKED_REFS_HEADER = b'# pack-refs with: peeled fully-peeled sorted \n'
+
+
+class PackedRefs(object):
+    """A packed-refs file: one "<sha> <name>" line per ref, sorted by
+    name, annotated tags being followed by a "^<sha>" line with the
+    object they peel to.
+
+    The file is mmapped. Lines have different lengths, so the binary
+    search is over byte offsets: from the middle offset, back up to the
+    start of the record it falls in and compare names. Files that don't
+    say they're sorted are sorted in memory first."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.map = b''
+
+        self.start = 0
+        is_sorted = False
+        if self.map[:1] == b'#':
+            self.start = self.map.find(b'\n') + 1
+            is_sorted = b' sorted ' in self.map[:self.start]
+
+        if not is_sorted:
+            records = []
+            pos = self.start
+            while pos < len(self.map):
+                end = self._next(pos)
+                records.append((self.map[pos+41:self.map.find(b'\n', pos)], self.map[pos:end]))
+                pos = end
+            mapped = self.map
+            self.map = b''.join(record for _, record in sorted(records))
+            self.start = 0
+            # The records are copies, the mapping isn't needed anymore
+            if not isinstance(mapped, bytes):
+                mapped.close()
+
+    def _next(self, pos):
+        """Start of the record after the one at pos."""
+        end = len(self.map)
+        pos = self.map.find(b'\n', pos) + 1 or end
+        while pos < end and self.map[pos] == ord('^'):
+            pos = self.map.find(b'\n', pos) + 1 or end
+        return pos
+
+    def _record_start(self, pos):
+        """Start of the record pos falls in."""
+        start = max(self.map.rfind(b'\n', self.start, pos) + 1, self.start)
+        while self.map[start] == ord('^'):
+            start = max(self.map.rfind(b'\n', self.start, start - 1) + 1, self.start)
+        return start
+
+    def _name(self, pos):
+        return self.map[pos+41:self.map.find(b'\n', pos)]
+
+    def _search(self, name):
+        """Offset of the first record whose name isn't below name."""
+        lo, hi = self.start, len(self.map)
+        while lo < hi:
+            pos = self._record_start((lo + hi) // 2)
+            if self._name(pos) < name:
+                lo = self._next(pos)
+            else:
+                hi = pos
+        return lo
+
+    def _record(self, pos):
+        """(name, sha, peeled) of the record at pos."""
+        nl = self.map.find(b'\n', pos)
+        peeled = None
+        if self.map[nl+1:nl+2] == b'^':
+            peeled = self.map[nl+2:nl+42].decode("ascii")
+        return (self.map[pos+41:nl].decode("utf8"),
+                self.map[pos:pos+40].decode("ascii"),
+                peeled)
+
+    def find(self, name):
+        """Return (sha, peeled) for ref name, or None."""
+        key = name.encode("utf8")
+        pos = self._search(key)
+        if pos < len(self.map) and self._name(pos) == key:
+            return self._record(pos)[1:]
+        return None
+
+    def refs(self, prefix=""):
+        """Yield (name, sha, peeled) for the refs starting with prefix,
+        sorted by name."""
+        key = prefix.encode("utf8")
+        pos = self._search(key)
+        while pos < len(self.map) and self._name(pos).startswith(key):
+            yield self._record(pos)
+            pos = self._next(pos)
+
+
+def packed_refs_load(repo):
+    """Return the PackedRefs of repo, or None if it has none.  It is
+    only opened again when the file changes."""
+    path = repo_path(repo, "packed-refs")
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    key = (st.st_mtime_ns, st.st_size, st.st_ino)
+    cached = _packed_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    packed = PackedRefs(path)
+    _packed_cache[path] = (key, packed)
+    return packed
+
+def packed_refs_write(repo, refs):
+    """Write the packed-refs of repo from refs, an iterable of (name,
+    sha, peeled) tuples (peeled being None for what isn't a tag).  It
+    goes through packed-refs.lock, like with git."""
+    path = repo_path(repo, "packed-refs")
+    lock = path + ".lock"
+
+    out = [PACKED_REFS_HEADER]
+    for name, sha, peeled in sorted(refs):
+        out.append(f"{sha} {name}\n".encode("utf8"))
+        if peeled:
+            out.append(f"^{peeled}\n".encode("ascii"))
+
+    try:
+        f = open(lock, "xb")
+    except FileExistsError:
+        raise Exception(f"Unable to create {lock}: another process seems to be writing the refs")
+    try:
+        with f:
+            f.write(b''.join(out))
+        os.replace(lock, path)
+    except BaseException:
+        os.remove(lock)
+        raise
+
+
+def ref_read(path):
+    """Return the contents of the ref file at path, or None if there's
+    none.  Files are only read again when they change: git writes refs
+    to a lock file renamed over the ref, so the inode of a rewritten
+    ref changes even within the same mtime tick."""
+    try:
+        st = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+
+    key = (st.st_mtime_ns, st.st_size, st.st_ino)
+    cached = _ref_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    with open(path) as f:
+        data = f.read().strip()
+    _ref_cache[path] = (key, data)
+    return data
+
+def ref_resolve(repo, ref):
+    """Resolve ref (like "HEAD" or "refs/heads/master") to a sha,
+    following symbolic refs.  Return None if it doesn't exist.  Loose
+    refs win over packed ones."""
+    data = ref_read(repo_path(repo, ref))
+    if data is None:
+        packed = packed_refs_load(repo) if ref.startswith("refs/") else None
+        found = packed.find(ref) if packed else None
+        return found[0] if found else None
+    if data.startswith("ref: "):
+        return ref_resolve(repo, data[5:])
+    return data
+
+def ref_write(repo, ref, sha):
+    """Point ref to sha, through a lock file renamed over the ref."""
+    path = repo_path(repo, ref)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock = path + ".lock"
+    try:
+        f = open(lock, "x")
+    except FileExistsError:
+        raise Exception(f"Unable to create {lock}: another process seems to be writing {ref}")
+    try:
+        with f:
+            f.write(sha + "\n")
+        os.replace(lock, path)
+    except BaseException:
+        os.remove(lock)
+        raise
+
+def loose_refs(repo, prefix="refs"):
+    """Return the sorted names of the loose refs under prefix."""
+    names = []
+    top = repo_path(repo, prefix)
+    for directory, dirs, files in os.walk(top):
+        rel = os.path.relpath(directory, repo_path(repo)).replace(os.sep, "/")
+        names.extend(rel + "/" + name for name in files if not name.endswith(".lock"))
+    return sorted(names)
+
+def ref_list(repo, prefix="refs"):
+    """Return a dict of the refs under prefix, sorted by name, with
+    their shas.  packed-refs is read in one go, from the first ref with
+    the prefix; loose refs are merged in over it."""
+    refs = dict()
+    packed = packed_refs_load(repo)
+    if packed:
+        for name, sha, _ in packed.refs(prefix + "/"):
+            refs[name] = sha
+
+    loose = loose_refs(repo, prefix)
+    for name in loose:
+        sha = ref_resolve(repo, name)
+        if sha:
+            refs[name] = sha
+
+    if not (packed and loose):
+        return refs
+    return dict(sorted(refs.items()))
@@ -0,0 +1,462 @@
+import os
+import time
+import zlib
+import struct
+import hashlib
+import tempfile
+import multiprocessing
+
+from utils.path import repo_dir
+from utils.config import conf_size
+from .GitRepository import GitRepository
+from .write_batch import _fsync
+from .objects import GitTree
+from .object_fun import object_read_raw, object_read_header, loose_objects
+from .packfile import (pack_find, repo_packs, midx_path, OBJ_COMMIT, OBJ_TREE, OBJ_BLOB, OBJ_TAG,
+                       OBJ_OFS_DELTA)
+
+TYPE_NUMBERS = {b'commit': OBJ_COMMIT,
+                b'tree': OBJ_TREE,
+                b'blob': OBJ_BLOB,
+                b'tag': OBJ_TAG}
+
+# Same defaults as git repack
+DEFAULT_WINDOW = 10
+DEFAULT_DEPTH = 50
+DEFAULT_BIG_FILE_THRESHOLD = 512 * 1024 * 1024
+
+# Objects smaller than this aren't worth deltifying
+MIN_DELTA_SIZE = 50
+
+# Size of the blocks of the base indexed when searching for copies
+DELTA_BLOCK = 16
+
+
+def name_hash(name):
+    """git's pack_name_hash: a hash of the path of an object that
+    clusters files with the same name, and then the same suffix."""
+    h = 0
+    for c in name:
+        if c not in b' \t\n\r\f\v':
+            h = ((h >> 2) + (c << 24)) & 0xffffffff
+    return h
+
+# Delta encoding
+def _delta_varint(n):
+    out = bytearray()
+    while True:
+        c = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(c | 0x80)
+        else:
+            out.append(c)
+            return out
+
+def _delta_insert(out, data):
+    """Append insert instructions for data, at most 127 bytes each."""
+    for i in range(0, len(data), 127):
+        chunk = data[i:i+127]
+        out.append(len(chunk))
+        out += chunk
+
+def _delta_copy(out, offset, size):
+    """Append copy instructions for size bytes at offset of the base."""
+    while size:
+        n = min(size, 0x10000)
+        op = 0x80
+        args = bytearray()
+        for i in range(4):
+            b = (offset >> (8 * i)) & 0xff
+            if b:
+                op |= 1 << i
+                args.append(b)
+        # A size of 0x10000 is encoded as 0
+        for i in range(3):
+            b = (n >> (8 * i)) & 0xff
+            if b:
+                op |= 0x10 << i
+                args.append(b)
+        out.append(op)
+        out += args
+        offset += n
+        size -= n
+
+def create_delta(base, target, max_size=None):
+    """Compute a git delta turning base into target.
+
+    Fixed-size blocks of the base are indexed, and the target is
+    scanned for them; every hit is extended both ways and becomes a
+    copy, everything else an insert. Return None as soon as the delta
+    would be bigger than max_size."""
+    index = {}
+    for i in range(len(base) - DELTA_BLOCK, -1, -DELTA_BLOCK):
+        index[base[i:i+DELTA_BLOCK]] = i
+
+    out = _delta_varint(len(base)) + _delta_varint(len(target))
+    n = len(target)
+    pos = pending = 0
+    while pos + DELTA_BLOCK <= n:
+        off = index.get(target[pos:pos+DELTA_BLOCK])
+        if off is None:
+            pos += 1
+            continue
+
+        # Grow the match backwards into the pending insert...
+        start, bstart = pos, off
+        while start > pending and bstart > 0 and target[start-1] == base[bstart-1]:
+            start -= 1
+            bstart -= 1
+
+        # ... and forwards, a whole block at a time first
+        end, bend = pos + DELTA_BLOCK, off + DELTA_BLOCK
+        while end + 64 <= n and target[end:end+64] == base[bend:bend+64]:
+            end += 64
+            bend += 64
+        while end < n and bend < len(base) and target[end] == base[bend]:
+            end += 1
+            bend += 1
+
+        _delta_insert(out, target[pending:start])
+        _delta_copy(out, bstart, end - start)
+        pos = pending = end
+
+        if max_size is not None and len(out) > max_size:
+            return None
+
+    _delta_insert(out, target[pending:])
+    if max_size is not None and len(out) > max_size:
+        return None
+    return bytes(out)
+
+
+# Delta search, run in the worker processes
+_worker_repo = None
+
+def _worker_init(worktree, gitdir):
+    global _worker_repo
+    _worker_repo = GitRepository(worktree, gitdir=gitdir)
+
+def _delta_search(task):
+    """Find the best delta for each target of a slice of the sorted
+    object list.  task is (entries, first, window, big_file): entries
+    are (sha, type, size) and targets start at index first, the entries
+    before it being only there as bases.  Return (target, base, delta)
+    for the targets that deltify well."""
+    entries, first, window, big_file = task
+    repo = _worker_repo
+    datas = {}
+    found = []
+
+    def data(i):
+        if i not in datas:
+            datas[i] = object_read_raw(repo, entries[i][0])[1]
+        return datas[i]
+
+    for i in range(first, len(entries)):
+        sha, kind, size = entries[i]
+        # Keep just what the window can still reach
+        for old in [k for k in datas if k < i - window]:
+            del datas[old]
+
+        if size < MIN_DELTA_SIZE or size > big_file:
+            continue
+
+        best = None
+        # Like git, a delta is only worth it if under half the object
+        max_size = size // 2 - 20
+        for j in range(max(0, i - window), i):
+            base_sha, base_kind, base_size = entries[j]
+            if base_kind != kind or base_size < MIN_DELTA_SIZE or base_size > big_file:
+                continue
+            # The size difference alone would make the delta too big
+            if size - base_size > max_size:
+                continue
+
+            delta = create_delta(data(j), data(i), max_size)
+            if delta is not None:
+                best = (j, delta)
+                max_size = len(delta) - 1
+
+        if best:
+            found.append((i, best[0], best[1]))
+    return found
+
+
+# Pack writing
+def _entry_header(kind, size):
+    c = (kind << 4) | (size & 15)
+    size >>= 4
+    out = bytearray()
+    while size:
+        out.append(c | 0x80)
+        c = size & 0x7f
+        size >>= 7
+    out.append(c)
+    return bytes(out)
+
+def _ofs_encode(rel):
+    """Encode the distance back to an OFS_DELTA base."""
+    out = [rel & 0x7f]
+    rel >>= 7
+    while rel:
+        rel -= 1
+        out.append(0x80 | (rel & 0x7f))
+        rel >>= 7
+    return bytes(reversed(out))
+
+class _HashingWriter(object):
+    """Write to a file while computing the sha1 and the size of what
+    went through."""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha1 = hashlib.sha1()
+        self.size = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.sha1.update(data)
+        self.size += len(data)
+
+def write_index(path, entries, pack_sha):
+    """Write a version 2 pack index for entries, a list of (binary sha,
+    crc32, offset) tuples, to path."""
+    entries = sorted(entries)
+    with open(path, "wb") as f:
+        out = _HashingWriter(f)
+        out.write(b'\xfftOc' + struct.pack(">I", 2))
+
+        fanout = [0] * 256
+        for sha, _, _ in entries:
+            fanout[sha[0]] += 1
+        total = 0
+        for i in range(256):
+            total += fanout[i]
+            fanout[i] = total
+        out.write(struct.pack(">256I", *fanout))
+
+        out.write(b''.join(sha for sha, _, _ in entries))
+        out.write(b''.join(struct.pack(">I", crc) for _, crc, _ in entries))
+
+        # Offsets that don't fit in 31 bits go to the large offset table
+        large = []
+        offsets = bytearray()
+        for _, _, offset in entries:
+            if offset < 0x80000000:
+                offsets += struct.pack(">I", offset)
+            else:
+                offsets += struct.pack(">I", 0x80000000 | len(large))
+                large.append(offset)
+        out.write(bytes(offsets))
+        out.write(b''.join(struct.pack(">Q", offset) for offset in large))
+
+        out.write(pack_sha)
+        f.write(out.sha1.digest())
+
+def midx_write(repo):
+    """Write the multi-pack-index of all the packs of repo.  Return the
+    number of objects in it.
+
+    An object in several packs is taken from the newest one, like git
+    does. Without packs there's nothing to index, and an old
+    multi-pack-index is removed."""
+    packs = sorted(repo_packs(repo, rescan=True), key=lambda pack: pack.name)
+    if not packs:
+        if os.path.exists(midx_path(repo)):
+            os.remove(midx_path(repo))
+        return 0
+
+    objects = dict()
+    newest = sorted(range(len(packs)), key=lambda i: -os.stat(packs[i].path).st_mtime_ns)
+    for pack_id in newest:
+        index = packs[pack_id].index
+        for i in range(len(index)):
+            objects.setdefault(index.sha(i), (pack_id, i))
+    shas = sorted(objects)
+
+    fanout = [0] * 256
+    for sha in shas:
+        fanout[sha[0]] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i-1]
+
+    offsets = [packs[pack_id].index.offset(i) for pack_id, i in (objects[sha] for sha in shas)]
+    # Offsets only go to the large offset table if some don't fit in 32 bits
+    large = []
+    need_large = any(offset > 0xffffffff for offset in offsets)
+    ooff = bytearray()
+    for sha, offset in zip(shas, offsets):
+        if need_large and offset >= 0x80000000:
+            large.append(offset)
+            offset = 0x80000000 | (len(large) - 1)
+        ooff += struct.pack(">II", objects[sha][0], offset)
+
+    names = b''.join(pack.name.encode() + b'.idx\x00' for pack in packs)
+    chunks = [(b'PNAM', names + b'\x00' * (-len(names) % 4)),
+              (b'OIDF', struct.pack(">256I", *fanout)),
+              (b'OIDL', b''.join(shas)),
+              (b'OOFF', bytes(ooff))]
+    if large:
+        chunks.append((b'LOFF', b''.join(struct.pack(">Q", offset) for offset in large)))
+
+    out = [struct.pack(">4sBBBBI", b'MIDX', 1, 1, len(chunks), 0, len(packs))]
+    offset = 12 + 12 * (len(chunks) + 1)
+    for chunk_id, data in chunks:
+        out.append(struct.pack(">4sQ", chunk_id, offset))
+        offset += len(data)
+    out.append(struct.pack(">4sQ", b'\x00' * 4, offset))
+    out.extend(data for _, data in chunks)
+    data = b''.join(out)
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(midx_path(repo)), prefix="tmp_midx_")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.write(hashlib.sha1(data).digest())
+        os.replace(tmp, midx_path(repo))
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return len(shas)
+
+def repack(repo, window=DEFAULT_WINDOW, depth=DEFAULT_DEPTH, jobs=None):
+    """Pack all the loose objects of repo into a new deltified pack,
+    then remove them.
+
+    Objects are sorted by type, name hash and decreasing size, so that
+    likely delta pairs end up close; each object is then deltified
+    against the best of the window objects before it. The search is
+    spread over a multiprocessing pool. Return a dict of statistics."""
+    start = time.time()
+    big_file = conf_size(repo.conf, "core", "bigFileThreshold", DEFAULT_BIG_FILE_THRESHOLD)
+
+    shas = loose_objects(repo)
+    objects_dir = repo_dir(repo, "objects")
+
+    # Loose objects that are already packed only need pruning
+    todo = [sha for sha in shas if not pack_find(repo, bytes.fromhex(sha))]
+
+    stats = {"objects": len(todo), "deltas": 0, "loose_bytes": 0,
+             "object_bytes": 0, "pack_bytes": 0, "pack": None}
+    for sha in shas:
+        stats["loose_bytes"] += os.path.getsize(os.path.join(objects_dir, sha[0:2], sha[2:]))
+
+    # Path names of blobs and trees, from the trees, to cluster them
+    headers = {sha: object_read_header(repo, sha) for sha in todo}
+    names = {}
+    for sha in todo:
+        if headers[sha][0] == b'tree':
+            tree = GitTree(object_read_raw(repo, sha)[1])
+            for i in range(len(tree)):
+                names.setdefault(tree.sha(i).hex(), tree.name(i))
+
+    entries = sorted(((sha, TYPE_NUMBERS[fmt], size) for sha, (fmt, size) in headers.items()),
+                     key=lambda e: (e[1], name_hash(names.get(e[0], b'')), -e[2], e[0]))
+    stats["object_bytes"] = sum(e[2] for e in entries)
+
+    # Delta search, in slices overlapping by one window
+    deltas = {}
+    if entries and window > 0 and depth > 0:
+        jobs = jobs or os.cpu_count() or 1
+        step = max(64, -(-len(entries) // (jobs * 4)))
+        starts = []
+        tasks = []
+        for first in range(0, len(entries), step):
+            lo = max(0, first - window)
+            starts.append(lo)
+            tasks.append((entries[lo:first+step], first - lo, window, big_file))
+
+        def collect(results):
+            # Indexes in the results are relative to the slice
+            for lo, found in zip(starts, results):
+                for target, base, delta in found:
+                    deltas[lo + target] = (lo + base, delta)
+
+        if jobs == 1 or len(tasks) == 1:
+            _worker_init(repo.worktree, repo.gitdir)
+            collect(map(_delta_search, tasks))
+        else:
+            with multiprocessing.Pool(jobs, _worker_init, (repo.worktree, repo.gitdir)) as pool:
+                collect(pool.imap(_delta_search, tasks))
+
+    # Enforce the maximum chain depth, bases always come first
+    depths = [0] * len(entries)
+    for i in range(len(entries)):
+        if i in deltas:
+            base = deltas[i][0]
+            if depths[base] + 1 > depth:
+                del deltas[i]
+            else:
+                depths[i] = depths[base] + 1
+
+    if not entries:
+        for sha in shas:
+            _prune_loose(objects_dir, sha)
+        stats["time"] = time.time() - start
+        return stats
+
+    # Write the pack, then its index
+    pack_dir = repo_dir(repo, "objects", "pack", mkdir=True)
+    fd, tmp_pack = tempfile.mkstemp(prefix="tmp_pack_", dir=pack_dir)
+    tmp_idx = tmp_pack + ".idx"
+    try:
+        offsets = []
+        index = []
+        with os.fdopen(fd, "wb") as f:
+            out = _HashingWriter(f)
+            out.write(b'PACK' + struct.pack(">II", 2, len(entries)))
+
+            for i, (sha, kind, size) in enumerate(entries):
+                offset = out.size
+                offsets.append(offset)
+                if i in deltas:
+                    base, delta = deltas[i]
+                    raw = (_entry_header(OBJ_OFS_DELTA, len(delta))
+                           + _ofs_encode(offset - offsets[base])
+                           + zlib.compress(delta, repo.pack_compression))
+                    stats["deltas"] += 1
+                else:
+                    data = object_read_raw(repo, sha)[1]
+                    raw = _entry_header(kind, size) + zlib.compress(data, repo.pack_compression)
+                out.write(raw)
+                index.append((bytes.fromhex(sha), zlib.crc32(raw), offset))
+
+            pack_sha = out.sha1.digest()
+            f.write(pack_sha)
+
+        write_index(tmp_idx, index, pack_sha)
+
+        # The loose objects are pruned next: the pack and its index must
+        # be on disk first
+        _fsync(tmp_pack)
+        _fsync(tmp_idx)
+
+        # The pack must be in place before its index makes it visible
+        name = "pack-" + pack_sha.hex()
+        os.replace(tmp_pack, os.path.join(pack_dir, name + ".pack"))
+        os.replace(tmp_idx, os.path.join(pack_dir, name + ".idx"))
+        # And so must the renames (not possible on Windows)
+        if os.name == "posix":
+            _fsync(pack_dir)
+    except BaseException:
+        for path in (tmp_pack, tmp_idx):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+    for sha in shas:
+        _prune_loose(objects_dir, sha)
+
+    stats["pack"] = name
+    stats["pack_bytes"] = os.path.getsize(os.path.join(pack_dir, name + ".pack"))
+    stats["time"] = time.time() - start
+    return stats
+
+def _prune_loose(objects_dir, sha):
+    """Remove a loose object, and its fanout directory once empty."""
+    os.remove(os.path.join(objects_dir, sha[0:2], sha[2:]))
+    try:
+        os.rmdir(os.path.join(objects_dir, sha[0:2]))
+    except OSError:
+        pass
@@ -4,8 +4,8 @@ from os.path import isdir
 import sys
 
 from .GitRepository import GitRepository
-from .object_fun import object_read, object_find
 from utils.path import repo_file,repo_dir
+from utils.trace import traced
 
 def repo_create(path):
     """ 
@@ -46,12 +46,81 @@ def repo_create(path):
     with open(repo_file(repo, "config"), "w") as f:     # type: ignore
           config = repo_default_config()
           config.write(f)
-    
+
+    # The directories in it may have found another repository before
+    _find_cache_drop(repo.worktree)
     return repo
 
+# Repositories found so far: the gitdir found from each directory (by
+# absolute path as given, and by realpath for those walked through),
+# with the mtimes of the directories walked through below the worktree,
+# and the repository opened for each gitdir, with the stat data of its
+# config when it was read
+_find_cache = dict()
+_repo_cache = dict()
+
+def _find_cache_drop(worktree):
+    """ Forget where the directories at or under worktree found their
+    repository """
+    roots = {os.path.abspath(worktree), os.path.realpath(worktree)}
+    for directory in list(_find_cache):
+        if any(directory == root or directory.startswith(root.rstrip(os.sep) + os.sep)
+               for root in roots):
+            del _find_cache[directory]
+
+def _find_cache_get(start):
+    """ The (worktree, gitdir) found from start before, if there can't be
+    a new .git between them: creating one changes the mtime of the
+    directory it's in """
+    cached = _find_cache.get(start)
+    if cached is None:
+        return None
+    found, mtimes = cached
+    if not os.path.isdir(found[1]):
+        return None
+    for directory, mtime in mtimes:
+        try:
+            if os.stat(directory).st_mtime_ns != mtime:
+                return None
+        except OSError:
+            return None
+    return found
+
+def _repo_open(worktree, gitdir):
+    """ The repository at gitdir, reusing the one opened before unless
+    its config changed since """
+    try:
+        st = os.stat(os.path.join(gitdir, "config"))
+        key = (st.st_mtime_ns, st.st_size, st.st_ino)
+    except OSError:
+        # Let GitRepository complain about it
+        key = None
+
+    cached = _repo_cache.get(gitdir)
+    if key and cached and cached[0] == key and cached[1].worktree == worktree:
+        return cached[1]
+
+    repo = GitRepository(worktree, gitdir=gitdir)
+    _repo_cache[gitdir] = (key, repo)
+    return repo
+
+def _ceiling_dirs():
+    """ The directories of GIT_CEILING_DIRECTORIES, which repo_find won't
+    look into. Like git, relative ones are ignored """
+    dirs = os.environ.get("GIT_CEILING_DIRECTORIES", "")
+    return {os.path.realpath(d) for d in dirs.split(os.pathsep) if os.path.isabs(d)}
+
+@traced("repo_find")
 def repo_find(path=".",required=True):
     """
-    Find an existing Git repository by searching recursively up the directory tree.
+    Find an existing Git repository by searching up the directory tree.
+
+    Like git, the search is skipped if GIT_DIR is set (the worktree being
+    GIT_WORK_TREE, or the current directory), and doesn't go into the
+    directories of GIT_CEILING_DIRECTORIES. Where each directory's
+    repository is, and the repositories themselves, are cached: finding
+    one again only stats the directories in between, in case a .git was
+    created in one, and its config, to see if it must be read again.
     
     Parameters:
         path (str): The path from which to start searching. Defaults to current directory.
@@ -64,28 +133,51 @@ def repo_find(path=".",required=True):
     Raises:
         Exception: If required=True and no Git repository is found.
     """
-    
-    # Converts the provided path to a relative path (if it was not)
-    path = os.path.relpath(path)
+    gitdir = os.environ.get("GIT_DIR")
+    if gitdir:
+        if os.path.isdir(gitdir):
+            worktree = os.path.realpath(os.environ.get("GIT_WORK_TREE", "."))
+            return _repo_open(worktree, os.path.realpath(gitdir))
+        if required:
+            raise Exception(f"Not a git repository: {gitdir}")
+        return None
 
-    # If .git exists in the path, return the repo object
-    if os.path.isdir(os.path.join(path,".git")):
-        return GitRepository(path)
+    # abspath doesn't touch the disk, unlike realpath
+    start = os.path.abspath(path)
+    found = _find_cache_get(start)
+    if found:
+        return _repo_open(*found)
+    path = os.path.realpath(start)
 
-    # If we haven't returned, recurse in parent, if w
-    parent = os.path.realpath(os.path.join(path, ".."))
+    # Walk up until a .git is found, remembering the directories seen so
+    # the nested ones find it at once next time. Their mtimes are taken
+    # before looking for .git in them, so one created meanwhile is seen
+    ceilings = _ceiling_dirs()
+    seen = []
+    while True:
+        try:
+            seen.append((path, os.stat(path).st_mtime_ns))
+        except OSError:
+            seen.append((path, None))
+        gitdir = os.path.join(path, ".git")
+        if os.path.isdir(gitdir):
+            found = (path, gitdir)
+            # The worktree's own mtime doesn't matter, it has the .git
+            below = seen[:-1]
+            for i, (directory, _) in enumerate(seen):
+                _find_cache[directory] = (found, below[i:])
+            _find_cache[start] = (found, below)
+            return _repo_open(*found)
 
-    if parent == path:
-        # Bottom case
-        # os.path.join("/", "..") == "/":
-        # If parent==path, then path is root.
-        if required:
-            raise Exception("No git directory.")
-        else:
-            return None
+        parent = os.path.dirname(path)
+        # os.path.dirname("/") == "/"
+        if parent == path or parent in ceilings:
+            break
+        path = parent
 
-    # Recursive case
-    return repo_find(parent, required)
+    if required:
+        raise Exception("No git directory.")
+    return None
 
 def repo_default_config():
     """ 
@@ -108,7 +200,113 @@ def repo_default_config():
     return ret
 
 # Functions for cat-file
-def cat_file(repo, obj, fmt=None):
-    """ Read the contents of the objects and shows them in the terminal """
-    obj = object_read(repo, object_find(repo, obj, fmt=fmt))
-    sys.stdout.buffer.write(obj.serialize())
+def cat_file(repo, obj, fmt=None, show=None):
+    """ Read the contents of the objects and shows them in the terminal.
+    If show is "type" or "size", only that is printed, which just needs
+    the object header. Contents are streamed in chunks, never loaded whole """
+    # Imported here, like below: init and repo_find don't need the object
+    # store, and mygit init shouldn't pay for loading it
+    from .object_fun import object_find, object_open, object_read_header
+    sha = object_find(repo, obj, fmt=fmt)
+    if sha is None:
+        raise Exception(f"Not a valid object name {obj}")
+
+    if show:
+        header = object_read_header(repo, sha)
+        if header is None:
+            raise Exception(f"Not a valid object name {obj}")
+        print(header[0].decode("ascii") if show == "type" else header[1])
+        return
+
+    res = object_open(repo, sha)
+    if res is None:
+        raise Exception(f"Not a valid object name {obj}")
+
+    obj_fmt, size, stream = res
+    with stream:
+        if fmt and obj_fmt != fmt:
+            raise Exception(f"Object {obj} is a {obj_fmt.decode("ascii")}, not a {fmt.decode("ascii")}")
+        for chunk in stream.chunks():
+            sys.stdout.buffer.write(chunk)
+
+def cat_file_batch(repo, names, contents=True, buffer=False, out=None):
+    """ Print "<sha> <type> <size>" for each object named in names (an
+    iterable of lines, like stdin), followed by its contents and a
+    newline if contents, like git cat-file --batch. Names that don't
+    resolve, and blank lines, print "<name> missing".
+
+    The same repository serves all the requests, so its packs, caches
+    and prefix index are only loaded once. Output is flushed after
+    each object, so a caller can wait for the answer to what it just
+    asked for, unless buffer. """
+    from .object_fun import object_find, AmbiguousObjectError
+    out = out or sys.stdout.buffer
+    for line in names:
+        name = line.rstrip("\n")
+        try:
+            sha = object_find(repo, name) if name else None
+        except AmbiguousObjectError:
+            out.write(f"{name} ambiguous\n".encode())
+        else:
+            _batch_object(repo, name, sha, contents, out)
+        if not buffer:
+            out.flush()
+
+def _batch_object(repo, name, sha, contents, out):
+    """ Print the batch output for one object """
+    from .object_fun import object_open, object_read_header
+    res = object_open(repo, sha) if sha and contents else None
+    header = res[:2] if res else (sha and object_read_header(repo, sha))
+    if not header:
+        out.write(f"{name} missing\n".encode())
+        return
+
+    out.write(f"{sha} {header[0].decode("ascii")} {header[1]}\n".encode())
+    if res:
+        with res[2] as stream:
+            for chunk in stream.chunks():
+                out.write(chunk)
+        out.write(b'\n')
+
+# Functions for hash-object
+def hash_object(path, fmt=b'blob', repo=None):
+    """ Hash the file at path (or stdin if path is None) as an object
+    of type fmt, and store it in repo if one is given. Returns the sha """
+    import tempfile
+    from .object_fun import object_write_stream, CHUNK_SIZE
+    if path is not None:
+        return object_write_stream(path, fmt=fmt, repo=repo)
+
+    # The size of stdin is unknown until it's exhausted, so spool it
+    # first. Small inputs stay in memory, big ones go to a temp file.
+    with tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE) as spool:
+        while chunk := sys.stdin.buffer.read(CHUNK_SIZE):
+            spool.write(chunk)
+        size = spool.tell()
+        spool.seek(0)
+        return object_write_stream(spool, size, fmt, repo)
+
+# Functions for rev-parse
+def rev_parse(repo, names, fmt=None, batch=False, out=None):
+    """ Print the sha each name resolves to, peeled to type fmt if given.
+    In batch mode names can be any iterable, like stdin: a name that
+    doesn't resolve, or a blank line, prints "<name> missing" instead of
+    stopping, so there is one output line per input line """
+    from .object_fun import object_find
+    out = out or sys.stdout
+    for name in names:
+        name = name.strip()
+        if not name and not batch:
+            continue
+        try:
+            sha = object_find(repo, name, fmt=fmt) if name else None
+        except Exception:
+            if not batch:
+                raise
+            sha = None
+        if sha is None:
+            if not batch:
+                raise Exception(f"Not a valid object name {name}")
+            out.write(f"{name} missing\n")
+        else:
+            out.write(sha + "\n")
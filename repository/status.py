@@ -0,0 +1,214 @@
+import os
+import stat
+import sys
+
+from utils.path import repo_file
+from .index import index_read, index_write
+from .add import hash_file
+from .ignore import GitIgnore
+from .worktree import walk_worktree
+from .refs import ref_resolve
+from .tree import tree_resolve, tree_flatten
+
+# Letters of git status --short for each kind of change, in the index
+# (first column) and in the worktree (second one)
+STAGED_CODES = {"new file": "A", "modified": "M", "deleted": "D"}
+UNSTAGED_CODES = {"modified": "M", "deleted": "D"}
+
+
+def stat_matches(entry, st, filemode=True):
+    """Whether the stat data of the file st is the one recorded in the
+    index entry, in which case the file is assumed unchanged.  Fields
+    are compared the way they're stored in the index, on 32 bits."""
+    if stat.S_ISLNK(st.st_mode) != (entry.mode == 0o120000):
+        return False
+    if filemode and not stat.S_ISLNK(st.st_mode) and \
+       bool(st.st_mode & 0o111) != (entry.mode == 0o100755):
+        return False
+
+    return (st.st_mtime_ns == entry.mtime and
+            st.st_ctime_ns == entry.ctime and
+            st.st_size & 0xffffffff == entry.fsize and
+            st.st_ino & 0xffffffff == entry.ino & 0xffffffff and
+            st.st_dev & 0xffffffff == entry.dev & 0xffffffff and
+            st.st_uid & 0xffffffff == entry.uid and
+            st.st_gid & 0xffffffff == entry.gid)
+
+def entry_check(repo, index, entry, st, filemode=True):
+    """Check index entry against st, the lstat of its file (None if it
+    is missing).  Return (state, refreshed): state is None if the file
+    is unchanged, else "modified" or "deleted"; refreshed is a new entry
+    with up to date stat data if only that changed.
+
+    The file is only rehashed when its stat data changed, or when the
+    entry is racily clean."""
+    # A directory in place of a file counts as a deletion too
+    if st is None or stat.S_ISDIR(st.st_mode):
+        return "deleted", None
+
+    if stat_matches(entry, st, filemode) and not index.is_racy(entry):
+        return None, None
+
+    new = hash_file(repo, entry.name, write=False)
+    if new.sha != entry.sha or (filemode and new.mode != entry.mode):
+        return "modified", None
+
+    # Same content, the file was just touched (or is racy)
+    new.mode = entry.mode
+    new.flags = entry.flags
+    return None, new
+
+def worktree_changes(repo, index, jobs=None):
+    """Compare the worktree of repo with index, yielding (state, path)
+    pairs as soon as they are found, state being "modified", "deleted"
+    or "untracked".
+
+    The worktree is walked in parallel, skipping ignored directories,
+    and the stat results of the walk are used to check the entries. Once
+    the generator is exhausted, refreshed stat data is in index."""
+    filemode = repo.conf.getboolean("core", "filemode", fallback=True)
+    ignore = GitIgnore(repo)
+
+    # Ignored files and directories are still walked if they're tracked
+    tracked_dirs = set()
+    for entry in index:
+        path = entry.name
+        while "/" in path:
+            path = path.rsplit("/", 1)[0]
+            if path in tracked_dirs:
+                break
+            tracked_dirs.add(path)
+
+    def skip(path, is_dir):
+        if is_dir:
+            return path not in tracked_dirs and ignore(path, True)
+        return index.find(path) is None and ignore(path, False)
+
+    seen = set()
+    refreshed = []
+    for path, st in walk_worktree(repo, skip, jobs):
+        entry = index.find(path)
+        if entry is None:
+            yield "untracked", path
+            continue
+
+        seen.add(path)
+        state, new = entry_check(repo, index, entry, st, filemode)
+        if state:
+            yield state, path
+        elif new:
+            refreshed.append(new)
+
+    # Entries the walk didn't meet: deleted, or replaced by something
+    # that isn't a file
+    for entry in index:
+        if entry.name in seen:
+            continue
+        try:
+            st = os.lstat(os.path.join(repo.worktree, entry.name))
+        except (FileNotFoundError, NotADirectoryError):
+            st = None
+        state, new = entry_check(repo, index, entry, st, filemode)
+        if state:
+            yield state, entry.name
+        elif new:
+            refreshed.append(new)
+
+    if refreshed:
+        index.add_entries(refreshed)
+
+def index_changes(repo, index):
+    """Compare the tree of HEAD with index.  Return the list of (path,
+    state) of the staged changes, sorted by path, state being "new
+    file", "modified" or "deleted"."""
+    head = ref_resolve(repo, "HEAD")
+    leaves = {}
+    if head:
+        leaves = {leaf.path: leaf for leaf in tree_flatten(repo, tree_resolve(repo, head))}
+
+    changes = []
+    for entry in index:
+        leaf = leaves.pop(entry.name, None)
+        if leaf is None:
+            changes.append((entry.name, "new file"))
+        elif bytes.fromhex(leaf.sha) != entry.sha or int(leaf.mode, 8) != entry.mode:
+            changes.append((entry.name, "modified"))
+    changes += [(path, "deleted") for path in leaves]
+    return sorted(changes)
+
+def head_branch(repo):
+    """Return the name of the current branch, or None if HEAD is detached."""
+    with open(repo_file(repo, "HEAD")) as f:
+        head = f.read().strip()
+    if head.startswith("ref: refs/heads/"):
+        return head[16:]
+    return None
+
+def status(repo, out=None, short=False, jobs=None):
+    """Print the status of the worktree of repo, like git status.  With
+    short, print one line per change as they're found, like git status
+    --short, instead of waiting for the whole walk to sort them."""
+    out = out or sys.stdout
+    index = index_read(repo)
+    # Comparing the index with HEAD doesn't touch the worktree: it's
+    # done first
+    staged = index_changes(repo, index)
+    staged_states = dict(staged)
+
+    changes = {"modified": [], "deleted": [], "untracked": []}
+    for state, path in worktree_changes(repo, index, jobs):
+        if short:
+            if state == "untracked":
+                out.write(f"?? {path}\n")
+            else:
+                staged_code = STAGED_CODES.get(staged_states.pop(path, None), " ")
+                out.write(f"{staged_code}{UNSTAGED_CODES[state]} {path}\n")
+            out.flush()
+        else:
+            changes[state].append(path)
+
+    # Save the refreshed stat data for next time
+    if index.dirty:
+        index_write(repo, index)
+
+    if short:
+        # Files only changed in the index
+        for path, state in sorted(staged_states.items()):
+            out.write(f"{STAGED_CODES[state]}  {path}\n")
+        return
+
+    branch = head_branch(repo)
+    if branch:
+        out.write(f"On branch {branch}\n")
+    else:
+        out.write("HEAD detached\n")
+
+    if staged:
+        out.write("\nChanges to be committed:\n")
+        for name, what in staged:
+            out.write(f"\t{what + ':':<12}{name}\n")
+
+    unstaged = sorted([(name, "modified") for name in changes["modified"]] +
+                      [(name, "deleted") for name in changes["deleted"]])
+    if unstaged:
+        out.write("\nChanges not staged for commit:\n")
+        for name, what in unstaged:
+            out.write(f"\t{what + ':':<12}{name}\n")
+
+    if changes["untracked"]:
+        out.write("\nUntracked files:\n")
+        for name in sorted(changes["untracked"]):
+            out.write(f"\t{name}\n")
+
+    if not (staged or unstaged or changes["untracked"]):
+        out.write("nothing to commit, working tree clean\n")
+
+def ls_files(repo, stage=False, out=None):
+    """Print the names of the index entries, with their mode, sha and
+    stage if stage."""
+    out = out or sys.stdout
+    for entry in index_read(repo):
+        if stage:
+            out.write(f"{entry.mode:06o} {entry.sha.hex()} {entry.stage}\t{entry.name}\n")
+        else:
+            out.write(f"{entry.name}\n")
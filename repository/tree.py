@@ -0,0 +1,112 @@
+import sys
+
+from .objects import GitTree, GitTreeLeaf
+from .object_fun import object_read, object_find
+
+EMPTY_TREE = GitTree(b'')
+
+
+def leaf_type(mode):
+    """Object type of a tree entry with mode."""
+    if mode.endswith(b'40000'):
+        return "tree"
+    if mode == b'160000':
+        return "commit"
+    return "blob"
+
+
+def tree_read(repo, sha):
+    """Read tree sha, or raise if it isn't one."""
+    obj = object_read(repo, sha)
+    if obj is None or obj.fmt != b'tree':
+        raise Exception(f"Not a tree: {sha}")
+    return obj
+
+def tree_resolve(repo, name):
+    """Return the sha of the tree named by name, following tags and
+    commits to their tree."""
+    sha = object_find(repo, name, fmt=b'tree')
+    if sha is None:
+        raise Exception(f"Not a valid tree name {name}")
+    return sha
+
+def tree_lookup(repo, sha, path):
+    """Return the GitTreeLeaf for path (with / separators) in tree sha,
+    or None.  Each level is a binary search."""
+    parts = path.strip("/").split("/")
+    for depth, part in enumerate(parts):
+        tree = tree_read(repo, sha)
+        i = tree.find(part.encode("utf8", "surrogateescape"))
+        if i is None:
+            return None
+        if depth == len(parts) - 1:
+            return GitTreeLeaf(tree.mode(i), path.strip("/"), tree.sha(i).hex())
+        if not tree.is_tree(i):
+            return None
+        sha = tree.sha(i).hex()
+
+def tree_flatten(repo, sha, prefix=""):
+    """Yield a GitTreeLeaf, with its full path, for every entry that
+    isn't a tree below tree sha, in tree order."""
+    tree = tree_read(repo, sha)
+    for i in range(len(tree)):
+        path = prefix + tree.name(i).decode("utf8", "surrogateescape")
+        if tree.is_tree(i):
+            yield from tree_flatten(repo, tree.sha(i).hex(), path + "/")
+        else:
+            yield GitTreeLeaf(tree.mode(i), path, tree.sha(i).hex())
+
+def tree_diff(repo, old, new, prefix=""):
+    """Compare the trees old and new (shas, or None for an empty tree).
+    Yield (path, old_leaf, new_leaf) for every file that differs, a
+    missing side being None.
+
+    Both trees are sorted the same way, so their entries are merged in
+    one pass, and subtrees with the same sha on both sides are skipped
+    without being read."""
+    if old == new:
+        return
+    a = tree_read(repo, old) if old else EMPTY_TREE
+    b = tree_read(repo, new) if new else EMPTY_TREE
+
+    def leaf(tree, i, path):
+        return GitTreeLeaf(tree.mode(i), path, tree.sha(i).hex())
+
+    def one_side(tree, i, path, deleted):
+        if tree.is_tree(i):
+            sha = tree.sha(i).hex()
+            yield from tree_diff(repo, sha if deleted else None, None if deleted else sha, path + "/")
+        elif deleted:
+            yield path, leaf(tree, i, path), None
+        else:
+            yield path, None, leaf(tree, i, path)
+
+    i = j = 0
+    while i < len(a) or j < len(b):
+        key_a = a.key(i) if i < len(a) else None
+        key_b = b.key(j) if j < len(b) else None
+
+        if key_b is None or (key_a is not None and key_a < key_b):
+            yield from one_side(a, i, prefix + a.name(i).decode("utf8", "surrogateescape"), True)
+            i += 1
+        elif key_a is None or key_b < key_a:
+            yield from one_side(b, j, prefix + b.name(j).decode("utf8", "surrogateescape"), False)
+            j += 1
+        else:
+            if a.sha(i) != b.sha(j) or a.mode(i) != b.mode(j):
+                path = prefix + a.name(i).decode("utf8", "surrogateescape")
+                if a.is_tree(i):
+                    yield from tree_diff(repo, a.sha(i).hex(), b.sha(j).hex(), path + "/")
+                else:
+                    yield path, leaf(a, i, path), leaf(b, j, path)
+            i += 1
+            j += 1
+
+def ls_tree(repo, name, recursive=False, out=None):
+    """Print the entries of the tree named by name, like git ls-tree.
+    With recursive, subtrees are listed instead of shown."""
+    out = out or sys.stdout
+    sha = tree_resolve(repo, name)
+    leaves = tree_flatten(repo, sha) if recursive else tree_read(repo, sha)
+    for mode, path, child in leaves:
+        out.write(f"{int(mode, 8):06o} {leaf_type(mode)} {child}\t{path}\n")
@@ -0,0 +1,55 @@
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# A file found in the worktree: its path relative to the worktree (with
+# / separators) and its lstat result
+WorktreeEntry = namedtuple("WorktreeEntry", ["path", "stat"])
+
+
+def _default_jobs():
+    # Directory scans are I/O bound, same default as ThreadPoolExecutor
+    return min(32, (os.cpu_count() or 1) + 4)
+
+def worktree_scan_dir(root, directory, ignore=None):
+    """Scan one directory of the worktree at root.  Return the list of
+    WorktreeEntry for its files and the list of its subdirectories,
+    without those ignore(path, is_dir) says to skip."""
+    files = []
+    dirs = []
+    with os.scandir(os.path.join(root, directory)) as it:
+        for entry in it:
+            path = directory + "/" + entry.name if directory else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name == ".git" or (ignore and ignore(path, True)):
+                    continue
+                dirs.append(path)
+            elif not (ignore and ignore(path, False)):
+                # DirEntry caches this, and it runs in the worker thread
+                files.append(WorktreeEntry(path, entry.stat(follow_symlinks=False)))
+    return files, dirs
+
+def walk_worktree(repo, ignore=None, jobs=None, start=""):
+    """Walk the worktree of repo (or its start subdirectory), yielding a
+    WorktreeEntry for every file as soon as its directory is scanned.
+
+    Directories are scanned by a pool of at most jobs threads; as each
+    scan completes its subdirectories are queued. If ignore is given,
+    ignore(path, is_dir) is called for every entry and ignored
+    directories are not descended into. The order of the files is
+    unspecified. .git directories are always skipped."""
+    root = repo.worktree
+    with ThreadPoolExecutor(jobs or _default_jobs()) as pool:
+        pending = {pool.submit(worktree_scan_dir, root, start, ignore)}
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, dirs = future.result()
+                    for directory in dirs:
+                        pending.add(pool.submit(worktree_scan_dir, root, directory, ignore))
+                    yield from files
+        finally:
+            # The caller stopped early, don't scan what's left
+            for future in pending:
+                future.cancel()
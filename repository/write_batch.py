@@ -0,0 +1,150 @@
+import os
+import itertools
+
+from utils.path import repo_dir, repo_path
+
+# Objects are written to a temporary file in objects/, then renamed to
+# their final path, so that a crash never leaves a truncated object
+# behind. With core.fsyncObjectFiles, each file is also synced before
+# being renamed. That costs a disk flush per object: for bulk writes,
+# repo.write_batch() only moves the files into place when the batch
+# ends, after syncing them all in one pass. Batches also use the object
+# filter (see object_filter.py) to skip looking for new objects on disk,
+# and record what they wrote in it when they end.
+
+# Numbers the temporary files of this process
+_tmp_counter = itertools.count()
+
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _make_dir(repo, directory):
+    repo_dir(repo, *os.path.relpath(directory, repo.gitdir).split(os.sep), mkdir=True)
+
+
+class WriteBatch(object):
+    """Object files written during a batch, not moved into place yet."""
+
+    def __init__(self, repo):
+        from .object_filter import object_filter_load
+        self.repo = repo
+        # Temporary file of each final path
+        self.pending = dict()
+        # Directories known to exist, so each is only created once
+        self.dirs = set()
+        # Objects of the repository (None if there's no filter to use),
+        # and the ones written in the batch
+        self.filter = object_filter_load(repo)
+        self.written = []
+
+    def add(self, tmp, path):
+        if path in self.pending:
+            os.remove(tmp)
+        else:
+            self.pending[path] = tmp
+
+    def commit(self):
+        """Sync all the files, then move them into place, then sync the
+        directories they were moved to."""
+        for tmp in self.pending.values():
+            _fsync(tmp)
+
+        for path, tmp in self.pending.items():
+            directory = os.path.dirname(path)
+            if directory not in self.dirs:
+                _make_dir(self.repo, directory)
+                self.dirs.add(directory)
+            os.replace(tmp, path)
+
+        # Directory syncs make the renames durable (not possible on Windows)
+        if os.name == "posix":
+            for directory in self.dirs:
+                _fsync(directory)
+        self.pending.clear()
+
+        if self.written:
+            from .object_filter import object_filter_update
+            object_filter_update(self.repo, self.written)
+
+    def abort(self):
+        for tmp in self.pending.values():
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+        self.pending.clear()
+
+
+def object_tmp_open(repo):
+    """Create a temporary file in objects/ for an object being written.
+    Return its (fd, path).
+
+    This is on the path of every object written: names are made of the
+    pid and a counter, cheaper than tempfile's random ones, and objects/
+    is only checked for when creating the file fails."""
+    while True:
+        path = repo_path(repo, "objects", f"tmp_obj_{os.getpid()}_{next(_tmp_counter)}")
+        try:
+            return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o444), path
+        except FileExistsError:
+            # Left over by a process that had the same pid
+            continue
+        except FileNotFoundError:
+            repo_dir(repo, "objects", mkdir=True)
+
+def object_known_new(repo, sha):
+    """Whether object sha is sure not to be in repo, going by the filter
+    of the write batch in progress: no need to look for it."""
+    return repo.batch is not None and repo.batch.filter is not None and sha not in repo.batch.filter
+
+def object_written(repo, sha):
+    """Record that object sha was stored, for the filter: at the end of
+    the batch, or right away outside of one."""
+    if repo.batch is None:
+        from .object_filter import object_filter_update
+        object_filter_update(repo, [sha])
+        return
+    if repo.batch.filter is not None:
+        repo.batch.filter.add(sha)
+    repo.batch.written.append(sha)
+
+def object_file_pending(repo, path):
+    """Where to read the object file at path (under objects/) from: its
+    temporary file if it was written in the current batch, else path."""
+    if repo.batch is not None:
+        return repo.batch.pending.get(path, path)
+    return path
+
+def object_file_exists(repo, path):
+    return (repo.batch is not None and path in repo.batch.pending) or os.path.exists(path)
+
+def object_file_commit(repo, tmp, path, check=True):
+    """Move the object file tmp, complete, to path, unless there's
+    already one (if check). In a batch, that's only done when it ends."""
+    if check and object_file_exists(repo, path):
+        os.remove(tmp)
+    elif repo.batch is not None:
+        repo.batch.add(tmp, path)
+    else:
+        if repo.fsync_objects:
+            _fsync(tmp)
+        _make_dir(repo, os.path.dirname(path))
+        os.replace(tmp, path)
+
+def object_file_write(repo, path, data, check=True):
+    """Write data to the object file at path (under objects/), unless
+    it exists already (if check)."""
+    fd, tmp = object_tmp_open(repo)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    object_file_commit(repo, tmp, path, check)
@@ -0,0 +1,94 @@
+import os
+import shutil
+import unittest
+import tempfile
+import subprocess
+from unittest.mock import patch
+
+from repository.repofun import repo_create
+from repository.index import index_read
+from repository.object_fun import object_read
+import repository.add
+from repository.add import add, add_batches
+
+class TestAddBatches(unittest.TestCase):
+    def test_balanced(self):
+        """Test that batches get about the same total size"""
+        sizes = [(f"f{i}", s) for i, s in enumerate([100, 90, 50, 40, 30, 10, 5, 5])]
+        batches = add_batches(sizes, 3)
+        totals = [sum(dict(sizes)[f] for f in b) for b in batches]
+
+        self.assertEqual(sorted(f for b in batches for f in b), sorted(dict(sizes)))
+        self.assertLessEqual(max(totals) - min(totals), 50)
+
+class TestAdd(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.repo = repo_create(self.test_dir)
+
+        self.files = {"a.txt": b"hello\n",
+                      "dir/b.txt": b"world\n",
+                      "dir/sub/big.bin": os.urandom(300000),
+                      "dir/sub/same.txt": b"hello\n"}
+        for name, data in self.files.items():
+            os.makedirs(os.path.dirname(os.path.join(self.test_dir, name)), exist_ok=True)
+            with open(os.path.join(self.test_dir, name), "wb") as f:
+                f.write(data)
+
+        self.original_dir = os.getcwd()
+        os.chdir(self.test_dir)
+
+    def tearDown(self):
+        os.chdir(self.original_dir)
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def check_index(self):
+        index = index_read(self.repo)
+        self.assertEqual([e.name for e in index], sorted(self.files))
+        for e in index:
+            self.assertEqual(object_read(self.repo, e.sha.hex()).serialize(), self.files[e.name])
+            self.assertEqual(e.fsize, len(self.files[e.name]))
+
+    def test_add_serial(self):
+        self.assertEqual(add(self.repo, ["."], jobs=1), len(self.files))
+        self.check_index()
+
+    @patch.object(repository.add, "STREAM_THRESHOLD", 1000)
+    def test_add_parallel(self):
+        add(self.repo, ["a.txt", "dir"], jobs=2)
+        self.check_index()
+
+    def test_add_updates(self):
+        add(self.repo, ["a.txt"], jobs=1)
+        with open("a.txt", "wb") as f:
+            f.write(b"changed\n")
+        self.files["a.txt"] = b"changed\n"
+        add(self.repo, ["."], jobs=1)
+        self.check_index()
+
+    def test_add_symlinks(self):
+        """ Symlinks are added as links, wherever they point """
+        outside = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, outside)
+        os.symlink(outside, "out")
+        os.symlink("a.txt", "dir/in")
+        add(self.repo, ["out", "dir/in"], jobs=1)
+
+        entries = {e.name: e for e in index_read(self.repo)}
+        self.assertEqual(sorted(entries), ["dir/in", "out"])
+        for name, target in [("out", outside), ("dir/in", "a.txt")]:
+            self.assertEqual(entries[name].mode, 0o120000)
+            self.assertEqual(object_read(self.repo, entries[name].sha.hex()).serialize(), target.encode())
+
+    def test_add_missing(self):
+        with self.assertRaises(Exception):
+            add(self.repo, ["nope"], jobs=1)
+
+    @unittest.skipUnless(shutil.which("git"), "needs git to check the index")
+    def test_git_reads_index(self):
+        add(self.repo, ["."], jobs=2)
+        out = subprocess.run(["git", "status", "--porcelain"], check=True,
+                             capture_output=True).stdout.decode()
+        # Everything staged, and git agrees with the stat data
+        self.assertEqual(sorted(out.splitlines()), sorted(f"A  {name}" for name in self.files))
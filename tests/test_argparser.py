@@ -0,0 +1,36 @@
+import os
+import sys
+import unittest
+import subprocess
+
+from utils.argparser_def import COMMANDS, command_of, define_argparser
+
+
+class TestArgparser(unittest.TestCase):
+    """ Building only the subparser of the command run must parse the same """
+
+    def test_command_of(self):
+        self.assertEqual(command_of(["log", "-n", "2"]), "log")
+        self.assertEqual(command_of(["-h"]), None)
+        self.assertEqual(command_of(["bogus", "init"]), None)
+        self.assertEqual(command_of([]), None)
+
+    def test_same_args(self):
+        full = define_argparser()
+        for argv in [["init"], ["cat-file", "-t", "HEAD"], ["log", "--oneline", "a", "b"],
+                     ["gc", "--window", "5"], ["rev-list", "--count", "HEAD"]]:
+            self.assertEqual(define_argparser(command_of(argv)).parse_args(argv),
+                             full.parse_args(argv))
+
+    def test_all_commands(self):
+        for name in COMMANDS:
+            parser = define_argparser(name)
+            self.assertEqual(list(parser._subparsers._group_actions[0].choices), [name])
+
+    def test_lazy_imports(self):
+        # Parsing the command line alone doesn't load the object store
+        code = ("import sys, mygit; mygit.define_argparser(mygit.command_of(['init'])); "
+                "print(any(m.startswith('repository') for m in sys.modules))")
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(out.stdout.strip(), "False")
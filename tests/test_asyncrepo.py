@@ -0,0 +1,69 @@
+import os
+import shutil
+import asyncio
+import unittest
+import tempfile
+
+from repository.repofun import repo_create
+from repository.objects import GitBlob
+from repository.object_fun import object_write
+from repository.asyncrepo import AsyncRepository
+
+
+class TestAsyncRepository(unittest.TestCase):
+    """ The async facade must read and write like the blocking API """
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        repo_create(self.test_dir)
+        self.arepo = AsyncRepository(self.test_dir, max_workers=4)
+        self.blobs = {object_write(GitBlob(d), self.arepo.repo): d
+                      for d in (os.urandom(100 + i) for i in range(20))}
+
+    def tearDown(self):
+        self.arepo.close()
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def test_read_objects(self):
+        shas = list(self.blobs)
+        objs = asyncio.run(self.arepo.read_objects(shas + ["0" * 40]))
+        self.assertEqual([o.serialize() for o in objs[:-1]], [self.blobs[s] for s in shas])
+        self.assertIsNone(objs[-1])
+
+    def test_coalesce(self):
+        sha = next(iter(self.blobs))
+        submitted = []
+        submit = self.arepo.executor.submit
+
+        def counting_submit(fn, *args):
+            submitted.append(args)
+            return submit(fn, *args)
+        self.arepo.executor.submit = counting_submit
+
+        objs = asyncio.run(self.arepo.read_objects([sha] * 50))
+        self.assertEqual(len(submitted), 1)
+        self.assertTrue(all(o is objs[0] for o in objs))
+        # Nothing is left in flight
+        self.assertEqual(self.arepo._reads, {})
+
+    def test_cancel_one_waiter(self):
+        sha = next(iter(self.blobs))
+
+        async def run():
+            first = asyncio.ensure_future(self.arepo.read_object(sha))
+            second = asyncio.ensure_future(self.arepo.read_object(sha))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        self.assertEqual(asyncio.run(run()).serialize(), self.blobs[sha])
+
+    def test_write_and_resolve(self):
+        async def run():
+            sha = await self.arepo.write_object(GitBlob(b'async data'))
+            return sha, await self.arepo.resolve(sha[:8]), await self.arepo.read_object(sha)
+
+        sha, resolved, obj = asyncio.run(run())
+        self.assertEqual(resolved, sha)
+        self.assertEqual(obj.serialize(), b'async data')
@@ -0,0 +1,67 @@
+import io
+import os
+import shutil
+import unittest
+import tempfile
+from unittest.mock import patch
+
+from repository.GitRepository import GitRepository
+from repository.repofun import cat_file_batch
+
+from test_packfile import git, git_objects, make_history
+
+
+class CountingBuffer(io.BytesIO):
+    """ A BytesIO counting the calls to flush """
+    flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+
+
+@unittest.skipUnless(shutil.which("git"), "needs git to compare with")
+class TestCatFileBatch(unittest.TestCase):
+    """ Batch output must be byte for byte the same as git's """
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        make_history(self.test_dir, commits=5)
+        self.repo = GitRepository(self.test_dir)
+        self.names = [sha for sha, _, _ in git_objects(self.test_dir)]
+        self.names += ["HEAD", "HEAD~2", "master", "0" * 40, "nope", "", self.names[0][:10]]
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def check(self, contents):
+        data = "".join(name + "\n" for name in self.names)
+        out = CountingBuffer()
+        cat_file_batch(self.repo, io.StringIO(data), contents=contents, out=out)
+        option = "--batch" if contents else "--batch-check"
+        self.assertEqual(out.getvalue(), git(self.test_dir, "cat-file", option, data=data.encode()))
+        # Flushed for every object
+        self.assertEqual(out.flushes, len(self.names))
+
+    def test_loose(self):
+        self.check(contents=True)
+        self.check(contents=False)
+
+    def test_packed(self):
+        git(self.test_dir, "repack", "-a", "-d", "-q")
+        self.check(contents=True)
+        self.check(contents=False)
+
+    def test_buffer(self):
+        out = CountingBuffer()
+        cat_file_batch(self.repo, ["HEAD\n"] * 10, contents=False, buffer=True, out=out)
+        self.assertEqual(out.flushes, 0)
+        self.assertEqual(len(out.getvalue().splitlines()), 10)
+
+    def test_errors(self):
+        # Only ambiguous names are reported, other errors propagate
+        out = io.BytesIO()
+        with patch("repository.object_fun.object_find", side_effect=OSError("broken")):
+            with self.assertRaises(OSError):
+                cat_file_batch(self.repo, ["HEAD\n"], out=out)
+        self.assertEqual(out.getvalue(), b'')
@@ -0,0 +1,105 @@
+import os
+import shutil
+import unittest
+import tempfile
+
+from repository.GitRepository import GitRepository
+from repository.checkout import checkout
+
+from test_packfile import git
+
+
+@unittest.skipUnless(shutil.which("git"), "needs git to build history")
+class TestCheckout(unittest.TestCase):
+    """ Checked out worktrees and indexes must be clean for git """
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        git(self.test_dir, "init", "-q")
+        git(self.test_dir, "config", "user.name", "Test")
+        git(self.test_dir, "config", "user.email", "test@example.com")
+
+        for i in range(200):
+            self.write(f"d{i % 5}/e{i % 3}/f{i}.txt", f"file {i}\n")
+        self.write("run.sh", "#!/bin/sh\n")
+        os.chmod(os.path.join(self.test_dir, "run.sh"), 0o755)
+        os.symlink("d1", os.path.join(self.test_dir, "link"))
+        git(self.test_dir, "add", "-A")
+        git(self.test_dir, "commit", "-q", "-m", "one")
+
+        git(self.test_dir, "checkout", "-q", "-b", "two")
+        git(self.test_dir, "rm", "-q", "-r", "d2")
+        self.write("d3/e0/f3.txt", "changed\n")
+        self.write("new/deep/file", "new\n")
+        git(self.test_dir, "add", "-A")
+        git(self.test_dir, "commit", "-q", "-m", "two")
+        git(self.test_dir, "checkout", "-q", "master")
+        self.repo = GitRepository(self.test_dir)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def write(self, path, data):
+        path = os.path.join(self.test_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(data)
+
+    def assertClean(self, branch):
+        self.assertEqual(git(self.test_dir, "status", "--porcelain"), b'')
+        self.assertEqual(git(self.test_dir, "symbolic-ref", "HEAD").decode().strip(), f"refs/heads/{branch}")
+
+    def test_switch(self):
+        stats = checkout(self.repo, "two", jobs=4)
+        self.assertEqual((stats["written"], stats["removed"]), (2, 40))
+        self.assertClean("two")
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, "d2")))
+        self.assertEqual(set(stats["timings"]), {"read", "plan", "remove", "mkdir", "write", "index"})
+
+        stats = checkout(self.repo, "master", jobs=4)
+        self.assertEqual((stats["written"], stats["removed"]), (41, 1))
+        self.assertClean("master")
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, "new")))
+
+    def test_fresh(self):
+        # Everything is written when there's no index nor worktree
+        for name in os.listdir(self.test_dir):
+            if name != ".git":
+                path = os.path.join(self.test_dir, name)
+                shutil.rmtree(path) if os.path.isdir(path) and not os.path.islink(path) else os.remove(path)
+        os.remove(os.path.join(self.test_dir, ".git", "index"))
+
+        stats = checkout(self.repo, "master", force=True, jobs=4)
+        self.assertEqual(stats["written"], 202)
+        self.assertClean("master")
+        self.assertTrue(os.access(os.path.join(self.test_dir, "run.sh"), os.X_OK))
+        self.assertEqual(os.readlink(os.path.join(self.test_dir, "link")), "d1")
+
+        # Nothing to do the second time
+        stats = checkout(self.repo, "master", force=True)
+        self.assertEqual((stats["written"], stats["unchanged"]), (0, 202))
+
+    def test_local_changes(self):
+        self.write("d3/e0/f3.txt", "local\n")
+        with self.assertRaises(Exception):
+            checkout(self.repo, "two")
+        self.assertEqual(git(self.test_dir, "symbolic-ref", "HEAD").strip(), b'refs/heads/master')
+
+        # Changes to files that don't differ are kept
+        self.write("d3/e0/f3.txt", "file 3\n")
+        self.write("d0/e0/f0.txt", "local\n")
+        checkout(self.repo, "two")
+        with open(os.path.join(self.test_dir, "d0/e0/f0.txt")) as f:
+            self.assertEqual(f.read(), "local\n")
+
+        # Unless forced
+        checkout(self.repo, "master", force=True)
+        self.assertClean("master")
+
+    def test_detached(self):
+        sha = git(self.test_dir, "rev-parse", "two~1").decode().strip()
+        stats = checkout(self.repo, "two~1")
+        self.assertIsNone(stats["branch"])
+        with open(os.path.join(self.test_dir, ".git", "HEAD")) as f:
+            self.assertEqual(f.read(), sha + "\n")
@@ -0,0 +1,100 @@
+import io
+import os
+import shutil
+import hashlib
+import unittest
+import tempfile
+
+from repository.repofun import repo_create
+from repository.GitRepository import GitRepository
+from repository.objects import GitBlob
+from repository.object_fun import object_read, object_write, object_write_stream, object_read_header, \
+    object_open, object_find
+from repository.chunked import chunk_stream, chunked_path, CHUNK_MIN, CHUNK_MAX
+
+
+def chunks_of(data):
+    return list(chunk_stream(io.BytesIO(data), len(data)))
+
+
+class TestChunking(unittest.TestCase):
+    """ Chunk boundaries only depend on the bytes around them """
+
+    def test_sizes(self):
+        data = os.urandom(4 * 1024 * 1024)
+        chunks = chunks_of(data)
+        self.assertEqual(b''.join(chunks), data)
+        self.assertTrue(all(CHUNK_MIN <= len(c) <= CHUNK_MAX for c in chunks[:-1]))
+        # Data without a boundary is cut at the maximum size
+        self.assertEqual([len(c) for c in chunks_of(b'\x00' * (CHUNK_MAX * 2 + 10))],
+                         [CHUNK_MAX, CHUNK_MAX, 10])
+
+    def test_shift(self):
+        data = os.urandom(4 * 1024 * 1024)
+        edited = data[:1000000] + b'inserted' + data[1000000:]
+        before, after = set(chunks_of(data)), chunks_of(edited)
+        # Only the chunk around the edit is new
+        self.assertLessEqual(len([c for c in after if c not in before]), 2)
+
+    def test_stream(self):
+        # Reading in small pieces cuts the same chunks
+        data = os.urandom(1024 * 1024)
+
+        class Trickle(io.BytesIO):
+            def read(self, n=-1):
+                return super().read(min(n, 1000))
+        self.assertEqual(list(chunk_stream(Trickle(data), len(data))), chunks_of(data))
+
+
+class TestChunkedStorage(unittest.TestCase):
+    """ Chunked blobs read like any other object """
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        repo_create(self.test_dir)
+        conf = GitRepository(self.test_dir).conf
+        conf.set("core", "chunkedStorage", "true")
+        conf.set("core", "chunkedStorageThreshold", "64k")
+        with open(os.path.join(self.test_dir, ".git", "config"), "w") as f:
+            conf.write(f)
+        self.repo = GitRepository(self.test_dir)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def chunk_files(self):
+        top = chunked_path(self.repo, "data")
+        return sum(len(files) for _, _, files in os.walk(top))
+
+    def test_roundtrip(self):
+        data = os.urandom(2 * 1024 * 1024)
+        sha = object_write(GitBlob(data), self.repo)
+        self.assertEqual(sha, hashlib.sha1(b'blob %d\x00' % len(data) + data).hexdigest())
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, ".git", "objects", sha[:2], sha[2:])))
+
+        self.assertEqual(object_read(self.repo, sha).serialize(), data)
+        self.assertEqual(object_read_header(self.repo, sha), (b'blob', len(data)))
+        self.assertEqual(object_find(self.repo, sha[:10]), sha)
+
+        fmt, size, stream = object_open(self.repo, sha)
+        with stream:
+            self.assertEqual(stream.read(10), data[:10])
+            self.assertEqual(b''.join(stream.chunks()), data[10:])
+
+        # Small blobs are still stored whole
+        small = object_write(GitBlob(b'small'), self.repo)
+        self.assertTrue(os.path.exists(os.path.join(self.test_dir, ".git", "objects", small[:2], small[2:])))
+
+    def test_dedup(self):
+        data = os.urandom(4 * 1024 * 1024)
+        object_write(GitBlob(data), self.repo)
+        count = self.chunk_files()
+
+        edited = data[:3000000] + b'a few more bytes' + data[3000000:]
+        path = os.path.join(self.test_dir, "file")
+        with open(path, "wb") as f:
+            f.write(edited)
+        sha = object_write_stream(path, repo=self.repo)
+        self.assertLessEqual(self.chunk_files(), count + 2)
+        self.assertEqual(object_read(self.repo, sha).serialize(), edited)
@@ -0,0 +1,163 @@
+import io
+import os
+import shutil
+import unittest
+import tempfile
+import subprocess
+
+from repository.GitRepository import GitRepository
+from repository.objects import GitCommit, kvlm_parse, kvlm_serialize
+from repository.object_fun import object_read
+from repository.commit_graph import commit_graph_write, commit_graph_load
+from repository.history import CommitSource, log, rev_list, rev_list_args, merge_bases, commit_resolve
+
+from test_packfile import git
+
+
+def commit(cwd, name, date, *merge):
+    """Commit a file called name at the given timestamp, or merge the
+    branches in merge with name as message"""
+    env = dict(os.environ, GIT_AUTHOR_DATE=f"{date} +0200", GIT_COMMITTER_DATE=f"{date} +0200")
+    if merge:
+        cmd = ["merge", "-q", "--no-ff", "-m", name, *merge]
+    else:
+        with open(os.path.join(cwd, name), "w") as f:
+            f.write(name + "\n")
+        git(cwd, "add", name)
+        cmd = ["commit", "-q", "-m", name]
+    subprocess.run(["git", *cmd], cwd=cwd, env=env, check=True, capture_output=True)
+
+def make_branchy_history(cwd):
+    """Three branches forked from master, merged back by an octopus, then
+    a merge of a fourth branch and a tag"""
+    git(cwd, "init", "-q", "-b", "master")
+    git(cwd, "config", "user.name", "Test")
+    git(cwd, "config", "user.email", "test@example.com")
+
+    date = 1700000000
+    for i in range(5):
+        date += 60
+        commit(cwd, f"base{i}", date)
+    for branch in ["one", "two", "three", "four"]:
+        git(cwd, "branch", branch)
+    for branch in ["one", "two", "three"]:
+        git(cwd, "checkout", "-q", branch)
+        for i in range(3):
+            date += 60
+            commit(cwd, f"{branch}{i}", date)
+    git(cwd, "checkout", "-q", "master")
+    date += 60
+    commit(cwd, "octopus", date, "one", "two", "three")
+    git(cwd, "checkout", "-q", "four")
+    date += 60
+    commit(cwd, "four0", date)
+    git(cwd, "checkout", "-q", "master")
+    date += 60
+    commit(cwd, "merge", date, "four")
+    git(cwd, "tag", "-a", "-m", "release", "v1", "master~1")
+
+
+class TestCommitParse(unittest.TestCase):
+    """ Commits must parse and serialize back to the same bytes """
+
+    raw = (b'tree 29ff16c9c14e2652b22f8b78bb08a5a07930c147\n'
+           b'parent 206941306e8a8af65b66eaaaea388a7ae24d49a0\n'
+           b'parent 0e6cfc8b0c5e3e33d8b4b5f14b2c2ad5b3f4f7f1\n'
+           b'author Thibault Polge <thibault@thb.lt> 1527025023 +0200\n'
+           b'committer Thibault Polge <thibault@thb.lt> 1527025044 +0200\n'
+           b'gpgsig -----BEGIN PGP SIGNATURE-----\n'
+           b' \n'
+           b' iQIzBAABCAAdFiEExwXquOM8bWb4Q2zVGxM2FxoLkGQFAlsEjZQACgkQGxM2FxoL\n'
+           b' -----END PGP SIGNATURE-----\n'
+           b'\n'
+           b'Create first draft\n')
+
+    def test_roundtrip(self):
+        kvlm = kvlm_parse(self.raw)
+        self.assertEqual(kvlm[None], b'Create first draft\n')
+        self.assertTrue(kvlm[b'gpgsig'].startswith(b'-----BEGIN PGP SIGNATURE-----\n\niQIz'))
+        self.assertEqual(kvlm_serialize(kvlm), self.raw)
+
+    def test_fields(self):
+        c = GitCommit(self.raw)
+        self.assertEqual(c.tree(), "29ff16c9c14e2652b22f8b78bb08a5a07930c147")
+        self.assertEqual(c.parents(), ["206941306e8a8af65b66eaaaea388a7ae24d49a0",
+                                       "0e6cfc8b0c5e3e33d8b4b5f14b2c2ad5b3f4f7f1"])
+        self.assertEqual(c.date(), 1527025044)
+
+
+@unittest.skipUnless(shutil.which("git"), "needs git to build history")
+class TestCommitGraph(unittest.TestCase):
+    """ The commit-graph must be readable by git, and history queries
+    must give the same answers as git's, with and without it """
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        make_branchy_history(self.test_dir)
+        self.repo = GitRepository(self.test_dir)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def git_lines(self, *args):
+        return git(self.test_dir, *args).decode().splitlines()
+
+    def test_git_verifies(self):
+        self.assertEqual(commit_graph_write(self.repo), 17)
+        git(self.test_dir, "commit-graph", "verify")
+
+    def test_entries(self):
+        commit_graph_write(self.repo)
+        graph = commit_graph_load(self.repo)
+        for line in self.git_lines("rev-list", "--all", "--parents"):
+            sha, *parents = line.split()
+            pos = graph.find(bytes.fromhex(sha))
+            self.assertIsNotNone(pos)
+            positions, generation, date = graph.entry(pos)
+            self.assertEqual([graph.oid(p).hex() for p in positions], parents)
+            c = object_read(self.repo, sha)
+            self.assertEqual(graph.tree(pos).hex(), c.tree())
+            self.assertEqual(date, c.date())
+
+    def test_walks_without_inflating(self):
+        commit_graph_write(self.repo)
+        source = CommitSource(self.repo)
+        head = commit_resolve(self.repo, "HEAD")
+        self.assertEqual(len(rev_list(self.repo, [head], source=source)), 17)
+        # Everything came from the graph
+        self.assertEqual(source.graph.count, len(source.cache))
+
+    def check_queries(self):
+        repo = GitRepository(self.test_dir)
+        for revs in (["HEAD"], ["master", "^one"], ["one..master"], ["four", "^two", "^three"], ["v1"]):
+            include, exclude = rev_list_args(repo, revs)
+            self.assertEqual(rev_list(repo, include, exclude),
+                             self.git_lines("rev-list", *revs, "--"))
+
+        for one, two in (("one", "two"), ("four", "master"), ("master", "one"), ("v1", "four")):
+            bases = merge_bases(repo, commit_resolve(repo, one), commit_resolve(repo, two))
+            self.assertEqual(sorted(bases), sorted(self.git_lines("merge-base", "--all", one, two)))
+
+        out = io.StringIO()
+        log(repo, [commit_resolve(repo, "HEAD")], oneline=True, out=out)
+        self.assertEqual(out.getvalue().splitlines(), self.git_lines("log", "--oneline"))
+
+        out = io.StringIO()
+        log(repo, [commit_resolve(repo, "HEAD")], max_count=3, out=out)
+        self.assertEqual(out.getvalue(), git(self.test_dir, "log", "-n", "3").decode())
+
+    def test_queries_without_graph(self):
+        self.check_queries()
+
+    def test_queries_with_graph(self):
+        commit_graph_write(self.repo)
+        self.check_queries()
+
+    def test_queries_with_stale_graph(self):
+        # Commits made after the graph was written are parsed instead
+        commit_graph_write(self.repo)
+        git(self.test_dir, "checkout", "-q", "one")
+        commit(self.test_dir, "late", 1800000000)
+        git(self.test_dir, "checkout", "-q", "master")
+        self.check_queries()
@@ -2,6 +2,7 @@ import os
 import shutil
 import unittest
 import tempfile
+from unittest import mock
 
 from repository.repofun import repo_find,repo_create 
 from repository.GitRepository import GitRepository
@@ -100,6 +101,59 @@ class TestFindRepo(unittest.TestCase):
         with self.assertRaises(Exception):
             repo_find(self.nogit_dir)
 
+    def test_cached(self):
+        """ Finding a repo again, from it or below, gives the same object """
+        nested = os.path.join(self.git_dir, "a", "b", "c")
+        os.makedirs(nested)
+        repo = repo_find(self.git_dir)
+        self.assertIs(repo_find(nested), repo)
+        self.assertIs(repo_find(os.path.join(self.git_dir, "a")), repo)
+        self.assertEqual(repo.worktree, os.path.realpath(self.git_dir))
+
+        # Until its config changes
+        config = os.path.join(self.git_dir, ".git", "config")
+        with open(config, "a") as f:
+            f.write("[user]\n\tname = someone\n")
+        found = repo_find(nested)
+        self.assertIsNot(found, repo)
+        self.assertEqual(found.conf.get("user", "name"), "someone")
+
+    def test_nested_created(self):
+        """ A repository created after a lookup is found from inside it """
+        nested = os.path.join(self.git_dir, "a", "b")
+        os.makedirs(nested)
+        outer = repo_find(nested)
+        self.assertEqual(outer.worktree, os.path.realpath(self.git_dir))
+
+        inner = repo_create(nested)
+        self.assertEqual(repo_find(nested).gitdir, os.path.realpath(inner.gitdir))
+
+        # Even if it's not made by repo_create: its parent's mtime changed
+        other = os.path.join(self.git_dir, "c")
+        os.makedirs(other)
+        self.assertEqual(repo_find(other).worktree, os.path.realpath(self.git_dir))
+        shutil.copytree(inner.gitdir, os.path.join(other, ".git"))
+        self.assertEqual(repo_find(other).worktree, os.path.realpath(other))
+
+    def test_ceiling(self):
+        """ The search doesn't go into GIT_CEILING_DIRECTORIES """
+        nested = os.path.join(self.git_dir, "a", "b")
+        os.makedirs(nested)
+        with mock.patch.dict(os.environ, GIT_CEILING_DIRECTORIES=os.path.join(self.git_dir, "a")):
+            self.assertIsNone(repo_find(nested, required=False))
+        with mock.patch.dict(os.environ, GIT_CEILING_DIRECTORIES=os.path.dirname(self.git_dir)):
+            self.assertIsNotNone(repo_find(nested, required=False))
+
+    def test_git_dir(self):
+        """ With GIT_DIR, there's no search """
+        gitdir = os.path.join(self.git_dir, ".git")
+        with mock.patch.dict(os.environ, GIT_DIR=gitdir, GIT_WORK_TREE=self.nogit_dir):
+            repo = repo_find(self.nogit_dir)
+            self.assertEqual(repo.gitdir, os.path.realpath(gitdir))
+            self.assertEqual(repo.worktree, os.path.realpath(self.nogit_dir))
+        with mock.patch.dict(os.environ, GIT_DIR=os.path.join(self.nogit_dir, ".git")):
+            self.assertIsNone(repo_find(self.git_dir, required=False))
+
 
 
 
@@ -0,0 +1,125 @@
+import io
+import os
+import shutil
+import unittest
+import tempfile
+
+from repository.repofun import repo_create
+from repository.ignore import GitIgnore, IgnoreFile, gitignore_parse, glob_to_regex, ignore_file_load, check_ignore
+
+def rules(text):
+    return IgnoreFile(gitignore_parse(text.splitlines()))
+
+class TestIgnoreFile(unittest.TestCase):
+    """ Tests for the compiled rules of a single file """
+
+    def test_basename(self):
+        f = rules("*.o\n")
+        self.assertTrue(f.match("a.o", False))
+        self.assertTrue(f.match("dir/sub/a.o", False))
+        self.assertIsNone(f.match("a.c", False))
+
+    def test_anchored(self):
+        f = rules("/build\ndoc/*.html\n")
+        self.assertTrue(f.match("build", True))
+        self.assertIsNone(f.match("src/build", True))
+        self.assertTrue(f.match("doc/index.html", False))
+        # A single * doesn't cross directories
+        self.assertIsNone(f.match("doc/api/index.html", False))
+
+    def test_double_star(self):
+        f = rules("**/logs\nsrc/**/gen\nout/**\n")
+        self.assertTrue(f.match("a/b/logs", True))
+        self.assertTrue(f.match("logs", True))
+        self.assertTrue(f.match("src/gen", True))
+        self.assertTrue(f.match("src/x/y/gen", True))
+        self.assertTrue(f.match("out/x/y", False))
+        self.assertIsNone(f.match("out", True))
+
+    def test_negation_last_rule_wins(self):
+        f = rules("*.log\n!keep.log\n")
+        self.assertTrue(f.match("a.log", False))
+        self.assertFalse(f.match("keep.log", False))
+
+        f = rules("!keep.log\n*.log\n")
+        self.assertTrue(f.match("keep.log", False))
+
+    def test_dir_only(self):
+        f = rules("tmp/\n")
+        self.assertTrue(f.match("tmp", True))
+        self.assertIsNone(f.match("tmp", False))
+
+    def test_classes_and_escapes(self):
+        self.assertRegex("a1", "^" + glob_to_regex("a[0-9]") + "$")
+        self.assertNotRegex("ab", "^" + glob_to_regex("a[!b]") + "$")
+        f = rules("\\#notcomment\n\\!bang\nfile?.txt\n")
+        self.assertTrue(f.match("#notcomment", False))
+        self.assertTrue(f.match("!bang", False))
+        self.assertTrue(f.match("file1.txt", False))
+
+
+class TestGitIgnore(unittest.TestCase):
+    """ Tests for the rules of a whole repository """
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.repo = repo_create(self.test_dir)
+
+        self.write(".gitignore", "*.log\nbuild/\n")
+        self.write("sub/.gitignore", "!important.log\n")
+        self.write(".git/info/exclude", "secret\n")
+        os.makedirs(os.path.join(self.test_dir, "build"))
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.test_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(data)
+
+    def test_levels(self):
+        ignore = GitIgnore(self.repo)
+        self.assertTrue(ignore.is_ignored("a.log"))
+        self.assertTrue(ignore.is_ignored("other/a.log"))
+        # The closest .gitignore wins
+        self.assertFalse(ignore.is_ignored("sub/important.log"))
+        self.assertTrue(ignore.is_ignored("sub/other.log"))
+        # info/exclude applies too
+        self.assertTrue(ignore.is_ignored("dir/secret"))
+        self.assertFalse(ignore.is_ignored("a.txt"))
+
+    def test_ignored_parent(self):
+        ignore = GitIgnore(self.repo)
+        # Can't re-include something in an ignored directory
+        self.write("build/.gitignore", "!*\n")
+        self.assertTrue(ignore.is_ignored("build/x/y.c"))
+
+    def test_unknown_type(self):
+        ignore = GitIgnore(self.repo)
+        self.assertTrue(ignore.is_ignored("build", None))
+        self.write("other/build", "a file")
+        self.assertFalse(ignore.is_ignored("other/build", None))
+
+    def test_cache_invalidation(self):
+        path = os.path.join(self.test_dir, ".gitignore")
+        first = ignore_file_load(path)
+        self.assertIs(ignore_file_load(path), first)
+
+        self.write(".gitignore", "*.tmp\n")
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        self.assertIsNot(ignore_file_load(path), first)
+        self.assertTrue(GitIgnore(self.repo).is_ignored("a.tmp"))
+
+    def test_check_ignore_batch(self):
+        original_dir = os.getcwd()
+        os.chdir(os.path.join(self.test_dir, "sub"))
+        try:
+            out = io.StringIO()
+            check_ignore(self.repo, io.StringIO("a.log\nimportant.log\n../x.log\n../build/\nfine.c\n"), out)
+        finally:
+            os.chdir(original_dir)
+        self.assertEqual(out.getvalue().splitlines(), ["a.log", "../x.log", "../build/"])
@@ -0,0 +1,49 @@
+import os
+import shutil
+import unittest
+import tempfile
+
+from repository.repofun import repo_create
+from repository.index import GitIndex, GitIndexEntry, index_read, index_write
+
+class TestIndexRW(unittest.TestCase):
+    """ Tests for reading and writing the index """
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.repo = repo_create(self.test_dir)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def test_missing_index(self):
+        """Test that a repository without index has an empty one"""
+        self.assertEqual(len(index_read(self.repo)), 0)
+
+    def test_roundtrip(self):
+        """Test that entries survive a write and a read"""
+        entries = [GitIndexEntry(name, 1700000000123456789, 1700000001987654321,
+                                 2049, 1234 + i, 0o100644, 1000, 1000, 42 + i, os.urandom(20))
+                   for i, name in enumerate(["a", "dir/b", "dir/sub/a-rather-long-file-name.txt", "z"])]
+        index_write(self.repo, GitIndex(entries=entries))
+
+        index = index_read(self.repo)
+        self.assertEqual(len(index), len(entries))
+        for old, new in zip(entries, index):
+            for field in GitIndexEntry.__slots__:
+                self.assertEqual(getattr(old, field), getattr(new, field))
+
+    def test_find(self):
+        """Test lookups by name"""
+        index = GitIndex()
+        index.add_entries([GitIndexEntry(n, 0, 0, 0, 0, 0o100644, 0, 0, 0, b'\0' * 20) for n in ["b", "a", "c"]])
+        self.assertEqual([e.name for e in index], ["a", "b", "c"])
+        self.assertEqual(index.find("b").name, "b")
+        self.assertIsNone(index.find("d"))
+
+    def test_locked_index(self):
+        """Test that the index isn't written while someone holds the lock"""
+        open(os.path.join(self.test_dir, ".git", "index.lock"), "w").close()
+        with self.assertRaises(Exception):
+            index_write(self.repo, GitIndex())
@@ -0,0 +1,219 @@
+import os
+import shutil
+import unittest
+import tempfile
+from unittest.mock import patch
+
+from repository.GitRepository import GitRepository
+from repository.objects import GitBlob
+from repository.object_fun import object_read_raw, object_write, loose_objects
+from repository.packfile import MultiPackIndex, repo_packs, pack_find, midx_path
+from repository.repack import midx_write
+from repository.object_filter import ObjectFilter, object_filter_load, object_filter_path, object_filter_write
+
+from test_packfile import git, git_objects, make_history
+
+
+def add_pack(cwd, name):
+    """Commit a new file and pack the loose objects into a new pack"""
+    with open(os.path.join(cwd, name), "w") as f:
+        f.write(name + "\n")
+    git(cwd, "add", name)
+    git(cwd, "commit", "-q", "-m", name)
+    git(cwd, "repack", "-q", "-d")
+
+
+@unittest.skipUnless(shutil.which("git"), "needs git to build packs")
+class TestMultiPackIndex(unittest.TestCase):
+    """ The multi-pack-index must be the same as git's """
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        make_history(self.test_dir, 4)
+        git(self.test_dir, "repack", "-q", "-d")
+        add_pack(self.test_dir, "second")
+        add_pack(self.test_dir, "third")
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def check_midx(self, repo):
+        midx = MultiPackIndex(midx_path(repo))
+        packs = {pack.name + ".idx": pack for pack in repo_packs(repo, rescan=True)}
+        self.assertEqual(sorted(midx.pack_names), sorted(packs))
+        objects = git_objects(self.test_dir)
+        self.assertEqual(len(midx), len(objects))
+        for sha, _, _ in objects:
+            pack, offset = midx.find(bytes.fromhex(sha))
+            self.assertEqual(packs[midx.pack_names[pack]].find(bytes.fromhex(sha)), offset)
+        self.assertIsNone(midx.find(b'\x00' * 20))
+
+    def test_write(self):
+        repo = GitRepository(self.test_dir)
+        self.assertEqual(len(repo_packs(repo)), 3)
+        self.assertEqual(midx_write(repo), len(git_objects(self.test_dir)))
+        git(self.test_dir, "multi-pack-index", "verify")
+        self.check_midx(repo)
+
+    def test_read_git(self):
+        git(self.test_dir, "multi-pack-index", "write")
+        self.check_midx(GitRepository(self.test_dir))
+
+    def test_lookup(self):
+        repo = GitRepository(self.test_dir)
+        midx_write(repo)
+        add_pack(self.test_dir, "fourth")
+
+        # A single search for the packs of the multi-pack-index, then the
+        # new pack is searched on its own
+        repo = GitRepository(self.test_dir)
+        with patch("repository.packfile.Pack.find", autospec=True, side_effect=lambda pack, sha: pack.index.find(sha)) as find:
+            for sha, fmt, size in git_objects(self.test_dir):
+                self.assertEqual(object_read_raw(repo, sha),
+                                 (fmt, git(self.test_dir, "cat-file", fmt.decode(), sha)))
+        self.assertEqual(len(repo.midx[2]), 1)
+        self.assertTrue(all(call.args[0] is repo.midx[2][0] for call in find.call_args_list))
+
+        # A multi-pack-index naming a pack that's gone is left aside
+        git(self.test_dir, "repack", "-q", "-a", "-d")
+        repo = GitRepository(self.test_dir)
+        self.assertIsNone(repo_packs(repo) and repo.midx)
+        self.assertTrue(all(pack_find(repo, bytes.fromhex(sha)) for sha, _, _ in git_objects(self.test_dir)))
+
+
+@unittest.skipUnless(shutil.which("git"), "needs git to build packs")
+class TestObjectFilter(unittest.TestCase):
+    """ The filter must know every object, and few others """
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        make_history(self.test_dir, 4)
+        git(self.test_dir, "repack", "-q", "-d")
+        add_pack(self.test_dir, "second")
+        # Some loose objects too
+        git(self.test_dir, "commit", "-q", "--allow-empty", "-m", "loose")
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def test_filter(self):
+        repo = GitRepository(self.test_dir)
+        fltr = object_filter_load(repo)
+        self.assertTrue(os.path.exists(object_filter_path(repo)))
+        for sha, _, _ in git_objects(self.test_dir):
+            self.assertIn(sha, fltr)
+
+        misses = [os.urandom(20).hex() for _ in range(1000)]
+        self.assertLess(sum(sha in fltr for sha in misses), 20)
+
+        # Saved and read back the same
+        with open(object_filter_path(repo), "rb") as f:
+            saved = ObjectFilter.parse(f.read(), object_filter_path(repo))
+        self.assertEqual(saved.bits, fltr.bits)
+        self.assertEqual(saved.packs, {pack.name for pack in repo_packs(repo)})
+
+    def test_incremental(self):
+        repo = GitRepository(self.test_dir)
+        object_filter_load(repo)
+
+        # New packs are added when the filter is loaded
+        add_pack(self.test_dir, "third")
+        fltr = object_filter_load(repo)
+        for sha, _, _ in git_objects(self.test_dir):
+            self.assertIn(sha, fltr)
+
+        # Objects written by batches are added when they end
+        with repo.write_batch():
+            sha = object_write(GitBlob(b"new object"), repo)
+        self.assertIn(sha, object_filter_load(repo))
+
+        # Rebuilding drops the objects that are gone
+        os.remove(os.path.join(self.test_dir, ".git", "objects", sha[:2], sha[2:]))
+        object_filter_write(repo)
+        self.assertNotIn(sha, object_filter_load(repo))
+
+    def test_duplicates(self):
+        """ Objects added again don't count, nor go to the log """
+        repo = GitRepository(self.test_dir)
+        fltr = object_filter_load(repo)
+        count = fltr.count
+        shas = [sha for sha, _, _ in git_objects(self.test_dir)]
+        self.assertFalse(any(fltr.add(sha) for sha in shas))
+        self.assertEqual(fltr.count, count)
+
+        log = object_filter_path(repo) + ".log"
+        object_write(GitBlob(b"written twice"), repo)
+        size = os.path.getsize(log)
+        with repo.write_batch():
+            object_write(GitBlob(b"written twice"), repo)
+        self.assertEqual(os.path.getsize(log), size)
+
+    def test_cached(self):
+        """ The filter is only read again when its file changes """
+        repo = GitRepository(self.test_dir)
+        fltr = object_filter_load(repo)
+        with patch("repository.object_filter._filter_read") as read:
+            with repo.write_batch() as batch:
+                self.assertIs(batch.filter, fltr)
+            self.assertIs(object_filter_load(repo), fltr)
+        read.assert_not_called()
+
+        object_filter_write(repo)
+        self.assertIsNot(object_filter_load(repo), fltr)
+
+    def test_concurrent(self):
+        """ Batches of other processes, and objects written outside of
+        batches, all end up in the filter """
+        repos = [GitRepository(self.test_dir) for _ in range(3)]
+        for repo in repos:
+            object_filter_load(repo)
+        shas = []
+        for i, repo in enumerate(repos):
+            with repo.write_batch():
+                shas.append(object_write(GitBlob(b"batch %d" % i), repo))
+        shas.append(object_write(GitBlob(b"no batch"), repos[0]))
+
+        for repo in repos + [GitRepository(self.test_dir)]:
+            fltr = object_filter_load(repo)
+            for sha in shas:
+                self.assertIn(sha, fltr)
+
+        # Merged into the file when the log gets long, and kept
+        log = object_filter_path(repos[0]) + ".log"
+        self.assertEqual(os.path.getsize(log), 20 * len(shas))
+        with patch("repository.object_filter.LOG_MERGE", 2):
+            object_filter_load(repos[0])
+        self.assertEqual(os.path.getsize(log) if os.path.exists(log) else 0, 0)
+        self.assertFalse(os.path.exists(log + ".merging"))
+        with open(object_filter_path(repos[0]), "rb") as f:
+            saved = ObjectFilter.parse(f.read(), object_filter_path(repos[0]))
+        for sha in shas:
+            self.assertIn(sha, saved)
+
+    def test_locked(self):
+        """ While another process writes it, the filter in memory is used """
+        repo = GitRepository(self.test_dir)
+        lock = object_filter_path(repo) + ".lock"
+        os.makedirs(os.path.dirname(lock), exist_ok=True)
+        open(lock, "w").close()
+        self.assertIsNone(object_filter_load(repo))
+        with repo.write_batch():
+            sha = object_write(GitBlob(b"no filter"), repo)
+        os.remove(lock)
+        self.assertIn(sha, object_filter_load(repo))
+
+    def test_skip_lookup(self):
+        """ Objects the filter doesn't know aren't looked for on disk """
+        repo = GitRepository(self.test_dir)
+        with repo.write_batch():
+            with patch("os.path.exists", wraps=os.path.exists) as exists:
+                sha = object_write(GitBlob(b"never seen"), repo)
+                self.assertFalse(any(sha[2:] in str(call.args[0]) for call in exists.call_args_list))
+
+                # Written again, it's known, and found in the batch
+                object_write(GitBlob(b"never seen"), repo)
+                self.assertEqual(len(repo.batch.pending), 1)
+        self.assertEqual(object_read_raw(repo, sha), (b'blob', b"never seen"))
+        self.assertIn(sha, loose_objects(repo))
@@ -2,11 +2,12 @@ import os
 import shutil
 import unittest
 import tempfile
+import io
 
 from repository.repofun import repo_find,repo_create 
 from repository.GitRepository import GitRepository
 from repository.objects import GitBlob
-from repository.object_fun import object_read,object_write
+from repository.object_fun import object_read,object_write,object_write_stream,object_open,object_read_header
 from utils.path import repo_dir, repo_file, repo_path
 
 class TestBlobRW(unittest.TestCase):
@@ -51,6 +52,156 @@ class TestBlobRW(unittest.TestCase):
         self.assertEqual(newblob.serialize(),self.data)
 
 
-         
+class TestStreamWrite(unittest.TestCase):
+    """ Tests for the streaming object writer """
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.repo = repo_create(self.test_dir)
+
+        # Bigger than a single chunk, so several passes are needed
+        self.data = os.urandom(200 * 1024)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def test_same_sha_as_object_write(self):
+        sha = object_write_stream(io.BytesIO(self.data), len(self.data))
+        self.assertEqual(sha, object_write(GitBlob(self.data)))
+
+    def test_write_from_path(self):
+        path = os.path.join(self.test_dir, "file.bin")
+        with open(path, "wb") as f:
+            f.write(self.data)
+
+        sha = object_write_stream(path, repo=self.repo)
+
+        # The object can be read back, and no temp file is left behind
+        self.assertEqual(object_read(self.repo, sha).serialize(), self.data)
+        leftovers = [f for f in os.listdir(repo_path(self.repo, "objects")) if f.startswith("tmp_obj_")]
+        self.assertEqual(leftovers, [])
+
+    def test_short_stream_fails(self):
+        with self.assertRaises(Exception):
+            object_write_stream(io.BytesIO(self.data), len(self.data) + 1, repo=self.repo)
+
+        # The temporary file must have been cleaned up
+        leftovers = [f for f in os.listdir(repo_path(self.repo, "objects")) if f.startswith("tmp_obj_")]
+        self.assertEqual(leftovers, [])
+
+
+class TestStreamRead(unittest.TestCase):
+    """ Tests for the incremental object reader """
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.repo = repo_create(self.test_dir)
+
+        self.data = os.urandom(200 * 1024)
+        self.sha = object_write(GitBlob(self.data), repo=self.repo)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def test_header(self):
+        self.assertEqual(object_read_header(self.repo, self.sha), (b'blob', len(self.data)))
+
+    def test_missing_object(self):
+        self.assertIsNone(object_read_header(self.repo, "0" * 40))
+        self.assertIsNone(object_open(self.repo, "0" * 40))
+
+    def test_chunks(self):
+        fmt, size, stream = object_open(self.repo, self.sha)
+        with stream:
+            chunks = list(stream.chunks(1000))
+
+        self.assertTrue(all(len(c) <= 1000 for c in chunks))
+        self.assertEqual(b''.join(chunks), self.data)
+
+    def test_empty_blob(self):
+        sha = object_write(GitBlob(b''), repo=self.repo)
+        self.assertEqual(object_read(self.repo, sha).serialize(), b'')
+
+
+class TestObjectCache(unittest.TestCase):
+    """ Parsed objects are cached on the repository, within a budget """
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.repo = repo_create(self.test_dir)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def test_hit(self):
+        sha = object_write(GitBlob(b'cached'), repo=self.repo)
+        first = object_read(self.repo, sha)
+        self.assertIs(object_read(self.repo, sha), first)
+
+        stats = self.repo.cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 1))
+
+    def test_big_blobs_bypass(self):
+        self.repo.object_cache_blob_limit = 100
+        sha = object_write(GitBlob(os.urandom(101)), repo=self.repo)
+        object_read(self.repo, sha)
+        self.assertNotIn(sha, self.repo.object_cache)
+
+    def test_budget_from_config(self):
+        conf = GitRepository(self.test_dir).conf
+        conf.set("core", "objectCacheLimit", "1k")
+        with open(repo_file(self.repo, "config"), "w") as f:
+            conf.write(f)
+        repo = GitRepository(self.test_dir)
+        self.assertEqual(repo.object_cache.limit, 1024)
+
+        shas = [object_write(GitBlob(os.urandom(300)), repo=repo) for _ in range(4)]
+        for sha in shas:
+            object_read(repo, sha)
+
+        # Only the most recent ones fit
+        stats = repo.cache_stats()
+        self.assertLessEqual(stats["bytes"], 1024)
+        self.assertGreater(stats["evictions"], 0)
+        self.assertIn(shas[-1], repo.object_cache)
+        self.assertNotIn(shas[0], repo.object_cache)
+
+class TestCompression(unittest.TestCase):
+    """ Loose objects are compressed at the level of the config """
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        repo_create(self.test_dir)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def configure(self, **options):
+        conf = GitRepository(self.test_dir).conf
+        for option, value in options.items():
+            conf.set("core", option, value)
+        with open(os.path.join(self.test_dir, ".git", "config"), "w") as f:
+            conf.write(f)
+        return GitRepository(self.test_dir)
+
+    def loose_size(self, repo, sha):
+        return os.path.getsize(repo_path(repo, "objects", sha[:2], sha[2:]))
+
+    def test_levels(self):
+        data = b'compressible ' * 1000
+        repo = self.configure(compression="9", looseCompression="0")
+        self.assertEqual((repo.loose_compression, repo.pack_compression), (0, 9))
+
+        sha = object_write(GitBlob(data), repo=repo)
+        self.assertGreater(self.loose_size(repo, sha), len(data))
+        self.assertEqual(object_read(repo, sha).serialize(), data)
 
+        sha = object_write_stream(io.BytesIO(data + b'!'), len(data) + 1, repo=repo)
+        self.assertGreater(self.loose_size(repo, sha), len(data))
+        self.assertEqual(object_read(repo, sha).serialize(), data + b'!')
 
+    def test_fallback(self):
+        self.assertEqual(GitRepository(self.test_dir).loose_compression, -1)
+        self.assertEqual(self.configure(compression="1").loose_compression, 1)
+        with self.assertRaises(Exception):
+            self.configure(looseCompression="10")
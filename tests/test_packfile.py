@@ -0,0 +1,123 @@
+import os
+import shutil
+import unittest
+import tempfile
+import subprocess
+
+from utils import trace
+from repository.GitRepository import GitRepository
+from repository.object_fun import object_read_raw, object_read_header
+from repository.packfile import apply_delta, repo_packs, delta_base_cache, DEFAULT_DELTA_BASE_CACHE_LIMIT
+
+
+def git(cwd, *args, data=None):
+    """Run the real git in cwd, return its stdout"""
+    return subprocess.run(["git", *args], cwd=cwd, input=data, check=True,
+                          capture_output=True).stdout
+
+def git_objects(cwd):
+    """Return (sha, type, size) for every object in the repository at cwd"""
+    out = git(cwd, "cat-file", "--batch-all-objects", "--batch-check")
+    return [(sha, fmt.encode(), int(size))
+            for sha, fmt, size in (l.split() for l in out.decode().splitlines())]
+
+def make_history(cwd, commits=8):
+    """Create a repository at cwd with enough similar revisions of a file
+    for git to store deltas when packing"""
+    git(cwd, "init", "-q")
+    git(cwd, "config", "user.name", "Test")
+    git(cwd, "config", "user.email", "test@example.com")
+
+    lines = [f"line {i} of a file that changes a little every commit\n" for i in range(400)]
+    for n in range(commits):
+        lines[n * 7] = f"changed in commit {n}\n"
+        with open(os.path.join(cwd, "file.txt"), "w") as f:
+            f.writelines(lines)
+        git(cwd, "add", "file.txt")
+        git(cwd, "commit", "-q", "-m", f"commit {n}")
+
+
+@unittest.skipUnless(shutil.which("git"), "needs git to build packs")
+class TestPackRead(unittest.TestCase):
+    """ Objects in packs built by git must read the same as with git """
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        make_history(self.test_dir)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        delta_base_cache.limit = DEFAULT_DELTA_BASE_CACHE_LIMIT
+
+    def check_all_objects(self):
+        repo = GitRepository(self.test_dir)
+        self.assertTrue(repo_packs(repo))
+
+        for sha, fmt, size in git_objects(self.test_dir):
+            self.assertEqual(object_read_header(repo, sha), (fmt, size))
+            self.assertEqual(object_read_raw(repo, sha),
+                             (fmt, git(self.test_dir, "cat-file", fmt.decode(), sha)))
+
+    def test_ofs_delta(self):
+        git(self.test_dir, "repack", "-q", "-a", "-d", "-f")
+        self.check_all_objects()
+
+    def test_ref_delta(self):
+        git(self.test_dir, "-c", "repack.useDeltaBaseOffset=false", "repack", "-q", "-a", "-d", "-f")
+        self.check_all_objects()
+
+    def test_delta_base_cache(self):
+        git(self.test_dir, "repack", "-q", "-a", "-d", "-f")
+        delta_base_cache.clear()
+        self.check_all_objects()
+
+        # Every blob is a delta against the same base, which is only
+        # inflated the first time
+        self.assertGreater(delta_base_cache.hits, 0)
+        self.assertGreater(len(delta_base_cache), 0)
+
+        # And the hits and misses are in the tracing summary
+        counters = trace.summary()["counters"]["delta_base_cache"]
+        self.assertEqual(counters["hits"], delta_base_cache.hits)
+        self.assertEqual(counters["misses"], delta_base_cache.misses)
+
+    def test_delta_base_cache_limit(self):
+        git(self.test_dir, "config", "core.deltaBaseCacheLimit", "1k")
+        git(self.test_dir, "repack", "-q", "-a", "-d", "-f")
+        self.check_all_objects()
+
+        # Bases are bigger than the budget, so nothing is kept
+        self.assertEqual(delta_base_cache.limit, 1024)
+        self.assertLessEqual(delta_base_cache.size, 1024)
+
+    def test_loose_fallback(self):
+        git(self.test_dir, "repack", "-q", "-a", "-d")
+
+        # Objects written after the pack are loose
+        sha = git(self.test_dir, "hash-object", "-w", "--stdin", data=b"not packed\n").decode().strip()
+        repo = GitRepository(self.test_dir)
+        self.assertEqual(object_read_raw(repo, sha), (b'blob', b"not packed\n"))
+
+    def test_pack_written_later(self):
+        # Packs show up even after the repository has been opened
+        repo = GitRepository(self.test_dir)
+        self.assertEqual(repo_packs(repo), [])
+
+        git(self.test_dir, "repack", "-q", "-a", "-d")
+        sha, fmt, size = git_objects(self.test_dir)[0]
+        self.assertEqual(object_read_header(repo, sha), (fmt, size))
+
+
+class TestApplyDelta(unittest.TestCase):
+    """ Tests for the delta decoder """
+
+    def test_copy_and_insert(self):
+        base = b"0123456789"
+        # sizes 10 -> 7, copy 4 bytes at offset 2, insert "xyz"
+        delta = bytes([10, 7, 0x80 | 0x01 | 0x10, 2, 4, 3]) + b"xyz"
+        self.assertEqual(apply_delta(base, delta), b"2345xyz")
+
+    def test_bad_base_size(self):
+        with self.assertRaises(Exception):
+            apply_delta(b"short", bytes([10, 1, 1]) + b"x")
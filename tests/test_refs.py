@@ -0,0 +1,141 @@
+import io
+import os
+import mmap
+import shutil
+import unittest
+import tempfile
+from unittest.mock import patch
+
+from repository.GitRepository import GitRepository
+from repository.repofun import repo_create
+from repository.refs import PackedRefs, packed_refs_write, packed_refs_load, ref_list, ref_resolve
+from repository.ref_fun import pack_refs, show_ref, tag_list, tag_create
+from repository.object_fun import object_find
+from utils.path import repo_path
+
+from test_packfile import git
+from test_commit_graph import make_branchy_history
+
+
+class TestPackedRefs(unittest.TestCase):
+    """ Lookups in packed-refs are binary searches over the file """
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.repo = repo_create(self.test_dir)
+        self.refs = [(f"refs/tags/v{i}", f"{i:040x}", f"{i + 1:040x}" if i % 3 == 0 else None)
+                     for i in range(1000)]
+        self.refs += [(f"refs/heads/branch{i}", f"{i:040x}", None) for i in range(50)]
+        packed_refs_write(self.repo, self.refs)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def check(self, packed):
+        for name, sha, peeled in self.refs:
+            self.assertEqual(packed.find(name), (sha, peeled))
+        for name in ["refs/tags/v1000", "refs/heads/a", "refs/tags/", "refs/zzz", "HEAD"]:
+            self.assertIsNone(packed.find(name))
+
+        self.assertEqual(list(packed.refs()), sorted(self.refs))
+        self.assertEqual(list(packed.refs("refs/heads/")),
+                         sorted(r for r in self.refs if r[0].startswith("refs/heads/")))
+        self.assertEqual(list(packed.refs("refs/remotes/")), [])
+
+    def test_sorted(self):
+        self.check(packed_refs_load(self.repo))
+
+    def test_unsorted(self):
+        # Files without the sorted trait, like those of old gits
+        path = repo_path(self.repo, "packed-refs")
+        lines = []
+        for name, sha, peeled in reversed(self.refs):
+            lines.append(f"{sha} {name}\n")
+            if peeled:
+                lines.append(f"^{peeled}\n")
+        with open(path, "w") as f:
+            f.write("# pack-refs with: peeled \n" + "".join(lines))
+
+        # Sorted in memory, without keeping the file mapped
+        maps = []
+        real_mmap = mmap.mmap
+        def record(*args, **kwargs):
+            maps.append(real_mmap(*args, **kwargs))
+            return maps[-1]
+        with patch("mmap.mmap", record):
+            packed = PackedRefs(path)
+        self.assertTrue(maps and all(m.closed for m in maps))
+        self.check(packed)
+
+    def test_empty(self):
+        open(repo_path(self.repo, "packed-refs"), "w").close()
+        packed = packed_refs_load(self.repo)
+        self.assertIsNone(packed.find("refs/heads/master"))
+        self.assertEqual(list(packed.refs()), [])
+
+
+@unittest.skipUnless(shutil.which("git"), "needs git to build history")
+class TestRefs(unittest.TestCase):
+    """ Packed and loose refs must read like with git """
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        make_branchy_history(self.test_dir)
+        self.repo = GitRepository(self.test_dir)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def git_show_ref(self, *args):
+        return git(self.test_dir, "show-ref", *args).decode()
+
+    def our_show_ref(self, *args, **kwargs):
+        out = io.StringIO()
+        show_ref(self.repo, *args, out=out, **kwargs)
+        return out.getvalue()
+
+    def test_git_packed(self):
+        git(self.test_dir, "pack-refs", "--all")
+        self.assertFalse(os.listdir(repo_path(self.repo, "refs", "heads")))
+        self.assertEqual(self.our_show_ref(dereference=True), self.git_show_ref("-d"))
+        self.assertEqual(object_find(self.repo, "one"), git(self.test_dir, "rev-parse", "one").decode().strip())
+
+    def test_loose_overrides_packed(self):
+        git(self.test_dir, "pack-refs", "--all")
+        git(self.test_dir, "update-ref", "refs/heads/one", "two")
+        self.assertEqual(ref_resolve(self.repo, "refs/heads/one"), ref_resolve(self.repo, "refs/heads/two"))
+        self.assertEqual(self.our_show_ref(), self.git_show_ref())
+
+    def test_pack_refs(self):
+        expected = self.git_show_ref("-d")
+        self.assertEqual(pack_refs(self.repo), 1)
+        self.assertEqual(self.git_show_ref("-d"), expected)
+
+        self.assertEqual(pack_refs(self.repo, all=True), 6)
+        self.assertEqual(self.git_show_ref("-d"), expected)
+        self.assertEqual(self.our_show_ref(dereference=True), expected)
+        self.assertEqual(os.listdir(repo_path(self.repo, "refs", "heads")), [])
+        git(self.test_dir, "fsck", "--no-progress")
+
+    def test_filters(self):
+        pack_refs(self.repo)
+        self.assertEqual(self.our_show_ref(heads=True), self.git_show_ref("--heads"))
+        self.assertEqual(self.our_show_ref(tags=True), self.git_show_ref("--tags"))
+        self.assertEqual(self.our_show_ref(["one", "v1"]), self.git_show_ref("one", "v1"))
+
+    def test_tags(self):
+        pack_refs(self.repo, all=True)
+        tag_create(self.repo, "light", "one")
+        tag_create(self.repo, "a/nested", "HEAD~1")
+        with self.assertRaises(Exception):
+            tag_create(self.repo, "light")
+        with self.assertRaises(Exception):
+            tag_create(self.repo, "bad..name")
+
+        out = io.StringIO()
+        tag_list(self.repo, out=out)
+        self.assertEqual(out.getvalue(), git(self.test_dir, "tag").decode())
+        self.assertEqual(list(ref_list(self.repo, "refs/tags")),
+                         ["refs/tags/a/nested", "refs/tags/light", "refs/tags/v1"])
@@ -0,0 +1,88 @@
+import os
+import random
+import shutil
+import unittest
+import tempfile
+
+from repository.GitRepository import GitRepository
+from repository.object_fun import object_read_raw
+from repository.packfile import apply_delta
+from repository.repack import repack, loose_objects, create_delta
+
+from test_packfile import git, git_objects, make_history
+
+
+class TestCreateDelta(unittest.TestCase):
+    """ Deltas must turn the base back into the target """
+
+    def test_roundtrip(self):
+        rand = random.Random(42)
+        base = bytes(rand.randrange(256) for _ in range(20000))
+
+        # Some edits, an insertion and a deletion
+        target = bytearray(base)
+        target[100:110] = b"x" * 10
+        target[5000:5000] = b"inserted bytes" * 20
+        del target[15000:15500]
+        target = bytes(target)
+
+        delta = create_delta(base, target)
+        self.assertEqual(apply_delta(base, delta), target)
+        self.assertLess(len(delta), len(target) // 10)
+
+    def test_unrelated(self):
+        base = b"a" * 1000
+        target = b"b" * 1000
+        self.assertEqual(apply_delta(base, create_delta(base, target)), target)
+        self.assertIsNone(create_delta(base, target, max_size=100))
+
+    def test_long_copy(self):
+        # Copies longer than 64KB must be split
+        base = os.urandom(200000)
+        self.assertEqual(apply_delta(base, create_delta(base, base)), base)
+
+
+@unittest.skipUnless(shutil.which("git"), "needs git to create history and check packs")
+class TestRepack(unittest.TestCase):
+    """ Packs written by repack must be valid for git and for us """
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        make_history(self.test_dir, commits=25)
+        self.objects = git_objects(self.test_dir)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def check_repack(self, jobs):
+        repo = GitRepository(self.test_dir)
+        stats = repack(repo, jobs=jobs)
+
+        self.assertEqual(stats["objects"], len(self.objects))
+        self.assertGreater(stats["deltas"], 0)
+        self.assertLess(stats["pack_bytes"], stats["loose_bytes"])
+        self.assertEqual(loose_objects(repo), [])
+
+        # git agrees with the pack...
+        git(self.test_dir, "fsck", "--full", "--strict")
+        pack = os.path.join(self.test_dir, ".git", "objects", "pack", stats["pack"] + ".idx")
+        git(self.test_dir, "verify-pack", pack)
+
+        # ... and so do we
+        repo = GitRepository(self.test_dir)
+        for sha, fmt, size in self.objects:
+            self.assertEqual(object_read_raw(repo, sha),
+                             (fmt, git(self.test_dir, "cat-file", fmt.decode(), sha)))
+
+    def test_repack_serial(self):
+        self.check_repack(jobs=1)
+
+    def test_repack_parallel(self):
+        self.check_repack(jobs=2)
+
+    def test_nothing_to_pack(self):
+        repo = GitRepository(self.test_dir)
+        repack(repo, jobs=1)
+        stats = repack(repo, jobs=1)
+        self.assertIsNone(stats["pack"])
@@ -0,0 +1,113 @@
+import io
+import os
+import shutil
+import hashlib
+import unittest
+import tempfile
+
+from repository.GitRepository import GitRepository
+from repository.objects import GitBlob
+from repository.object_fun import object_find, object_write, AmbiguousObjectError
+from repository.repofun import rev_parse
+
+from test_packfile import git
+from test_commit_graph import make_branchy_history
+
+
+@unittest.skipUnless(shutil.which("git"), "needs git to build history")
+class TestObjectFind(unittest.TestCase):
+    """ Names must resolve like git rev-parse does """
+
+    names = ["HEAD", "master", "one", "v1", "refs/tags/v1", "HEAD^", "HEAD^2", "HEAD~3",
+             "HEAD^^2", "HEAD~1^3", "HEAD~1^0", "v1^{}", "v1^{commit}", "v1^{tree}",
+             "HEAD^{tree}", "one~2"]
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        make_branchy_history(self.test_dir)
+        self.repo = GitRepository(self.test_dir)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def rev_parse(self, name):
+        return git(self.test_dir, "rev-parse", name).decode().strip()
+
+    def check_names(self):
+        for name in self.names:
+            self.assertEqual(object_find(self.repo, name), self.rev_parse(name), name)
+
+        head = self.rev_parse("HEAD")
+        for n in (4, 7, 12, 40):
+            self.assertEqual(object_find(self.repo, head[:n]), head)
+            self.assertEqual(object_find(self.repo, head[:n].upper()), head)
+
+    def test_loose(self):
+        self.check_names()
+
+    def test_packed(self):
+        git(self.test_dir, "repack", "-a", "-d", "-q")
+        self.check_names()
+
+    def test_missing(self):
+        for name in ["nope", "HEAD^5", "HEAD~100", "v1^{blob}", "0000", "abc"]:
+            self.assertIsNone(object_find(self.repo, name), name)
+
+    def test_malformed_suffixes(self):
+        for name in ["HEAD~x", "HEAD^x", "HEAD~1x", "HEAD~-1", "HEAD^{tree", "HEAD^{Tree}", "HEAD~1 "]:
+            self.assertIsNone(object_find(self.repo, name), name)
+
+    def test_fmt(self):
+        self.assertEqual(object_find(self.repo, "v1", fmt=b'commit'), self.rev_parse("v1^{commit}"))
+        self.assertEqual(object_find(self.repo, "v1", fmt=b'tree'), self.rev_parse("v1^{tree}"))
+        self.assertIsNone(object_find(self.repo, "v1", fmt=b'commit', follow=False))
+
+    def test_ref_cache_invalidation(self):
+        self.assertEqual(object_find(self.repo, "one"), self.rev_parse("one"))
+        git(self.test_dir, "update-ref", "refs/heads/one", self.rev_parse("two"))
+        self.assertEqual(object_find(self.repo, "one"), self.rev_parse("two"))
+
+    def test_new_objects(self):
+        # Objects written after the prefix index was built are found too
+        object_find(self.repo, self.rev_parse("HEAD")[:6])
+        sha = object_write(GitBlob(b'written later\n'), self.repo)
+        self.assertEqual(object_find(self.repo, sha[:8]), sha)
+
+    def colliding_blobs(self):
+        """ Two blobs whose shas start the same """
+        seen = {}
+        for i in range(100000):
+            data = f"blob {i}\n".encode()
+            sha = hashlib.sha1(b'blob %d\x00' % len(data) + data).hexdigest()
+            if sha[:4] in seen:
+                return GitBlob(seen[sha[:4]]), GitBlob(data)
+            seen[sha[:4]] = data
+
+    def test_ambiguous(self):
+        first, second = self.colliding_blobs()
+        first = object_write(first, self.repo)
+        object_write(second, self.repo)
+
+        with self.assertRaises(AmbiguousObjectError):
+            object_find(self.repo, first[:4])
+        self.assertEqual(object_find(self.repo, first[:12]), first)
+
+    def test_ambiguous_written_later(self):
+        # A short sha found unique becomes ambiguous when another object
+        # with the same prefix is written
+        first, second = self.colliding_blobs()
+        first = object_write(first, self.repo)
+        self.assertEqual(object_find(self.repo, first[:4]), first)
+        object_write(second, GitRepository(self.test_dir))
+        with self.assertRaises(AmbiguousObjectError):
+            object_find(self.repo, first[:4])
+
+    def test_batch(self):
+        out = io.StringIO()
+        rev_parse(self.repo, ["HEAD\n", "nope\n", "\n", "v1^{}\n"], batch=True, out=out)
+        self.assertEqual(out.getvalue().splitlines(),
+                         [self.rev_parse("HEAD"), "nope missing", " missing", self.rev_parse("v1^{}")])
+
+        with self.assertRaises(Exception):
+            rev_parse(self.repo, ["nope"], out=io.StringIO())
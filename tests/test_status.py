@@ -0,0 +1,174 @@
+import io
+import os
+import shutil
+import unittest
+import tempfile
+from unittest.mock import patch
+
+from repository.repofun import repo_create
+from repository.index import GitIndexEntry, index_read, index_write
+from repository.add import add
+from repository.objects import GitTree, GitCommit
+from repository.object_fun import object_write
+from repository.refs import ref_write
+import repository.status
+from repository.status import worktree_changes, status
+
+
+def commit_index(repo):
+    """Commit the index of repo on master, like git commit"""
+    def write_tree(entries):
+        # entries: {name: (mode, sha) or a dict for a subtree}
+        items = []
+        for name, value in entries.items():
+            if isinstance(value, dict):
+                items.append((name + "/", b'40000', name, bytes.fromhex(write_tree(value))))
+            else:
+                items.append((name, f"{value[0]:o}".encode(), name, value[1]))
+        data = b''.join(mode + b' ' + name.encode() + b'\x00' + sha
+                        for _, mode, name, sha in sorted(items))
+        return object_write(GitTree(data), repo)
+
+    root = {}
+    for entry in index_read(repo):
+        *dirs, name = entry.name.split("/")
+        tree = root
+        for d in dirs:
+            tree = tree.setdefault(d, {})
+        tree[name] = (entry.mode, entry.sha)
+
+    commit = GitCommit(b"tree " + write_tree(root).encode() + b"\n"
+                       b"author Test <test@example.com> 1700000000 +0000\n"
+                       b"committer Test <test@example.com> 1700000000 +0000\n"
+                       b"\ncommit\n")
+    ref_write(repo, "refs/heads/master", object_write(commit, repo))
+
+
+class TestStatus(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.repo = repo_create(self.test_dir)
+
+        for name in ["a.txt", "b.txt", "dir/c.txt"]:
+            self.write(name, name.encode() + b" content\n")
+        add(self.repo, [self.test_dir], jobs=1)
+        commit_index(self.repo)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.test_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def changes(self):
+        return list(worktree_changes(self.repo, index_read(self.repo), jobs=1))
+
+    def make_not_racy(self):
+        """Pretend the index was written well after the files"""
+        path = os.path.join(self.test_dir, ".git", "index")
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 10))
+
+    def test_clean(self):
+        self.make_not_racy()
+        out = io.StringIO()
+        status(self.repo, out)
+        self.assertIn("working tree clean", out.getvalue())
+
+    def test_changes(self):
+        self.write("a.txt", b"modified content\n")
+        os.remove(os.path.join(self.test_dir, "b.txt"))
+        self.write("new.txt", b"new\n")
+
+        out = io.StringIO()
+        status(self.repo, out)
+        self.assertIn("modified:   a.txt", out.getvalue())
+        self.assertIn("deleted:    b.txt", out.getvalue())
+        self.assertIn("Untracked files:\n\tnew.txt", out.getvalue())
+
+    def test_only_changed_stat_is_rehashed(self):
+        self.make_not_racy()
+        # Touching a file changes its stat data but not its content
+        path = os.path.join(self.test_dir, "a.txt")
+        os.utime(path, ns=(0, 10 ** 18))
+
+        hashed = []
+        real_hash_file = repository.status.hash_file
+        def spy(repo, name, write=True):
+            hashed.append(name)
+            return real_hash_file(repo, name, write)
+
+        with patch.object(repository.status, "hash_file", spy):
+            index = index_read(self.repo)
+            changes = list(worktree_changes(self.repo, index, jobs=1))
+
+        self.assertEqual(hashed, ["a.txt"])
+        self.assertEqual(changes, [])
+        self.assertTrue(index.dirty)
+        self.assertEqual(index.find("a.txt").mtime, 10 ** 18)
+
+    def test_racy_entry(self):
+        # Same size, and an index entry that has the stat data of the new
+        # content: only the racy check can notice
+        self.write("a.txt", b"A.txt content\n")
+        index = index_read(self.repo)
+        old = index.find("a.txt")
+        st = os.lstat(os.path.join(self.test_dir, "a.txt"))
+        index.add_entries([GitIndexEntry.from_stat("a.txt", st, old.mode, old.sha)])
+        index_write(self.repo, index)
+
+        # Index written in the same tick as the file
+        os.utime(os.path.join(self.test_dir, ".git", "index"), ns=(st.st_mtime_ns, st.st_mtime_ns))
+        self.assertEqual(self.changes(), [("modified", "a.txt")])
+
+        # Otherwise the stat data is trusted
+        os.utime(os.path.join(self.test_dir, ".git", "index"), ns=(st.st_mtime_ns, st.st_mtime_ns + 10 ** 10))
+        self.assertEqual(self.changes(), [])
+
+    def test_staged(self):
+        self.write("a.txt", b"modified content\n")
+        self.write("new.txt", b"new\n")
+        os.remove(os.path.join(self.test_dir, "b.txt"))
+        add(self.repo, [os.path.join(self.test_dir, name) for name in ["a.txt", "new.txt"]], jobs=1)
+        index = index_read(self.repo)
+        index.remove(["b.txt"])
+        index_write(self.repo, index)
+        # Changed again after being staged
+        self.write("a.txt", b"modified again\n")
+
+        out = io.StringIO()
+        status(self.repo, out)
+        staged, unstaged = out.getvalue().split("Changes not staged for commit:")
+        self.assertIn("Changes to be committed:\n"
+                      "\tmodified:   a.txt\n"
+                      "\tdeleted:    b.txt\n"
+                      "\tnew file:   new.txt\n", staged)
+        self.assertIn("modified:   a.txt", unstaged)
+        self.assertNotIn("working tree clean", out.getvalue())
+
+        out = io.StringIO()
+        status(self.repo, out, short=True)
+        self.assertEqual(sorted(out.getvalue().splitlines()), ["A  new.txt", "D  b.txt", "MM a.txt"])
+
+    def test_short_format(self):
+        self.write("a.txt", b"modified content\n")
+        self.write("new.txt", b"new\n")
+
+        out = io.StringIO()
+        status(self.repo, out, short=True)
+        self.assertEqual(sorted(out.getvalue().splitlines()), [" M a.txt", "?? new.txt"])
+
+    def test_ignored_files(self):
+        # Ignored untracked files are not shown, tracked ones still are
+        self.write(".gitignore", b"*.txt\n.gitignore\n")
+        self.write("a.txt", b"modified content\n")
+        self.write("new.txt", b"new\n")
+
+        out = io.StringIO()
+        status(self.repo, out, short=True)
+        self.assertEqual(out.getvalue().splitlines(), [" M a.txt"])
+
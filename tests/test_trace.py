@@ -0,0 +1,37 @@
+import unittest
+
+from utils import trace
+from utils.argparser_def import command_of
+
+
+class TestTrace(unittest.TestCase):
+    """ Traced functions are counted only while tracing is on """
+
+    def setUp(self):
+        trace._calls.clear()
+
+    def tearDown(self):
+        trace.ENABLED = False
+        trace._calls.clear()
+
+    def test_counters(self):
+        @trace.traced("double", bytes_in=lambda data: len(data), bytes_out=len)
+        def double(data):
+            return data * 2
+
+        self.assertEqual(double(b'ab'), b'abab')
+        self.assertEqual(trace.summary()["functions"], {})
+
+        trace.ENABLED = True
+        for i in range(100):
+            self.assertEqual(double(b'x' * i), b'x' * i * 2)
+
+        calls = trace.summary()["functions"]["double"]
+        self.assertEqual(calls["calls"], 100)
+        self.assertEqual((calls["bytes_in"], calls["bytes_out"]), (4950, 9900))
+        self.assertLessEqual(calls["p50_ms"], calls["p99_ms"])
+        self.assertLessEqual(calls["p99_ms"], calls["total_ms"])
+
+    def test_command_of(self):
+        self.assertEqual(command_of(["--profile-output", "log", "status"]), "status")
+        self.assertEqual(command_of(["--profile", "log"]), "log")
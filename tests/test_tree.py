@@ -0,0 +1,128 @@
+import io
+import os
+import shutil
+import unittest
+import tempfile
+
+from repository.GitRepository import GitRepository
+from repository.objects import GitTree
+from repository.tree import tree_resolve, tree_lookup, tree_diff, ls_tree
+
+from test_packfile import git
+
+
+def write(cwd, path, data):
+    full = os.path.join(cwd, path)
+    os.makedirs(os.path.dirname(full), exist_ok=True)
+    with open(full, "w") as f:
+        f.write(data)
+
+
+class TestTreeParse(unittest.TestCase):
+    """ Entries are found in the raw tree without being copied """
+
+    # Entries in git order: "a.b" < "a/" < "a0"
+    entries = [(b'100644', b'a.b', b'\x01' * 20),
+               (b'40000', b'a', b'\x02' * 20),
+               (b'100755', b'a0', b'\x03' * 20),
+               (b'120000', b'link', b'\x04' * 20)]
+
+    def setUp(self):
+        self.raw = b''.join(mode + b' ' + name + b'\x00' + sha for mode, name, sha in self.entries)
+        self.tree = GitTree(self.raw)
+
+    def test_entries(self):
+        self.assertEqual(len(self.tree), 4)
+        self.assertEqual(self.tree.serialize(), self.raw)
+        for i, (mode, name, sha) in enumerate(self.entries):
+            self.assertEqual((self.tree.mode(i), self.tree.name(i), self.tree.sha(i)), (mode, name, sha))
+        self.assertEqual([leaf.path for leaf in self.tree], ["a.b", "a", "a0", "link"])
+        self.assertEqual(self.tree.entry(1).sha, "02" * 20)
+
+    def test_find(self):
+        for i, (mode, name, sha) in enumerate(self.entries):
+            self.assertEqual(self.tree.find(name), i)
+        self.assertIsNone(self.tree.find(b'b'))
+        self.assertIsNone(GitTree(b'').find(b'a'))
+
+    def test_truncated(self):
+        with self.assertRaises(Exception):
+            GitTree(self.raw[:-1])
+
+
+@unittest.skipUnless(shutil.which("git"), "needs git to build trees")
+class TestTreeRepo(unittest.TestCase):
+    """ Trees must list and diff like git's """
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        git(self.test_dir, "init", "-q")
+        git(self.test_dir, "config", "user.name", "Test")
+        git(self.test_dir, "config", "user.email", "test@example.com")
+
+        for path in ["top.txt", "a.b", "a/one.txt", "a/deep/two.txt", "a0/three.txt",
+                     "b/four.txt", "b/sub/five.txt", "c/six.txt"]:
+            write(self.test_dir, path, path + "\n")
+        git(self.test_dir, "add", ".")
+        git(self.test_dir, "commit", "-q", "-m", "first")
+
+        # A change deep down, a deletion, an addition, and a file that
+        # becomes a directory
+        write(self.test_dir, "a/deep/two.txt", "changed\n")
+        os.remove(os.path.join(self.test_dir, "b/four.txt"))
+        write(self.test_dir, "new/seven.txt", "seven\n")
+        os.remove(os.path.join(self.test_dir, "top.txt"))
+        write(self.test_dir, "top.txt/eight.txt", "eight\n")
+        git(self.test_dir, "add", "-A")
+        git(self.test_dir, "commit", "-q", "-m", "second")
+        self.repo = GitRepository(self.test_dir)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def rev_parse(self, rev):
+        return git(self.test_dir, "rev-parse", rev).decode().strip()
+
+    def test_ls_tree(self):
+        for rev in ["HEAD", "HEAD~1", "HEAD:a"]:
+            out = io.StringIO()
+            ls_tree(self.repo, self.rev_parse(rev), out=out)
+            self.assertEqual(out.getvalue(), git(self.test_dir, "ls-tree", rev).decode())
+
+        out = io.StringIO()
+        ls_tree(self.repo, "HEAD", recursive=True, out=out)
+        self.assertEqual(out.getvalue(), git(self.test_dir, "ls-tree", "-r", "HEAD").decode())
+
+    def test_lookup(self):
+        tree = tree_resolve(self.repo, "HEAD")
+        for path in ["a/deep/two.txt", "a0/three.txt", "a", "top.txt/eight.txt"]:
+            self.assertEqual(tree_lookup(self.repo, tree, path).sha, self.rev_parse(f"HEAD:{path}"))
+        self.assertIsNone(tree_lookup(self.repo, tree, "a/missing"))
+        self.assertIsNone(tree_lookup(self.repo, tree, "a.b/file"))
+
+    def test_diff(self):
+        old = tree_resolve(self.repo, self.rev_parse("HEAD~1"))
+        new = tree_resolve(self.repo, "HEAD")
+        changes = list(tree_diff(self.repo, old, new))
+
+        expected = []
+        for line in git(self.test_dir, "diff-tree", "-r", "HEAD~1", "HEAD").decode().splitlines():
+            meta, path = line.split("\t")
+            old_mode, new_mode, old_sha, new_sha, status = meta[1:].split()
+            expected.append((path,
+                             None if status == "A" else old_sha,
+                             None if status == "D" else new_sha))
+        self.assertEqual([(path, a and a.sha, b and b.sha) for path, a, b in changes], expected)
+
+    def test_diff_skips_equal_subtrees(self):
+        old = tree_resolve(self.repo, self.rev_parse("HEAD~1"))
+        new = tree_resolve(self.repo, "HEAD")
+        self.repo.object_cache.clear()
+        list(tree_diff(self.repo, old, new))
+
+        # c/ and a0/ are the same in both, so they're never read
+        read = set(self.repo.object_cache._items)
+        for path in ["c", "a0", "b/sub"]:
+            self.assertNotIn(self.rev_parse(f"HEAD:{path}"), read)
+        self.assertIn(self.rev_parse("HEAD:a/deep"), read)
@@ -0,0 +1,62 @@
+import unittest
+
+from utils.lru import ByteLRU
+from utils.config import parse_size
+
+class TestByteLRU(unittest.TestCase):
+    def test_hit_and_miss(self):
+        """Test that hits and misses are counted"""
+        cache = ByteLRU(100)
+        cache.put("a", b"x" * 10, 10)
+
+        self.assertEqual(cache.get("a"), b"x" * 10)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_eviction_by_size(self):
+        """Test that the least recently used entries go first once over budget"""
+        cache = ByteLRU(100)
+        cache.put("a", "a", 40)
+        cache.put("b", "b", 40)
+
+        # Touch a, so b is now the oldest
+        cache.get("a")
+        cache.put("c", "c", 40)
+
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+        self.assertEqual(cache.size, 80)
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_too_big(self):
+        """Test that values bigger than the budget are not cached"""
+        cache = ByteLRU(100)
+        cache.put("a", "a", 101)
+        self.assertEqual(len(cache), 0)
+
+    def test_replace(self):
+        """Test that putting an existing key replaces its size"""
+        cache = ByteLRU(100)
+        cache.put("a", "a", 60)
+        cache.put("a", "b", 30)
+        self.assertEqual(cache.size, 30)
+        self.assertEqual(cache.get("a"), "b")
+
+    def test_shrink_limit(self):
+        """Test that lowering the budget evicts right away"""
+        cache = ByteLRU(100)
+        cache.put("a", "a", 40)
+        cache.put("b", "b", 40)
+        cache.limit = 50
+
+        self.assertNotIn("a", cache)
+        self.assertEqual(cache.size, 40)
+
+class TestParseSize(unittest.TestCase):
+    def test_units(self):
+        self.assertEqual(parse_size("512"), 512)
+        self.assertEqual(parse_size("4k"), 4096)
+        self.assertEqual(parse_size("96m"), 96 * 1024 * 1024)
+        self.assertEqual(parse_size("1G"), 1024 ** 3)
@@ -0,0 +1,62 @@
+import os
+import shutil
+import unittest
+import tempfile
+
+from repository.repofun import repo_create
+from repository.ignore import GitIgnore
+from repository.worktree import walk_worktree
+
+class TestWalkWorktree(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.repo = repo_create(self.test_dir)
+
+        self.files = ["a.txt", "dir/b.txt", "dir/sub/c.txt", "build/out.o", "build/deep/x.o", "z/.gitignore"]
+        for name in self.files:
+            self.write(name, name)
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.test_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(data)
+
+    def test_all_files(self):
+        """Test that every file but those in .git is found, with its stat"""
+        entries = list(walk_worktree(self.repo, jobs=3))
+        self.assertEqual(sorted(e.path for e in entries), sorted(self.files))
+        for e in entries:
+            self.assertEqual(e.stat.st_size, len(e.path))
+
+    def test_pruning(self):
+        """Test that ignored directories aren't descended into"""
+        asked = []
+        def ignore(path, is_dir):
+            asked.append(path)
+            return path == "build"
+
+        paths = sorted(e.path for e in walk_worktree(self.repo, ignore))
+        self.assertEqual(paths, sorted(f for f in self.files if not f.startswith("build/")))
+        self.assertNotIn("build/out.o", asked)
+
+    def test_gitignore(self):
+        """Test pruning with the .gitignore rules"""
+        self.write(".gitignore", "build/\n*.txt\n!b.txt\n")
+        paths = sorted(e.path for e in walk_worktree(self.repo, GitIgnore(self.repo)))
+        self.assertEqual(paths, [".gitignore", "dir/b.txt", "z/.gitignore"])
+
+    def test_start(self):
+        """Test walking a subdirectory only"""
+        paths = sorted(e.path for e in walk_worktree(self.repo, start="dir"))
+        self.assertEqual(paths, ["dir/b.txt", "dir/sub/c.txt"])
+
+    def test_early_stop(self):
+        """Test that the walk can be abandoned half way"""
+        walk = walk_worktree(self.repo, jobs=1)
+        next(walk)
+        walk.close()
@@ -0,0 +1,79 @@
+import os
+import shutil
+import unittest
+import tempfile
+from unittest.mock import patch
+
+from repository.repofun import repo_create
+from repository.GitRepository import GitRepository
+from repository.objects import GitBlob
+from repository.object_fun import object_read, object_write, object_write_stream
+
+
+class TestWriteBatch(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.repo = repo_create(self.test_dir)
+        self.objects = os.path.join(self.test_dir, ".git", "objects")
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def loose_path(self, sha):
+        return os.path.join(self.objects, sha[:2], sha[2:])
+
+    def temp_files(self):
+        return [name for name in os.listdir(self.objects) if name.startswith("tmp_")]
+
+    def test_batch(self):
+        """ Objects are moved into place when the batch ends, readable before """
+        with patch("os.fsync", wraps=os.fsync) as fsync:
+            with self.repo.write_batch():
+                shas = [object_write(GitBlob(b"blob %d" % i), self.repo) for i in range(10)]
+                # Written twice, stored once
+                object_write(GitBlob(b"blob 0"), self.repo)
+                self.assertFalse(any(os.path.exists(self.loose_path(sha)) for sha in shas))
+                self.assertEqual(len(self.temp_files()), 10)
+                self.assertEqual(object_read(self.repo, shas[3]).serialize(), b"blob 3")
+                self.assertEqual(fsync.call_count, 0)
+
+        # One sync per file, and per directory
+        dirs = {sha[:2] for sha in shas}
+        self.assertEqual(fsync.call_count, len(shas) + len(dirs))
+        self.assertTrue(all(os.path.exists(self.loose_path(sha)) for sha in shas))
+        self.assertEqual(self.temp_files(), [])
+        self.assertIsNone(self.repo.batch)
+
+    def test_abort(self):
+        """ Nothing is stored when the batch fails """
+        with self.assertRaises(ZeroDivisionError):
+            with self.repo.write_batch():
+                sha = object_write(GitBlob(b"lost"), self.repo)
+                with self.repo.write_batch():
+                    object_write_stream(__file__, repo=self.repo)
+                1 / 0
+        self.assertFalse(os.path.exists(self.loose_path(sha)))
+        self.assertEqual(self.temp_files(), [])
+        self.assertIsNone(self.repo.batch)
+
+    def test_fsync_object_files(self):
+        """ With core.fsyncObjectFiles, objects are synced one by one """
+        conf = GitRepository(self.test_dir).conf
+        conf.set("core", "fsyncObjectFiles", "true")
+        with open(os.path.join(self.test_dir, ".git", "config"), "w") as f:
+            conf.write(f)
+        repo = GitRepository(self.test_dir)
+
+        with patch("os.fsync", wraps=os.fsync) as fsync:
+            sha = object_write(GitBlob(b"synced"), repo)
+            self.assertEqual(fsync.call_count, 1)
+            object_write_stream(__file__, repo=repo)
+            self.assertEqual(fsync.call_count, 2)
+        self.assertTrue(os.path.exists(self.loose_path(sha)))
+        self.assertEqual(self.temp_files(), [])
+
+        # Not without it
+        with patch("os.fsync") as fsync:
+            object_write(GitBlob(b"not synced"), self.repo)
+            self.assertEqual(fsync.call_count, 0)
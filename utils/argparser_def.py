@@ -1,39 +1,329 @@
 import argparse
 
-# Define the argparser for all the implemented functions
-def define_argparser():
-    # Define the arguments used when calling mygit, description is shown when --help
-    argparser = argparse.ArgumentParser(description="Antonio Content tracker")
+# The arguments of each command, added to its subparser by the functions
+# below. Only the subparser of the command being run is built, see
+# define_argparser
 
-    # Extents the argparser by adding subparsers
-    # The commands show
-    argsubparsers = argparser.add_subparsers(title="Commands", dest="command")
-    argsubparsers.required = True   # Makes mandatory to add subparsers
-
-    # Creates a new argparser for the init command
-    argsp = argsubparsers.add_parser("init", help="Initialize a new, empty repository.")
+def _init_args(argsp):
+    # mygit init [directory]
     argsp.add_argument("path",
                        metavar="directory",
                        nargs="?",
                        default=".",
                        help="Where to create the repository.")
 
-    # Subparser for cat file command
+def _cat_file_args(argsp):
     # mygit cat-file TYPE OBJECT
-    argsp = argsubparsers.add_parser("cat-file",
-                                     help="Provide content of repository objects")
+    # mygit cat-file (-t | -s) OBJECT
+    # mygit cat-file (--batch | --batch-check) [--buffer]
+    argsp.add_argument("-t",
+                       dest="show",
+                       action="store_const",
+                       const="type",
+                       help="Show the object type instead of its content")
+
+    argsp.add_argument("-s",
+                       dest="show",
+                       action="store_const",
+                       const="size",
+                       help="Show the object size instead of its content")
+
+    argsp.add_argument("--batch",
+                       dest="batch",
+                       action="store_const",
+                       const="contents",
+                       help="Read object names from stdin, print their header and contents")
+
+    argsp.add_argument("--batch-check",
+                       dest="batch",
+                       action="store_const",
+                       const="check",
+                       help="Read object names from stdin, print their header")
 
+    argsp.add_argument("--buffer",
+                       action="store_true",
+                       help="Don't flush the output after each object in batch mode")
+
+    # With -t/-s only the object is given, so both positionals are
+    # optional here and sorted out by cmd_cat_file
     argsp.add_argument("type",
                        metavar="type",
-                       choices=["blob", "commit", "tag", "tree"],
-                       help="Specify the type")
+                       nargs="?",
+                       help="Specify the type (blob, commit, tag or tree)")
 
     argsp.add_argument("object",
                        metavar="object",
+                       nargs="?",
                        help="The object to display")
 
-    # Subparser for the has-object command
+def _hash_object_args(argsp):
+    # mygit hash-object [-w] [-t TYPE] [--stdin | FILE]
+    argsp.add_argument("-t",
+                       metavar="type",
+                       dest="type",
+                       choices=["blob", "commit", "tag", "tree"],
+                       default="blob",
+                       help="Specify the type")
+
+    argsp.add_argument("-w",
+                       dest="write",
+                       action="store_true",
+                       help="Actually write the object into the database")
+
+    argsp.add_argument("--stdin",
+                       action="store_true",
+                       help="Read the object from standard input instead of a file")
+
+    argsp.add_argument("path",
+                       nargs="?",
+                       help="Read object from <file>")
+
+def _add_args(argsp):
+    # mygit add [-j N] PATH...
+    argsp.add_argument("-j", "--jobs",
+                       type=int,
+                       help="Number of processes hashing files (default: one per CPU)")
+
+    argsp.add_argument("path",
+                       nargs="+",
+                       help="Files to add")
+
+def _checkout_args(argsp):
+    # mygit checkout [-f] [-j N] [--timings] commit
+    argsp.add_argument("-f", "--force",
+                       action="store_true",
+                       help="Throw away local changes to the files checked out")
+
+    argsp.add_argument("-j", "--jobs",
+                       type=int,
+                       help="Number of threads writing files (default: one per CPU)")
+
+    argsp.add_argument("--timings",
+                       action="store_true",
+                       help="Show the time taken by each phase")
+
+    argsp.add_argument("commit",
+                       help="The branch or commit to check out")
+
+def _check_ignore_args(argsp):
+    # mygit check-ignore [--stdin | PATH...]
+    argsp.add_argument("--stdin",
+                       action="store_true",
+                       help="Read paths from standard input, one per line")
+
+    argsp.add_argument("path",
+                       nargs="*",
+                       help="Paths to check")
+
+def _ls_files_args(argsp):
+    # mygit ls-files [-s]
+    argsp.add_argument("-s", "--stage",
+                       action="store_true",
+                       help="Show mode, object name and stage of each file")
+
+def _ls_tree_args(argsp):
+    # mygit ls-tree [-r] tree
+    argsp.add_argument("-r",
+                       dest="recursive",
+                       action="store_true",
+                       help="Recurse into sub-trees")
+
+    argsp.add_argument("tree",
+                       help="A tree-ish object")
+
+def _pack_refs_args(argsp):
+    # mygit pack-refs [--all]
+    argsp.add_argument("--all",
+                       action="store_true",
+                       help="Pack all refs, not just tags and refs already packed")
+
+def _show_ref_args(argsp):
+    # mygit show-ref [--heads] [--tags] [-d] [pattern...]
+    argsp.add_argument("--heads",
+                       action="store_true",
+                       help="Only show branches")
+
+    argsp.add_argument("--tags",
+                       action="store_true",
+                       help="Only show tags")
+
+    argsp.add_argument("-d", "--dereference",
+                       action="store_true",
+                       help="Also show what annotated tags point to")
+
+    argsp.add_argument("pattern",
+                       nargs="*",
+                       help="Only show refs ending with these")
+
+def _tag_args(argsp):
+    # mygit tag [name [object]]
+    argsp.add_argument("name",
+                       nargs="?",
+                       help="The new tag's name")
+
+    argsp.add_argument("object",
+                       default="HEAD",
+                       nargs="?",
+                       help="The object the new tag will point to")
+
+def _status_args(argsp):
+    # mygit status [-s] [-j N]
+    argsp.add_argument("-s", "--short",
+                       action="store_true",
+                       help="Give the output in the short format, as changes are found")
+
+    argsp.add_argument("-j", "--jobs",
+                       type=int,
+                       help="Number of threads scanning the worktree")
+
+def _log_args(argsp):
+    # mygit log [-n N] [--oneline] [commit...]
+    argsp.add_argument("-n", "--max-count",
+                       type=int,
+                       help="Limit the number of commits to output")
+
+    argsp.add_argument("--oneline",
+                       action="store_true",
+                       help="Show each commit on a single line")
+
+    argsp.add_argument("commit",
+                       nargs="*",
+                       default=["HEAD"],
+                       help="Commits to start at")
+
+def _rev_list_args(argsp):
+    # mygit rev-list [--count] [-n N] commit... [^commit...] [A..B]
+    argsp.add_argument("--count",
+                       action="store_true",
+                       help="Print only the number of commits")
+
+    argsp.add_argument("-n", "--max-count",
+                       type=int,
+                       help="Limit the number of commits to output")
+
+    argsp.add_argument("commit",
+                       nargs="+",
+                       help="Commits to include, ^commit to exclude, or A..B")
+
+def _rev_parse_args(argsp):
+    # mygit rev-parse [--type TYPE] [--stdin] name...
+    argsp.add_argument("--type",
+                       metavar="type",
+                       dest="type",
+                       choices=["blob", "commit", "tag", "tree"],
+                       help="Peel the objects to this type")
+
+    argsp.add_argument("--stdin",
+                       action="store_true",
+                       help="Read the names from stdin, one per line")
+
+    argsp.add_argument("name",
+                       nargs="*",
+                       help="The names to parse")
+
+def _merge_base_args(argsp):
+    # mygit merge-base [--all] A B
+    argsp.add_argument("--all",
+                       action="store_true",
+                       help="Output all the best common ancestors, not just one")
+
+    argsp.add_argument("commit",
+                       nargs=2,
+                       help="The two commits")
+
+def _commit_graph_args(argsp):
+    # mygit commit-graph write
+    argsp.add_argument("action",
+                       choices=["write"],
+                       help="Action to do")
+
+def _multi_pack_index_args(argsp):
+    # mygit multi-pack-index write
+    argsp.add_argument("action",
+                       choices=["write"],
+                       help="Action to do")
+
+def _repack_args(argsp):
+    # Shared by repack and gc, gc being repack with the housekeeping defaults
+    # mygit repack [--window N] [--depth N] [-j N]
+    argsp.add_argument("--window",
+                       type=int,
+                       default=10,
+                       help="Number of objects considered as delta base for each object")
+
+    argsp.add_argument("--depth",
+                       type=int,
+                       default=50,
+                       help="Maximum length of a delta chain")
+
+    argsp.add_argument("-j", "--jobs",
+                       type=int,
+                       help="Number of processes searching for deltas (default: one per CPU)")
+
+# Every command, in the order --help lists them: its help and the function
+# adding its arguments
+COMMANDS = {
+    "init":         ("Initialize a new, empty repository.", _init_args),
+    "cat-file":     ("Provide content of repository objects", _cat_file_args),
+    "hash-object":  ("Compute object ID and optionally creates a blob from a file", _hash_object_args),
+    "add":          ("Add files contents to the index", _add_args),
+    "check-ignore": ("Check path(s) against ignore rules", _check_ignore_args),
+    "checkout":     ("Switch branches or restore working tree files", _checkout_args),
+    "ls-files":     ("List all the staged files", _ls_files_args),
+    "ls-tree":      ("Pretty-print a tree object", _ls_tree_args),
+    "pack-refs":    ("Pack refs into packed-refs", _pack_refs_args),
+    "show-ref":     ("List references", _show_ref_args),
+    "tag":          ("List or create tags", _tag_args),
+    "status":       ("Show the working tree status", _status_args),
+    "log":          ("Display history of given commits", _log_args),
+    "rev-list":     ("List commit objects in reverse chronological order", _rev_list_args),
+    "rev-parse":    ("Parse revision (or other objects) identifiers", _rev_parse_args),
+    "merge-base":   ("Find the best common ancestors of two commits", _merge_base_args),
+    "commit-graph": ("Write the commit-graph file", _commit_graph_args),
+    "multi-pack-index": ("Write the multi-pack-index of all the packs", _multi_pack_index_args),
+    "repack":       ("Pack loose objects into a deltified pack", _repack_args),
+    "gc":           ("Cleanup unnecessary files and optimize the local repository", _repack_args),
+}
+
+# mygit's own options taking a value, as a separate argument
+OPTIONS_WITH_VALUE = {"--profile-output"}
+
+def command_of(argv):
+    """The command argv runs, or None if it doesn't name a known one:
+    mygit's own options all come before it."""
+    args = iter(argv)
+    for arg in args:
+        if arg in OPTIONS_WITH_VALUE:
+            next(args, None)
+        elif not arg.startswith("-"):
+            return arg if arg in COMMANDS else None
+    return None
+
+# Define the argparser for all the implemented functions
+def define_argparser(command=None):
+    """With command, only build the subparser of that command: it's all
+    parse_args needs for it. Without, build them all, for --help and the
+    usage errors listing the commands."""
+    # Define the arguments used when calling mygit, description is shown when --help
+    argparser = argparse.ArgumentParser(description="Antonio Content tracker")
+
+    # Tracing of the hot paths, see utils/trace.py
+    argparser.add_argument("--profile",
+                           action="store_true",
+                           help="Print call counts, bytes and latencies of the hot paths as JSON on exit")
+
+    argparser.add_argument("--profile-output",
+                           metavar="file",
+                           help="Also write cProfile stats to file (implies --profile)")
+
+    # Extents the argparser by adding subparsers
+    # The commands show
+    argsubparsers = argparser.add_subparsers(title="Commands", dest="command")
+    argsubparsers.required = True   # Makes mandatory to add subparsers
+
+    for name, (help, add_args) in COMMANDS.items():
+        if command is None or name == command:
+            add_args(argsubparsers.add_parser(name, help=help))
 
     # return the final argparser object
     return argparser
-
@@ -0,0 +1,36 @@
+# Multipliers for the unit suffixes git accepts in size options
+SIZE_UNITS = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+def parse_size(value):
+    """Parse a git size like "512", "96m" or "1g" into a number of bytes."""
+    value = value.strip().lower()
+    if value and value[-1] in SIZE_UNITS:
+        return int(value[:-1]) * SIZE_UNITS[value[-1]]
+    return int(value)
+
+def conf_size(conf, section, option, default):
+    """Read a size option from a configparser, or return default."""
+    value = conf.get(section, option, fallback=None)
+    if value is None:
+        return default
+    try:
+        return parse_size(value)
+    except ValueError:
+        raise Exception(f"Bad size for {section}.{option}: {value}")
+
+def conf_compression(conf, section, option, default=-1):
+    """Read a zlib compression level from section.option, falling back on
+    core.compression and then default. Like git, -1 is zlib's default
+    level, 0 is no compression and 9 the smallest output."""
+    for section, option in [(section, option), ("core", "compression")]:
+        value = conf.get(section, option, fallback=None)
+        if value is None:
+            continue
+        try:
+            level = int(value)
+        except ValueError:
+            level = None
+        if level is None or not -1 <= level <= 9:
+            raise Exception(f"Bad zlib compression level for {section}.{option}: {value}")
+        return level
+    return default
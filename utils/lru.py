@@ -0,0 +1,82 @@
+import threading
+from collections import OrderedDict
+
+
+class ByteLRU(object):
+    """A least recently used cache, bounded by the total size in bytes
+    of its values rather than by their number.
+
+    Sizes are given by the caller on put(), as only it knows how to
+    estimate them. Values bigger than the whole budget are not cached.
+    Hits, misses and evictions are counted so the budget can be tuned."""
+
+    def __init__(self, limit):
+        self._limit = limit
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @limit.setter
+    def limit(self, limit):
+        """Change the budget, evicting entries if it shrinks."""
+        with self._lock:
+            self._limit = limit
+            self._evict()
+
+    def _evict(self):
+        while self.size > self._limit:
+            _, (_, evicted) = self._items.popitem(last=False)
+            self.size -= evicted
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key):
+        """Return the value cached for key, or None."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, size):
+        """Cache value under key, evicting the least recently used
+        entries until everything fits in the budget again."""
+        if size > self.limit:
+            return
+
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._items[key] = (value, size)
+            self.size += size
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def stats(self):
+        """Return the counters of the cache, as a dict."""
+        return {"entries": len(self._items),
+                "bytes": self.size,
+                "limit": self.limit,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions}
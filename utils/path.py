@@ -1,9 +1,12 @@
 import os
 
+from utils.trace import traced
+
 def repo_path(repo, *path):
     """Compute path under repo's gitdir."""
     return os.path.join(repo.gitdir, *path)
 
+@traced("repo_dir")
 def repo_dir(repo, *path, mkdir=False):
     """Same as repo_path, but mkdir *path if absent if mkdir."""
     path_full = repo_path(repo, *path)
@@ -15,13 +18,13 @@ def repo_dir(repo, *path, mkdir=False):
             raise Exception(f"Not a directory {path_full}")
 
     if mkdir:
-        print(f"Creating directory: {path_full}")
-        print("Full path is ",path_full)
-        os.makedirs(path_full)
+        # Another process may be creating it at the same time
+        os.makedirs(path_full, exist_ok=True)
         return path_full
     else:
         return None
 
+@traced("repo_file")
 def repo_file(repo, *path, mkdir=False):
     """Compute path under repo's gitdir, create dirname(*path) if absent."""
     if repo_dir(repo, *path[:-1], mkdir=mkdir):
@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import array
+import atexit
+import functools
+import threading
+
+# Performance tracing of the hot paths: functions decorated with @traced
+# count their calls, time them and add up the bytes they move. It's off
+# unless GIT_TRACE_PERFORMANCE is set (to 1 or true for stderr, or to an
+# absolute path to write to) or mygit is run with --profile; the summary
+# is then written as JSON when the process exits.
+
+ENABLED = False
+
+# Calls by name: their durations (in seconds) and bytes in and out
+_calls = dict()
+# Functions returning more counters for the summary, like cache stats, by name
+_counters = dict()
+_lock = threading.Lock()
+_output = None
+_profiler = None
+_start = None
+
+
+class _Calls(object):
+    __slots__ = ("times", "bytes_in", "bytes_out")
+
+    def __init__(self):
+        self.times = array.array("d")
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+
+def traced(name, bytes_in=None, bytes_out=None):
+    """Decorator counting and timing the calls of a function when tracing
+    is enabled. bytes_in is called with the arguments of a call, and
+    bytes_out with its result, to count the bytes it consumed and produced.
+    When tracing is off, this costs a flag check per call."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            result = fn(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            # Sizes may be costly to get, they're left out of the timing
+            size_in = bytes_in(*args, **kwargs) if bytes_in else 0
+            size_out = bytes_out(result) if bytes_out else 0
+            with _lock:
+                calls = _calls.get(name)
+                if calls is None:
+                    calls = _calls[name] = _Calls()
+                calls.times.append(elapsed)
+                calls.bytes_in += size_in
+                calls.bytes_out += size_out
+            return result
+        return wrapper
+    return decorate
+
+
+def add_counters(name, fn):
+    """Have the summary include the dict fn returns, under name."""
+    _counters[name] = fn
+
+
+def _percentile(times, p):
+    return times[min(len(times) - 1, int(len(times) * p))]
+
+def summary():
+    """The counters so far: calls, total and p50/p99 latencies (in ms)
+    and bytes of each traced function."""
+    functions = {}
+    with _lock:
+        for name, calls in sorted(_calls.items()):
+            times = sorted(calls.times)
+            functions[name] = {
+                "calls": len(times),
+                "total_ms": sum(times) * 1000,
+                "p50_ms": _percentile(times, 0.50) * 1000,
+                "p99_ms": _percentile(times, 0.99) * 1000,
+                "bytes_in": calls.bytes_in,
+                "bytes_out": calls.bytes_out,
+            }
+    return {"argv": sys.argv[1:],
+            "wall_ms": (time.perf_counter() - _start) * 1000 if _start else None,
+            "functions": functions,
+            "counters": {name: fn() for name, fn in sorted(_counters.items())}}
+
+
+def enable(output=None, profile_output=None):
+    """Start tracing, writing the summary at exit to the file output, or
+    stderr. With profile_output, also run cProfile and dump its stats
+    there."""
+    global ENABLED, _output, _profiler, _start
+    if not ENABLED:
+        atexit.register(_report)
+        _start = time.perf_counter()
+    ENABLED = True
+    _output = output or _output
+    if profile_output and _profiler is None:
+        import cProfile
+        _profiler = (cProfile.Profile(), profile_output)
+        _profiler[0].enable()
+
+def _report():
+    import json
+    if _profiler:
+        _profiler[0].disable()
+        _profiler[0].dump_stats(_profiler[1])
+
+    data = json.dumps(summary(), indent=2)
+    if _output:
+        with open(_output, "a") as f:
+            f.write(data + "\n")
+    else:
+        sys.stderr.write(data + "\n")
+
+
+# Like git's GIT_TRACE_* variables: 1 or true for stderr, an absolute
+# path for a file, anything else (0, false) for off
+_env = os.environ.get("GIT_TRACE_PERFORMANCE", "")
+if _env.lower() in ("1", "2", "true", "yes", "on"):
+    enable()
+elif os.path.isabs(_env):
+    enable(output=_env)